@@ -0,0 +1,97 @@
+"""CA chain cache and local bundle building shared by the cert backends"""
+
+from typing import Optional, List
+import abc
+import asyncio
+import logging
+import time
+from pathlib import Path
+from dataclasses import dataclass, field
+
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import Encoding
+
+from ..rmsettings import RMSettings
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class CAChainCache(abc.ABC):
+    """Cache the CA chain PEM
+
+    Reloaded after ttl seconds or when the watched file (or any file in the watched directory)
+    changes, subclasses implement load() and watch_path().
+    """
+
+    ttl: float = field(default_factory=lambda: RMSettings.singleton().ca_cache_ttl)
+    pem: Optional[str] = field(default=None)
+    fetched: float = field(default=0.0)
+    mtime: Optional[int] = field(default=None)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    @abc.abstractmethod
+    async def load(self) -> str:
+        """Fetch the chain from the source"""
+
+    def watch_path(self) -> Optional[Path]:
+        """File or directory whose changes invalidate the cache"""
+        return None
+
+    def current_mtime(self) -> Optional[int]:
+        """Newest mtime of the watched path"""
+        path = self.watch_path()
+        if path is None:
+            return None
+        try:
+            if path.is_dir():
+                return max((sub.stat().st_mtime_ns for sub in path.iterdir()), default=path.stat().st_mtime_ns)
+            return path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def fresh(self, mtime: Optional[int]) -> bool:
+        """Is the cached value still usable"""
+        return self.pem is not None and time.monotonic() - self.fetched < self.ttl and mtime == self.mtime
+
+    async def get(self) -> str:
+        """Return the cached chain, loading it if needed"""
+        mtime = self.current_mtime()
+        if self.fresh(mtime):
+            assert self.pem is not None  # nosec B101
+            return self.pem
+        async with self._lock:
+            # Someone else may have loaded it while we waited
+            if self.fresh(mtime):
+                assert self.pem is not None  # nosec B101
+                return self.pem
+            LOGGER.debug("Loading CA chain")
+            pem = await self.load()
+            self.pem, self.fetched, self.mtime = pem, time.monotonic(), mtime
+            return pem
+
+    def invalidate(self) -> None:
+        """Reload on next get"""
+        self.pem = None
+
+
+def build_bundle(certpem: str, chainpem: str) -> Optional[str]:
+    """Leaf cert followed by its intermediates from the chain (the self-signed root is left out)
+
+    certpem may already contain the chain (ie. bundle from sign_csr), only its first cert is used.
+    Returns None if the cert's issuer is not in the chain or the PEMs can't be parsed.
+    """
+    try:
+        cert = x509.load_pem_x509_certificates(certpem.encode("utf-8"))[0]
+        bysubject = {ca.subject: ca for ca in x509.load_pem_x509_certificates(chainpem.encode("utf-8"))}
+    except ValueError as exc:
+        LOGGER.warning("Could not parse certs for bundle: {}".format(exc))
+        return None
+    intermediates: List[x509.Certificate] = []
+    issuer = bysubject.get(cert.issuer)
+    if issuer is None:
+        return None
+    while issuer is not None and issuer.subject != issuer.issuer and issuer not in intermediates:
+        intermediates.append(issuer)
+        issuer = bysubject.get(issuer.issuer)
+    return "".join(crt.public_bytes(Encoding.PEM).decode("utf-8") for crt in [cert] + intermediates)
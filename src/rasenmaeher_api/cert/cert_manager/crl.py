@@ -0,0 +1,165 @@
+"""Locally signed CRL for the cert-manager backend
+
+cert-manager does not publish CRLs, so we build one from the revoked people in the DB and sign it
+with the configured CRL signing key. The signed CRL is kept in memory and re-signed only when the set
+of revocations changes or it's past half of its validity.
+"""
+
+from typing import ClassVar, Optional, List, Tuple, TYPE_CHECKING
+import asyncio
+import datetime
+import hashlib
+import logging
+from pathlib import Path
+from dataclasses import dataclass, field
+
+import cryptography.x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed25519, ed448, rsa
+
+from ...rmsettings import RMSettings
+from .base import CertManagerError
+
+if TYPE_CHECKING:
+    from ...db.certserials import RevokedSerial
+
+LOGGER = logging.getLogger(__name__)
+SIGNING_KEY_TYPES = (
+    rsa.RSAPrivateKey,
+    ec.EllipticCurvePrivateKey,
+    dsa.DSAPrivateKey,
+    ed25519.Ed25519PrivateKey,
+    ed448.Ed448PrivateKey,
+)
+
+
+def revocations_fingerprint(revoked: List["RevokedSerial"]) -> str:
+    """Hash of the revocations, the CRL needs re-signing when this changes"""
+    digest = hashlib.sha256()
+    for entry in revoked:
+        digest.update(f"{entry.serial}|{entry.issuer}|{entry.revoked.isoformat()}|{entry.reason}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _reason_flag(reason: Optional[str]) -> Optional[cryptography.x509.ReasonFlags]:
+    """Map Person.revoke_reason to the flag, unspecified is left out of the CRL as RFC5280 recommends"""
+    if not reason:
+        return None
+    try:
+        flag = cryptography.x509.ReasonFlags(reason)
+    except ValueError:
+        LOGGER.warning("Unknown revoke reason {}".format(reason))
+        return None
+    if flag == cryptography.x509.ReasonFlags.unspecified:
+        return None
+    return flag
+
+
+def sign_crl(
+    keypath: Path, certpath: Path, revoked: List["RevokedSerial"], validity: datetime.timedelta
+) -> Tuple[bytes, datetime.datetime]:
+    """Build and sign the CRL, returns DER and the signing time. Entries from other issuers are skipped."""
+    try:
+        key = serialization.load_pem_private_key(keypath.read_bytes(), password=None)
+        issuer_cert = cryptography.x509.load_pem_x509_certificate(certpath.read_bytes())
+    except (OSError, ValueError, TypeError) as exc:
+        raise CertManagerError(f"Could not load CRL signing key or cert: {exc}") from exc
+    if not isinstance(key, SIGNING_KEY_TYPES):
+        raise CertManagerError(f"CRL signing key type {type(key).__name__} can't sign CRLs")
+    issuer = issuer_cert.subject
+    issuer_dn = issuer.rfc4514_string()
+    try:
+        ski = issuer_cert.extensions.get_extension_for_class(cryptography.x509.SubjectKeyIdentifier).value
+        aki = cryptography.x509.AuthorityKeyIdentifier.from_issuer_subject_key_identifier(ski)
+    except cryptography.x509.ExtensionNotFound:
+        aki = cryptography.x509.AuthorityKeyIdentifier.from_issuer_public_key(key.public_key())
+    now = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
+    builder = (
+        cryptography.x509.CertificateRevocationListBuilder()
+        .issuer_name(issuer)
+        .last_update(now)
+        .next_update(now + validity)
+        # Monotonic enough across workers and restarts
+        .add_extension(cryptography.x509.CRLNumber(int(now.timestamp())), critical=False)
+        .add_extension(aki, critical=False)
+    )
+    for entry in revoked:
+        if entry.issuer != issuer_dn:
+            continue
+        revoked_builder = (
+            cryptography.x509.RevokedCertificateBuilder()
+            .serial_number(int(entry.serial, 16))
+            .revocation_date(entry.revoked)
+        )
+        flag = _reason_flag(entry.reason)
+        if flag is not None:
+            revoked_builder = revoked_builder.add_extension(cryptography.x509.CRLReason(flag), critical=False)
+        builder = builder.add_revoked_certificate(revoked_builder.build())
+    algorithm = None if isinstance(key, (ed25519.Ed25519PrivateKey, ed448.Ed448PrivateKey)) else hashes.SHA256()
+    crl = builder.sign(private_key=key, algorithm=algorithm)
+    return crl.public_bytes(serialization.Encoding.DER), now
+
+
+@dataclass
+class LocalCRL:
+    """The signed CRL, re-signed when needed"""
+
+    validity: float = field(default_factory=lambda: RMSettings.singleton().cert_manager_crl_validity)
+    fingerprint: Optional[str] = field(default=None)
+    der: bytes = field(default=b"")
+    pem: bytes = field(default=b"")
+    signed: Optional[datetime.datetime] = field(default=None)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    _singleton: ClassVar[Optional["LocalCRL"]] = None
+
+    @classmethod
+    def singleton(cls) -> "LocalCRL":
+        """Return singleton"""
+        if not LocalCRL._singleton:
+            LocalCRL._singleton = LocalCRL()
+        return LocalCRL._singleton
+
+    @staticmethod
+    def paths() -> Optional[Tuple[Path, Path]]:
+        """Signing key and cert paths, None if not configured"""
+        settings = RMSettings.singleton()
+        if not settings.cert_manager_crl_key_path or not settings.cert_manager_crl_cert_path:
+            return None
+        return Path(settings.cert_manager_crl_key_path), Path(settings.cert_manager_crl_cert_path)
+
+    def needs_signing(self, fingerprint: str) -> bool:
+        """Revocations changed or the CRL is past half of its validity"""
+        if self.signed is None or fingerprint != self.fingerprint:
+            return True
+        age = (datetime.datetime.now(datetime.UTC) - self.signed).total_seconds()
+        return age >= self.validity / 2
+
+    async def get(self, suffix: str) -> bytes:
+        """DER or PEM (if suffix ends with .pem) CRL, empty if signing is not configured"""
+        paths = self.paths()
+        if paths is None:
+            LOGGER.debug("CRL signing key not configured under cert-manager backend; empty response")
+            return b""
+        # Lazy import to avoid circular imports, the db models need the cert backend
+        from ...db.certserials import revoked_serials  # pylint: disable=import-outside-toplevel
+
+        async with self._lock:
+            revoked = await revoked_serials()
+            fingerprint = revocations_fingerprint(revoked)
+            if self.needs_signing(fingerprint):
+                keypath, certpath = paths
+                LOGGER.info("Signing CRL with {} revocations".format(len(revoked)))
+                der, signed = await asyncio.to_thread(
+                    sign_crl, keypath, certpath, revoked, datetime.timedelta(seconds=self.validity)
+                )
+                crl = cryptography.x509.load_der_x509_crl(der)
+                self.der, self.pem = der, crl.public_bytes(serialization.Encoding.PEM)
+                self.signed, self.fingerprint = signed, fingerprint
+        if suffix.endswith(".pem"):
+            return self.pem
+        return self.der
+
+    def invalidate(self) -> None:
+        """Re-sign on next get"""
+        self.signed = None
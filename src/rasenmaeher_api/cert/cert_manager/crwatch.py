@@ -0,0 +1,152 @@
+"""Shared watch on the CertificateRequests we create
+
+Instead of every signing opening its own watch, one long-lived watch on the namespace dispatches the
+issued certificates (or failures) to the futures waiting for them by CR name.
+"""
+
+from typing import ClassVar, Optional, Dict, List
+import asyncio
+import logging
+import random
+from dataclasses import dataclass, field
+
+from cloudcoil.models.cert_manager.v1 import CertificateRequest
+from libadvian.tasks import TaskMaster
+
+from ...rmsettings import RMSettings
+from .base import CertManagerError
+
+LOGGER = logging.getLogger(__name__)
+WATCHER_TASK_NAME = "certificaterequest_watcher"
+
+
+def issued_certificate(certificate_request: CertificateRequest) -> Optional[str]:
+    """The certificate if issued, None if still pending, raises CertManagerError if it failed"""
+    status = certificate_request.status
+    if status is None:
+        return None
+    if status.certificate:
+        return status.certificate
+    for condition in status.conditions or []:
+        failed = condition.type in ("Denied", "InvalidRequest") and condition.status == "True"
+        failed = failed or (
+            condition.type == "Ready" and condition.status == "False" and condition.reason in ("Failed", "Denied")
+        )
+        if failed:
+            raise CertManagerError(
+                f"CertificateRequest {certificate_request.name} failed: {condition.reason}: {condition.message}"
+            )
+    return None
+
+
+@dataclass
+class CertificateRequestWatcher:
+    """One watch on CertificateRequests in cert_manager_namespace for all signings in flight
+
+    Register with expect() before creating the CR so no update is missed. The watch starts without a
+    resourceVersion so on (re)connect the API server lists the existing CRs as ADDED events, that
+    covers anything that completed while we were not watching.
+    """
+
+    namespace: str = field(default_factory=lambda: RMSettings.singleton().cert_manager_namespace)
+    retry_base: float = field(default=0.5)
+    retry_max: float = field(default=10.0)
+    # Watch streams opened, for monitoring
+    watches: int = field(default=0)
+    _waiters: Dict[str, List["asyncio.Future[str]"]] = field(default_factory=dict, repr=False)
+
+    _singleton: ClassVar[Optional["CertificateRequestWatcher"]] = None
+
+    @classmethod
+    def singleton(cls) -> "CertificateRequestWatcher":
+        """Return singleton"""
+        if not CertificateRequestWatcher._singleton:
+            CertificateRequestWatcher._singleton = CertificateRequestWatcher()
+        return CertificateRequestWatcher._singleton
+
+    def expect(self, name: str) -> "asyncio.Future[str]":
+        """Future for the certificate of the named CR, starts the watch if needed"""
+        self.start()
+        future: "asyncio.Future[str]" = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(name, []).append(future)
+        return future
+
+    def discard(self, name: str, future: "asyncio.Future[str]") -> None:
+        """Stop waiting"""
+        waiters = self._waiters.get(name, [])
+        if future in waiters:
+            waiters.remove(future)
+        if not waiters:
+            self._waiters.pop(name, None)
+
+    async def wait(self, name: str, future: "asyncio.Future[str]", timeout: float) -> str:
+        """Wait for the future from expect(), raises CertManagerError on timeout"""
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except (TimeoutError, asyncio.TimeoutError) as exc:
+            raise CertManagerError(
+                f"CertificateRequest {self.namespace}/{name} did not issue a certificate within {timeout}s"
+            ) from exc
+        finally:
+            self.discard(name, future)
+
+    def dispatch(self, event: str, certificate_request: CertificateRequest) -> None:
+        """Resolve the futures waiting for this CR if it's done"""
+        name = certificate_request.name
+        if not name or name not in self._waiters:
+            return
+        outcome: Optional[BaseException] = None
+        certificate: Optional[str] = None
+        if event == "DELETED":
+            outcome = CertManagerError(f"CertificateRequest {self.namespace}/{name} was deleted before it was issued")
+        else:
+            try:
+                certificate = issued_certificate(certificate_request)
+            except CertManagerError as exc:
+                outcome = exc
+            if certificate is None and outcome is None:
+                return
+        for future in self._waiters.pop(name):
+            if future.done():
+                continue
+            if outcome is not None:
+                future.set_exception(outcome)
+            else:
+                assert certificate is not None  # nosec B101
+                future.set_result(certificate)
+
+    async def run(self) -> None:
+        """Watch until cancelled, reconnecting on errors"""
+        failures = 0
+        while True:
+            try:
+                self.watches += 1
+                LOGGER.debug("Starting CertificateRequest watch in {}".format(self.namespace))
+                async for event, obj in await CertificateRequest.async_watch(namespace=self.namespace):
+                    failures = 0
+                    if event == "BOOKMARK" or not isinstance(obj, CertificateRequest):
+                        continue
+                    self.dispatch(event, obj)
+                LOGGER.warning("CertificateRequest watch ended, restarting")
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("CertificateRequest watch failed")
+                failures += 1
+            delay = min(self.retry_base * 2.0 ** max(failures - 1, 0), self.retry_max)
+            await asyncio.sleep(delay / 2 + random.random() * delay / 2)  # nosec B311
+
+    def start(self) -> None:
+        """Start the watch task"""
+        tma = TaskMaster.singleton()
+        if tma.exists(WATCHER_TASK_NAME):
+            return
+        tma.create_task(self.run(), name=WATCHER_TASK_NAME)
+
+    async def stop(self) -> None:
+        """Stop the watch task"""
+        tma = TaskMaster.singleton()
+        if not tma.exists(WATCHER_TASK_NAME):
+            return
+        try:
+            await tma.stop_named_task_graceful(WATCHER_TASK_NAME)
+        except asyncio.CancelledError:
+            pass
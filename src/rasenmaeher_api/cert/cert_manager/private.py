@@ -1,10 +1,11 @@
 """Private APIs for cert-manager backend.
 
 The signing flow creates a cert-manager ``CertificateRequest`` CR carrying the
-caller-provided CSR, waits until cert-manager issues the certificate, and returns
-the issued certificate as PEM. Revocation is DB-driven (consumed by the
-Traefik callsign-validity plugin), so the revoke functions only best-effort
-clean up the CR.
+caller-provided CSR, waits until cert-manager issues the certificate (via the
+shared watch in crwatch.py), and returns the issued certificate as PEM.
+Revocation is DB-driven (consumed by the Traefik callsign-validity plugin and
+the locally signed CRL), so the revoke functions only best-effort clean up the
+CR and get the CRL re-signed.
 """
 
 import hashlib
@@ -13,7 +14,7 @@ from pathlib import Path
 import base64
 import logging
 
-from cloudcoil.errors import ResourceConflict, APIError, ResourceNotFound, WaitTimeout
+from cloudcoil.errors import ResourceConflict, APIError, ResourceNotFound
 from cloudcoil.models.cert_manager.v1 import CertificateRequest
 import cryptography.x509
 from cryptography.hazmat.primitives import serialization
@@ -23,6 +24,9 @@ from ...rmsettings import RMSettings
 from .base import CertManagerError
 from .names import cr_name
 from .public import get_ca
+from .crl import LocalCRL
+from .crwatch import CertificateRequestWatcher
+from ..crlcache import CRLCache
 
 LOGGER = logging.getLogger(__name__)
 
@@ -195,25 +199,16 @@ async def sign_csr(csr: str, bundle: bool = True) -> str:
     namespace = settings.cert_manager_namespace
     csr_b64 = _csr_pem_to_b64(csr)
 
-    certificate_request = await _upsert_cr(name, namespace, csr, csr_b64, settings)
-
+    # Register before creating so the shared watch can't miss the update
+    watcher = CertificateRequestWatcher.singleton()
+    issued = watcher.expect(name)
     try:
-        await certificate_request.async_wait_for(
-            lambda _, cr: (req := cast(CertificateRequest, cr)).status is not None
-            and req.status.certificate is not None,
-            timeout=settings.cert_manager_timeout,
-        )
-    except WaitTimeout as exc:
-        raise CertManagerError(
-            f"CertificateRequest {namespace}/{name} did not issue a certificate within {settings.cert_manager_timeout}s"
-        ) from exc
-
-    if certificate_request.status is None:
-        raise RuntimeError("certificate request has no status")
-    if certificate_request.status.certificate is None:
-        raise RuntimeError("certificate request status has no certificate")
-
-    cert_pem: str = certificate_request.status.certificate
+        certificate_request = await _upsert_cr(name, namespace, csr, csr_b64, settings)
+        # An existing CR may already be done
+        watcher.dispatch("ADDED", certificate_request)
+        cert_pem = await watcher.wait(name, issued, settings.cert_manager_timeout)
+    finally:
+        watcher.discard(name, issued)
 
     if bundle:
         ca_pem = await get_ca()
@@ -252,6 +247,8 @@ async def revoke_pem(pem: Union[str, Path], reason: ReasonTypes) -> None:
     LOGGER.debug(
         "revoke_pem called under cert-manager backend; no-op aside from DB-driven revocation",
     )
+    LocalCRL.singleton().invalidate()
+    CRLCache.singleton().schedule_refresh()
 
 
 async def revoke_serial(serialno: str, authority_key_id: str, reason: ReasonTypes) -> None:
@@ -1,17 +1,23 @@
 """Public surface for cert-manager backend - CA cert, CRL etc.
 
 The CA bundle is read from a path mounted into the rmapi pod (the same
-``opendefense-bundle`` ConfigMap that already feeds mTLS trust). CRLs are
-not produced under cert-manager — revocation is consumed by the Traefik
-plugin via websocket — so the CRL helpers return an empty placeholder.
+``opendefense-bundle`` ConfigMap that already feeds mTLS trust). cert-manager
+does not produce CRLs, the Traefik plugin consumes revocations via websocket.
+For other relying parties the CRL is built from the DB and signed locally
+(see crl.py) if a CRL signing key is configured, otherwise the CRL helpers
+return an empty placeholder.
 """
 
+from typing import ClassVar, Optional
 import asyncio
 import logging
 from pathlib import Path
+from dataclasses import dataclass
 
 from ...rmsettings import RMSettings
+from ..cachain import CAChainCache
 from .base import CertManagerError
+from .crl import LocalCRL
 
 
 LOGGER = logging.getLogger(__name__)
@@ -21,8 +27,35 @@ def _read_ca_sync(path: str) -> str:
     return Path(path).read_text(encoding="utf-8")
 
 
+@dataclass
+class CertManagerCAChain(CAChainCache):
+    """CA bundle from the mounted ConfigMap, reloaded when the file changes"""
+
+    _singleton: ClassVar[Optional["CertManagerCAChain"]] = None
+
+    @classmethod
+    def singleton(cls) -> "CertManagerCAChain":
+        """Return singleton"""
+        if not CertManagerCAChain._singleton:
+            CertManagerCAChain._singleton = CertManagerCAChain()
+        return CertManagerCAChain._singleton
+
+    async def load(self) -> str:
+        """Read the file"""
+        return await read_ca()
+
+    def watch_path(self) -> Optional[Path]:
+        """The mounted bundle"""
+        return Path(RMSettings.singleton().cert_manager_ca_bundle_path)
+
+
 async def get_ca() -> str:
-    """Return the CA bundle PEM from the mounted ConfigMap file."""
+    """Return the CA bundle PEM from the mounted ConfigMap file, cached."""
+    return await CertManagerCAChain.singleton().get()
+
+
+async def read_ca() -> str:
+    """Read the CA bundle PEM from the mounted ConfigMap file."""
     settings = RMSettings.singleton()
     path = settings.cert_manager_ca_bundle_path
     try:
@@ -34,15 +67,13 @@ async def get_ca() -> str:
 
 
 async def get_ocsprest_crl(suffix: str) -> bytes:
-    """No CRL under cert-manager. Returns an empty byte string."""
-    LOGGER.debug("get_ocsprest_crl called under cert-manager backend (suffix=%s); empty response", suffix)
-    return b""
+    """Locally signed CRL, PEM if suffix ends with .pem. Empty if no CRL signing key is configured."""
+    return await LocalCRL.singleton().get(suffix)
 
 
 async def get_crl() -> bytes:
-    """No CRL under cert-manager. Returns an empty byte string."""
-    LOGGER.debug("get_crl called under cert-manager backend; empty response")
-    return b""
+    """Locally signed DER CRL. Empty if no CRL signing key is configured."""
+    return await LocalCRL.singleton().get("crl.der")
 
 
 async def get_bundle(cert: str) -> str:
@@ -0,0 +1,101 @@
+"""Coalescing scheduler for the ocsprest refresh calls"""
+
+from typing import ClassVar, Optional
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from libadvian.tasks import TaskMaster
+
+from ...rmsettings import RMSettings
+from ..errors import CertError
+from .base import ocsprest_base
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class OCSPRefresher:
+    """Run ocsprest refreshes so that concurrent and closely spaced requests share one call
+
+    Every request() gets a generation number, a refresh started after the request covers it.
+    Refreshes run one at a time and start at most once per window seconds, requests made while
+    one is running or waiting for the window are all covered by the next one.
+    """
+
+    window: float = field(default_factory=lambda: RMSettings.singleton().ocsp_refresh_window)
+    requested: int = field(default=0)
+    # Highest generation covered by a finished refresh attempt, and by a successful one
+    attempted: int = field(default=0)
+    completed: int = field(default=0)
+    last_started: Optional[float] = field(default=None)
+    last_error: Optional[BaseException] = field(default=None)
+    _task: Optional["asyncio.Task[None]"] = field(default=None, repr=False)
+    _cond: asyncio.Condition = field(default_factory=asyncio.Condition, repr=False)
+
+    _singleton: ClassVar[Optional["OCSPRefresher"]] = None
+
+    @classmethod
+    def singleton(cls) -> "OCSPRefresher":
+        """Return singleton"""
+        if not OCSPRefresher._singleton:
+            OCSPRefresher._singleton = OCSPRefresher()
+        return OCSPRefresher._singleton
+
+    def request(self) -> int:
+        """Ask for a refresh without waiting for it, returns the generation to pass to wait()"""
+        self.requested += 1
+        if self._task is None or self._task.done():
+            self._task = TaskMaster.singleton().create_task(self._run())
+        return self.requested
+
+    async def wait(self, generation: int) -> None:
+        """Wait until a refresh covering the generation has finished, raises CertError if it failed"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.attempted >= generation)
+        if self.completed < generation:
+            raise CertError("OCSP refresh failed: {}".format(self.last_error)) from self.last_error
+
+    async def refresh(self) -> int:
+        """Request and wait"""
+        generation = self.request()
+        await self.wait(generation)
+        return generation
+
+    async def _run(self) -> None:
+        """Refresh until all requests are covered"""
+        try:
+            while self.requested > self.attempted:
+                if self.last_started is not None:
+                    delay = self.last_started + self.window - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                target = self.requested
+                self.last_started = time.monotonic()
+                try:
+                    await self._refresh()
+                    self.completed = target
+                except Exception as exc:  # pylint: disable=broad-except
+                    LOGGER.error("OCSP refresh failed: {}".format(exc))
+                    self.last_error = exc
+                await self._finish(target)
+        except asyncio.CancelledError as exc:
+            # Do not leave waiters hanging on shutdown
+            self.last_error = exc
+            await asyncio.shield(self._finish(self.requested))
+            raise
+
+    async def _finish(self, target: int) -> None:
+        """Mark attempt done and wake up the waiters"""
+        async with self._cond:
+            self.attempted = max(self.attempted, target)
+            self._cond.notify_all()
+
+    async def _refresh(self) -> None:
+        """The actual call"""
+        # Lazy import, private needs to import us
+        from .private import post_ocsprest  # pylint: disable=import-outside-toplevel
+
+        LOGGER.debug("Refreshing OCSP, generation {}".format(self.requested))
+        await post_ocsprest(f"{ocsprest_base()}/api/v1/refresh")
@@ -1,17 +1,18 @@
 """Private apis"""
 
 from typing import Union, Optional, Any, Dict
-import asyncio
 import logging
 import binascii
 from pathlib import Path
 
 import aiohttp
 import cryptography.x509
-from libadvian.tasks import TaskMaster
 
-from .base import base_url, get_result_cert, CFSSLError, get_result, NoResult, ocsprest_base, DBLocked, default_timeout
+from .base import base_url, get_result_cert, CFSSLError, get_result, NoResult, ocsprest_base, default_timeout
 from .mtls import mtls_session
+from .ocsprefresh import OCSPRefresher
+from .signqueue import SignQueue
+from ..crlcache import CRLCache
 from ...rmsettings import RMSettings
 
 LOGGER = logging.getLogger(__name__)
@@ -44,8 +45,8 @@ async def dump_crlfiles() -> None:
 
 
 async def refresh_ocsp() -> None:
-    """Call ocsprest refresh"""
-    await post_ocsprest(f"{ocsprest_base()}/api/v1/refresh")
+    """Call ocsprest refresh, concurrent and closely spaced calls share one refresh (see OCSPRefresher)"""
+    await OCSPRefresher.singleton().refresh()
 
 
 async def sign_csr(csr: str, bundle: bool = True) -> str:
@@ -54,19 +55,20 @@ async def sign_csr(csr: str, bundle: bool = True) -> str:
     params: csr, whether to return cert of full bundle
     returns: certificate as PEM
     """
+    resp = await SignQueue.singleton().call("sign_csr", lambda: _sign_csr(csr, bundle))
+    OCSPRefresher.singleton().request()
+    return resp
+
+
+async def _sign_csr(csr: str, bundle: bool) -> str:
+    """One signing attempt"""
     async with await mtls_session() as session:
         url = f"{ocsprest_base()}/api/v1/csr/sign"
         payload = {"certificate_request": csr, "profile": "client", "bundle": bundle}
         try:
             LOGGER.debug("Calling {}".format(url))
             async with session.post(url, json=payload, timeout=default_timeout()) as response:
-                resp = await get_result_cert(response)
-                TaskMaster.singleton().create_task(refresh_ocsp())
-                return resp
-        except DBLocked:
-            LOGGER.warning("Database is locked, waiting a moment and trying again")
-            await asyncio.sleep(0.1)
-            return await sign_csr(csr, bundle)
+                return await get_result_cert(response)
         except aiohttp.ClientError as exc:
             raise CFSSLError(str(exc)) from exc
 
@@ -129,13 +131,19 @@ async def revoke_serial(serialno: str, authority_key_id: str, reason: ReasonType
     Reason must be one of the enumerations of cryptography.x509.ReasonFlags or it's string values (see REASONS_BY_VALUE)
     """
     reason = validate_reason(reason)
+    payload = {
+        "serial": serialno,
+        "authority_key_id": authority_key_id,
+        "reason": str(reason.value).replace("_", ""),
+    }
+    await SignQueue.singleton().call("revoke_serial", lambda: _revoke_serial(payload))
+    CRLCache.singleton().schedule_refresh()
+
+
+async def _revoke_serial(payload: Dict[str, Any]) -> None:
+    """One revocation attempt"""
     async with await mtls_session() as session:
         url = f"{base_url()}/api/v1/cfssl/revoke"
-        payload = {
-            "serial": serialno,
-            "authority_key_id": authority_key_id,
-            "reason": str(reason.value).replace("_", ""),
-        }
         try:
             async with session.post(url, json=payload, timeout=default_timeout()) as response:
                 try:
@@ -143,10 +151,6 @@ async def revoke_serial(serialno: str, authority_key_id: str, reason: ReasonType
                 except NoResult:
                     # The result is expected to be empty
                     pass
-        except DBLocked:
-            LOGGER.warning("Database is locked, waiting a moment and trying again")
-            await asyncio.sleep(0.1)
-            return await revoke_serial(serialno, authority_key_id, reason)
         except aiohttp.ClientError as exc:
             raise CFSSLError(str(exc)) from exc
 
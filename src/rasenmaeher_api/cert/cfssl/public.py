@@ -1,8 +1,11 @@
 """Public things, CA cert, CRL etc"""
 
-from typing import Dict, Any
+from typing import Dict, Any, ClassVar, Optional
 import logging
 import base64
+import os
+from pathlib import Path
+from dataclasses import dataclass
 
 import aiohttp
 
@@ -17,12 +20,46 @@ from .base import (
     default_timeout,
 )
 from .private import refresh_ocsp
+from ..cachain import CAChainCache, build_bundle
 
 LOGGER = logging.getLogger(__name__)
 CRL_LIFETIME = "1800s"  # seconds
 
 
+@dataclass
+class CFSSLCAChain(CAChainCache):
+    """CA chain from CFSSL, invalidated when the shared CA certs directory changes"""
+
+    _singleton: ClassVar[Optional["CFSSLCAChain"]] = None
+
+    @classmethod
+    def singleton(cls) -> "CFSSLCAChain":
+        """Return singleton"""
+        if not CFSSLCAChain._singleton:
+            CFSSLCAChain._singleton = CFSSLCAChain()
+        return CFSSLCAChain._singleton
+
+    async def load(self) -> str:
+        """Ask CFSSL"""
+        return await fetch_ca()
+
+    def watch_path(self) -> Optional[Path]:
+        """The directory libpvarki reads the CA certs from"""
+        capath = os.environ.get("LOCAL_CA_CERTS_PATH")
+        if not capath:
+            return None
+        return Path(capath)
+
+
 async def get_ca() -> str:
+    """
+    Get CA from CFSSL, cached
+    returns: CA certificate
+    """
+    return await CFSSLCAChain.singleton().get()
+
+
+async def fetch_ca() -> str:
     """
     Quick and dirty method to get CA from CFSSL
     returns: CA certificate
@@ -72,7 +109,18 @@ async def get_crl() -> bytes:
 
 async def get_bundle(cert: str) -> str:
     """
-    Get the optimal cert bundle for given cert
+    Get the optimal cert bundle for given cert, built from the cached CA chain if it has the issuer
+    """
+    bundle = build_bundle(cert, await get_ca())
+    if bundle is not None:
+        return bundle
+    LOGGER.info("Issuer not in the CA chain, asking CFSSL for the bundle")
+    return await fetch_bundle(cert)
+
+
+async def fetch_bundle(cert: str) -> str:
+    """
+    Get the optimal cert bundle for given cert from CFSSL
     """
 
     # FIXME: This is not a good way but I don't have a better one right now either
@@ -0,0 +1,100 @@
+"""Bounded work queue for the CFSSL calls that write to its database"""
+
+from typing import ClassVar, Optional, Callable, Awaitable, TypeVar
+import asyncio
+import logging
+import random
+from dataclasses import dataclass, field
+
+from ...rmsettings import RMSettings
+from ..errors import DBLocked
+
+LOGGER = logging.getLogger(__name__)
+T = TypeVar("T")  # pylint: disable=invalid-name
+
+
+@dataclass
+class SignQueue:
+    """Run signing and revocation calls at most concurrency at a time
+
+    CFSSL keeps its cert DB in SQLite which reports itself locked under concurrent writes, calls that
+    fail with DBLocked are retried after capped exponential backoff with jitter (without holding a slot)
+    until max_attempts. The counters are exposed for monitoring.
+    """
+
+    concurrency: int = field(default_factory=lambda: RMSettings.singleton().cfssl_concurrency)
+    retry_base: float = field(default_factory=lambda: RMSettings.singleton().cfssl_retry_base)
+    retry_max: float = field(default_factory=lambda: RMSettings.singleton().cfssl_retry_max)
+    max_attempts: int = field(default_factory=lambda: RMSettings.singleton().cfssl_max_attempts)
+    # Waiting for a slot, in a call, sleeping before a retry
+    waiting: int = field(default=0)
+    running: int = field(default=0)
+    backing_off: int = field(default=0)
+    # Highest waiting seen
+    max_waiting: int = field(default=0)
+    completed: int = field(default=0)
+    retries: int = field(default=0)
+    failed: int = field(default=0)
+    _slots: Optional[asyncio.Semaphore] = field(default=None, repr=False)
+
+    _singleton: ClassVar[Optional["SignQueue"]] = None
+
+    @classmethod
+    def singleton(cls) -> "SignQueue":
+        """Return singleton"""
+        if not SignQueue._singleton:
+            SignQueue._singleton = SignQueue()
+        return SignQueue._singleton
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        """Limit concurrency"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._slots
+
+    @property
+    def depth(self) -> int:
+        """Calls not finished yet"""
+        return self.waiting + self.running + self.backing_off
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before the next attempt"""
+        delay = min(self.retry_base * 2.0 ** max(attempts - 1, 0), self.retry_max)
+        return delay / 2 + random.random() * delay / 2  # nosec B311
+
+    async def call(self, name: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """Run factory() in a slot, retrying on DBLocked"""
+        attempts = 0
+        while True:
+            attempts += 1
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            self.running += 1
+            try:
+                result = await factory()
+                self.completed += 1
+                return result
+            except DBLocked:
+                if attempts >= self.max_attempts:
+                    LOGGER.error("{}: database still locked after {} attempts, giving up".format(name, attempts))
+                    self.failed += 1
+                    raise
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.running -= 1
+                self.slots.release()
+            delay = self.backoff(attempts)
+            LOGGER.warning("{}: database is locked, retrying in {:.2f}s (attempt {})".format(name, delay, attempts))
+            self.retries += 1
+            self.backing_off += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.backing_off -= 1
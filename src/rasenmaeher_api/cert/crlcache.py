@@ -0,0 +1,197 @@
+"""In-memory cache of the CRLs served by the /utils/crl endpoints"""
+
+from typing import ClassVar, Optional, Dict, Any, TYPE_CHECKING
+import asyncio
+import datetime
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+
+import cryptography.x509
+from libadvian.tasks import TaskMaster
+
+from ..rmsettings import RMSettings, CertBackend
+
+if TYPE_CHECKING:
+    from ..db.changes import ChangeEvent
+
+LOGGER = logging.getLogger(__name__)
+REFRESHER_TASK_NAME = "crl_cache_refresher"
+CRL_SUFFIXES = ("crl.der", "crl.pem")
+
+
+@dataclass
+class CachedCRL:
+    """One CRL and the metadata for conditional requests"""
+
+    content: bytes
+    etag: str
+    last_modified: datetime.datetime
+    next_update: Optional[datetime.datetime]
+    fetched: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def from_content(cls, suffix: str, content: bytes) -> "CachedCRL":
+        """Parse the update times from the CRL, fall back to now if it can't be parsed (ie. it's empty)"""
+        etag = '"{}"'.format(hashlib.sha256(content).hexdigest()[:32])
+        try:
+            if suffix.endswith(".pem"):
+                crl = cryptography.x509.load_pem_x509_crl(content)
+            else:
+                crl = cryptography.x509.load_der_x509_crl(content)
+            return cls(content=content, etag=etag, last_modified=crl.last_update_utc, next_update=crl.next_update_utc)
+        except ValueError:
+            now = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
+            return cls(content=content, etag=etag, last_modified=now, next_update=None)
+
+    @property
+    def seconds_to_next_update(self) -> Optional[float]:
+        """How long until the CRL says it will be updated"""
+        if self.next_update is None:
+            return None
+        return (self.next_update - datetime.datetime.now(datetime.UTC)).total_seconds()
+
+
+@dataclass
+class CRLCache:
+    """Keep the CRLs in memory
+
+    The cached CRLs are reloaded when a cert is revoked (after an OCSP refresh so the CRL is regenerated),
+    when they reach their nextUpdate and at the latest after max_age seconds. The reloading is done by a
+    background task, get() also reloads expired entries itself in case the task is not running. If a reload
+    fails for any reason the old CRL is served until a reload succeeds.
+    """
+
+    max_age: float = field(default_factory=lambda: RMSettings.singleton().crl_cache_max_age)
+    entries: Dict[str, CachedCRL] = field(default_factory=dict)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    _revoked: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    _singleton: ClassVar[Optional["CRLCache"]] = None
+
+    @classmethod
+    def singleton(cls) -> "CRLCache":
+        """Return singleton"""
+        if not CRLCache._singleton:
+            CRLCache._singleton = CRLCache()
+        return CRLCache._singleton
+
+    def expires_in(self, entry: CachedCRL) -> float:
+        """Seconds until entry should be reloaded"""
+        remaining = entry.fetched + self.max_age - time.monotonic()
+        to_next = entry.seconds_to_next_update
+        # If nextUpdate has passed and the reload did not get a newer CRL fall back to max_age
+        if to_next is not None and to_next > 0:
+            remaining = min(remaining, to_next)
+        return remaining
+
+    async def get(self, suffix: str) -> CachedCRL:
+        """Get the CRL, loading it if needed"""
+        entry = self.entries.get(suffix)
+        if entry is not None and self.expires_in(entry) > 0:
+            return entry
+        async with self._lock:
+            entry = self.entries.get(suffix)
+            if entry is not None and self.expires_in(entry) > 0:
+                return entry
+            return await self._load(suffix)
+
+    @staticmethod
+    def load_timeout() -> float:
+        """Time allowed for loading a CRL, cert-manager signs it locally from the DB instead of asking CFSSL"""
+        settings = RMSettings.singleton()
+        if settings.cert_backend == CertBackend.CERT_MANAGER:
+            return settings.cert_manager_timeout
+        return settings.cfssl_timeout
+
+    async def _load(self, suffix: str) -> CachedCRL:
+        """Fetch the CRL, on failure keep serving the old one if we have it"""
+        # Lazy import, the backends need to import us
+        from .backend import get_ocsprest_crl  # pylint: disable=import-outside-toplevel
+
+        try:
+            content = await asyncio.wait_for(get_ocsprest_crl(suffix), timeout=self.load_timeout())
+        except Exception as exc:  # pylint: disable=broad-except
+            old = self.entries.get(suffix)
+            if old is None:
+                raise
+            LOGGER.exception("Could not reload {}, serving the old one: {}".format(suffix, repr(exc)))
+            return old
+        entry = CachedCRL.from_content(suffix, content)
+        old = self.entries.get(suffix)
+        if old is not None and old.etag == entry.etag:
+            # Unparseable CRLs get "now" as last_modified, don't move it if nothing changed
+            entry.last_modified = old.last_modified
+        self.entries[suffix] = entry
+        LOGGER.debug("Loaded {}, etag {}".format(suffix, entry.etag))
+        return entry
+
+    async def reload(self) -> None:
+        """Reload all the CRLs"""
+        async with self._lock:
+            for suffix in CRL_SUFFIXES:
+                await self._load(suffix)
+
+    def schedule_refresh(self) -> None:
+        """A cert was revoked, reload soon"""
+        self._revoked.set()
+
+    def handle_change(self, event: "ChangeEvent") -> None:
+        """Reload on revocations in other workers"""
+        # Lazy import to avoid circular imports, the db models need the cert backend
+        from ..db.changes import ChangeKind  # pylint: disable=import-outside-toplevel
+
+        if event.kind in (ChangeKind.PERSON_REVOKED, ChangeKind.RESET):
+            self.schedule_refresh()
+
+    async def run(self) -> None:
+        """Reload when scheduled or when the CRLs expire"""
+        while True:
+            timeouts = [self.expires_in(entry) for entry in self.entries.values()]
+            timeout = max(min(timeouts, default=self.max_age), 1.0)
+            try:
+                await asyncio.wait_for(self._revoked.wait(), timeout=timeout)
+            except (TimeoutError, asyncio.TimeoutError):
+                pass
+            revoked = self._revoked.is_set()
+            self._revoked.clear()
+            try:
+                if revoked:
+                    # Lazy import, the backends need to import us
+                    from .backend import refresh_ocsp  # pylint: disable=import-outside-toplevel
+
+                    await refresh_ocsp()
+                await self.reload()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("CRL reload failed")
+
+    def start(self) -> None:
+        """Start the refresher task and listen for revocations in other workers"""
+        # Lazy import to avoid circular imports, the db models need the cert backend
+        from ..db.changes import ChangeListener  # pylint: disable=import-outside-toplevel
+
+        ChangeListener.singleton().subscribe(self.handle_change)
+        tma = TaskMaster.singleton()
+        if tma.exists(REFRESHER_TASK_NAME):
+            return
+        tma.create_task(self.run(), name=REFRESHER_TASK_NAME)
+
+    async def stop(self) -> None:
+        """Stop the refresher task"""
+        tma = TaskMaster.singleton()
+        if not tma.exists(REFRESHER_TASK_NAME):
+            return
+        try:
+            await tma.stop_named_task_graceful(REFRESHER_TASK_NAME)
+        except asyncio.CancelledError:
+            pass
+
+    def headers(self, entry: CachedCRL) -> Dict[str, Any]:
+        """Caching headers for the response"""
+        max_age = int(max(self.expires_in(entry), 0))
+        return {
+            "ETag": entry.etag,
+            "Last-Modified": entry.last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+            "Cache-Control": f"public, max-age={max_age}",
+        }
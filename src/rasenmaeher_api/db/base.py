@@ -38,9 +38,9 @@ class ORMBaseModel(SQLModel, table=False):
                 getpk = b64_to_uuid(ensure_utf8(pkin))
             except ValueError:
                 getpk = uuid.UUID(ensure_str(pkin))
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(cls).where(cls.pk == getpk)
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
         if not obj:
             raise NotFound()
         if obj.deleted and not allow_deleted:
@@ -49,9 +49,9 @@ class ORMBaseModel(SQLModel, table=False):
 
     async def delete(self) -> bool:
         """override delete method to set the deleted timestamp instead of removing the row"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             self.deleted = datetime.datetime.now(datetime.UTC)
             session.add(self)
-            session.commit()
-            session.refresh(self)
+            await session.commit()
+            await session.refresh(self)
         return True
@@ -0,0 +1,153 @@
+"""In-process index of valid callsigns, answers the Traefik callsign-validity checks without DB round trips"""
+
+from typing import ClassVar, Optional, Set, Iterable, List, Tuple
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from libadvian.tasks import TaskMaster
+
+from ..rmsettings import RMSettings
+from .changes import ChangeListener, ChangeEvent, ChangeKind
+
+LOGGER = logging.getLogger(__name__)
+RELOAD_TASK_NAME = "callsign_index_reload"
+
+
+def fold(callsign: str) -> str:
+    """Normalize the callsign the same way as the lower(callsign) queries do"""
+    return callsign.strip().lower()
+
+
+@dataclass
+class CallsignIndex:
+    """Active (not deleted) callsigns case-folded, and the service CNs that are valid as-is
+
+    Kept current by Person.create_with_cert/revoke/delete in this process and by change events
+    from other workers, the whole index is reloaded in the background after max_age seconds (and
+    when the change listener reconnects) as a safety net. Misses are not checked from the DB so
+    unknown and revoked certs re-checked on every request never cost a query.
+    """
+
+    callsigns: Set[str] = field(default_factory=set)
+    service_cns: Set[str] = field(default_factory=set)
+    loaded_at: Optional[float] = field(default=None)
+    max_age: float = field(default_factory=lambda: RMSettings.singleton().callsign_index_max_age)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    # Changes made while a load is querying the DB, re-applied on top of the loaded set
+    _journal: Optional[List[Tuple[str, bool]]] = field(default=None, repr=False)
+
+    _singleton: ClassVar[Optional["CallsignIndex"]] = None
+
+    @classmethod
+    def singleton(cls) -> "CallsignIndex":
+        """Return singleton"""
+        if not CallsignIndex._singleton:
+            CallsignIndex._singleton = CallsignIndex()
+            ChangeListener.singleton().subscribe(CallsignIndex._singleton.handle_change)
+        return CallsignIndex._singleton
+
+    def handle_change(self, event: ChangeEvent) -> None:
+        """Apply changes made by other workers"""
+        if event.kind == ChangeKind.PERSON_CREATED:
+            self.add(event.data["callsign"])
+        elif event.kind in (ChangeKind.PERSON_REVOKED, ChangeKind.PERSON_DELETED):
+            self.discard(event.data["callsign"])
+        elif event.kind == ChangeKind.RESET and self.loaded:
+            self.schedule_reload()
+
+    @property
+    def loaded(self) -> bool:
+        """Has the index been built"""
+        return self.loaded_at is not None
+
+    @property
+    def stale(self) -> bool:
+        """Is it time to reload"""
+        if self.loaded_at is None:
+            return True
+        return (time.monotonic() - self.loaded_at) > self.max_age
+
+    def replace(self, callsigns: Iterable[str]) -> None:
+        """Replace the index contents"""
+        settings = RMSettings.singleton()
+        service_cns = {settings.mtls_client_cert_cn}
+        try:
+            service_cns.update(settings.valid_product_cns)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.debug("valid_product_cns lookup failed", exc_info=True)
+        self.service_cns = service_cns
+        self.callsigns = {fold(callsign) for callsign in callsigns}
+        self.loaded_at = time.monotonic()
+        LOGGER.debug("Indexed {} callsigns and {} service CNs".format(len(self.callsigns), len(self.service_cns)))
+
+    async def load(self) -> None:
+        """Build the index from the DB"""
+        async with self._lock:
+            await self._load_locked()
+
+    async def ensure_loaded(self) -> None:
+        """Build the index unless already built"""
+        async with self._lock:
+            if not self.loaded:
+                await self._load_locked()
+
+    async def _load_locked(self) -> None:
+        """Do the actual loading, caller must hold the lock"""
+        # Lazy import to avoid circular imports, people needs to update us
+        from .people import Person  # pylint: disable=import-outside-toplevel
+
+        self._journal = []
+        try:
+            callsigns = [callsign async for callsign in Person.list_callsigns()]
+        finally:
+            journal, self._journal = self._journal, None
+        self.replace(callsigns)
+        for callsign, valid in journal:
+            self._apply(callsign, valid)
+
+    async def _reload(self) -> None:
+        """Background reload"""
+        try:
+            await self.load()
+        except Exception as exc:  # pylint: disable=broad-except
+            LOGGER.error("Reloading callsign index failed: {}".format(exc))
+
+    def schedule_reload(self) -> None:
+        """Reload in background unless already reloading"""
+        tma = TaskMaster.singleton()
+        if tma.exists(RELOAD_TASK_NAME):
+            return
+        tma.create_task(self._reload(), name=RELOAD_TASK_NAME)
+
+    def _apply(self, callsign: str, valid: bool) -> None:
+        """Add or remove the callsign, journaled if a load is in progress"""
+        if self._journal is not None:
+            self._journal.append((callsign, valid))
+        if valid:
+            self.callsigns.add(fold(callsign))
+        else:
+            self.callsigns.discard(fold(callsign))
+
+    def add(self, callsign: str) -> None:
+        """Mark the callsign valid"""
+        self._apply(callsign, True)
+
+    def discard(self, callsign: str) -> None:
+        """Mark the callsign invalid"""
+        self._apply(callsign, False)
+
+    def lookup(self, callsign: str) -> bool:
+        """Check the index only"""
+        if callsign in self.service_cns:
+            return True
+        return fold(callsign) in self.callsigns
+
+    async def is_valid(self, callsign: str) -> bool:
+        """Check the index, building it first if needed"""
+        if not self.loaded:
+            await self.ensure_loaded()
+        elif self.stale:
+            self.schedule_reload()
+        return self.lookup(callsign)
@@ -0,0 +1,131 @@
+"""Serial numbers of the certs issued to people, needed for building CRLs locally"""
+
+from typing import ClassVar, List, Optional, TYPE_CHECKING
+import asyncio
+import datetime
+import logging
+import uuid
+from dataclasses import dataclass, field
+
+import cryptography.x509
+from sqlmodel import Field, SQLModel, select, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .base import ORMBaseModel, utcnow
+from .engine import EngineWrapper
+
+if TYPE_CHECKING:
+    from .people import Person
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CertSerial(SQLModel, table=True):
+    """Serial (lowercase hex) and issuer DN of a cert issued to user"""
+
+    __tablename__ = "certserials"
+    __table_args__ = ORMBaseModel.__table_args__
+
+    serial: str = Field(primary_key=True)
+    created: datetime.datetime = Field(sa_column_kwargs={"default": utcnow}, nullable=False)
+    user: uuid.UUID = Field(foreign_key=f"{ORMBaseModel.__table_args__['schema']}.users.pk", index=True)
+    issuer: str = Field(nullable=False)
+
+    @classmethod
+    def from_pem(cls, user: uuid.UUID, certpem: str) -> "CertSerial":
+        """Read serial and issuer from the (first) cert in the PEM"""
+        cert = cryptography.x509.load_pem_x509_certificate(certpem.encode("utf-8"))
+        return cls(
+            serial=format(cert.serial_number, "x"),
+            user=user,
+            issuer=cert.issuer.rfc4514_string(),
+        )
+
+
+@dataclass
+class RevokedSerial:
+    """One entry for the CRL"""
+
+    serial: str
+    issuer: str
+    revoked: datetime.datetime
+    reason: Optional[str]
+
+
+async def add_cert_serial(session: AsyncSession, person: "Person", certpem: str) -> None:
+    """Record the serial of persons cert in the sessions transaction"""
+    session.add(CertSerial.from_pem(person.pk, certpem))
+
+
+async def backfill_revoked_serials() -> int:
+    """Record serials for revoked people whose certs were issued before we started recording them"""
+    # Lazy import, people needs to import us
+    from .people import Person  # pylint: disable=import-outside-toplevel
+
+    added = 0
+    async with EngineWrapper.get_async_session() as session:
+        statement = select(Person).where(
+            col(Person.deleted).is_not(None),
+            ~select(CertSerial).where(CertSerial.user == Person.pk).exists(),
+        )
+        people = (await session.exec(statement)).all()
+        for person in people:
+            try:
+                certpem = await asyncio.to_thread(person.certfile.read_text, "utf-8")
+                session.add(CertSerial.from_pem(person.pk, certpem))
+                added += 1
+            except FileNotFoundError:
+                continue
+            except ValueError as exc:
+                LOGGER.warning("Could not read cert of {}: {}".format(person.callsign, exc))
+        if added:
+            await session.commit()
+    return added
+
+
+@dataclass
+class SerialBackfill:
+    """Run backfill_revoked_serials once per process, new revocations have their serials recorded already"""
+
+    done: bool = field(default=False)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    _singleton: ClassVar[Optional["SerialBackfill"]] = None
+
+    @classmethod
+    def singleton(cls) -> "SerialBackfill":
+        """Return singleton"""
+        if not SerialBackfill._singleton:
+            SerialBackfill._singleton = SerialBackfill()
+        return SerialBackfill._singleton
+
+    async def ensure(self) -> None:
+        """Backfill unless already done, a failed backfill is retried on next call"""
+        if self.done:
+            return
+        async with self._lock:
+            if self.done:
+                return
+            added = await backfill_revoked_serials()
+            if added:
+                LOGGER.info("Recorded serials of {} revoked certs".format(added))
+            self.done = True
+
+
+async def revoked_serials() -> List[RevokedSerial]:
+    """Serials of the certs of all revoked people, sorted by serial"""
+    from .people import Person  # pylint: disable=import-outside-toplevel
+
+    await SerialBackfill.singleton().ensure()
+    async with EngineWrapper.get_async_session() as session:
+        statement = (
+            select(CertSerial, Person)
+            .join(Person, col(CertSerial.user) == col(Person.pk))
+            .where(col(Person.deleted).is_not(None))
+            .order_by(col(CertSerial.serial))
+        )
+        rows = (await session.exec(statement)).all()
+    return [
+        RevokedSerial(serial=cserial.serial, issuer=cserial.issuer, revoked=person.deleted, reason=person.revoke_reason)
+        for cserial, person in rows
+    ]
@@ -0,0 +1,176 @@
+"""Change notifications between workers/replicas via Postgres LISTEN/NOTIFY
+
+Writes that affect cached data add a NOTIFY to their transaction (delivered on commit),
+each worker runs a ChangeListener that dispatches the events to the caches that subscribed.
+"""
+
+from typing import ClassVar, Optional, Any, Dict, List, Callable
+import asyncio
+import enum
+import json
+import logging
+import uuid
+from dataclasses import dataclass, field
+
+import asyncpg  # type: ignore[import-untyped]
+import sqlalchemy as sa
+from sqlmodel import select
+from sqlmodel.sql.expression import SelectOfScalar
+from sqlmodel.ext.asyncio.session import AsyncSession
+from libadvian.tasks import TaskMaster
+
+from .config import DBConfig
+from .engine import EngineWrapper
+
+LOGGER = logging.getLogger(__name__)
+# Identifies this process so we can skip our own events, those are already applied locally
+ORIGIN = str(uuid.uuid4())
+LISTENER_TASK_NAME = "db_change_listener"
+
+
+class ChangeKind(str, enum.Enum):
+    """Kinds of change events"""
+
+    PERSON_CREATED = "person_created"
+    PERSON_REVOKED = "person_revoked"
+    PERSON_DELETED = "person_deleted"
+    PERSON_UPDATED = "person_updated"
+    ROLE_ASSIGNED = "role_assigned"
+    ROLE_REMOVED = "role_removed"
+    POOL_ACTIVE = "pool_active"
+    ENROLLMENT_APPROVED = "enrollment_approved"
+    # Synthetic, dispatched locally when we (re)connect and may have missed events
+    RESET = "reset"
+
+
+@dataclass
+class ChangeEvent:
+    """One change"""
+
+    kind: ChangeKind = field()
+    data: Dict[str, Any] = field(default_factory=dict)
+    origin: str = field(default=ORIGIN)
+
+    def to_json(self) -> str:
+        """Serialize for NOTIFY payload"""
+        return json.dumps({"kind": self.kind.value, "data": self.data, "origin": self.origin}, default=str)
+
+    @classmethod
+    def from_json(cls, payload: str) -> "ChangeEvent":
+        """Parse NOTIFY payload"""
+        parsed = json.loads(payload)
+        return ChangeEvent(kind=ChangeKind(parsed["kind"]), data=parsed.get("data", {}), origin=parsed["origin"])
+
+
+ChangeHandler = Callable[[ChangeEvent], None]
+
+
+def change_statement(kind: ChangeKind, **data: Any) -> SelectOfScalar[Any]:
+    """The NOTIFY statement for given change"""
+    return select(sa.func.pg_notify(DBConfig.singleton().notify_channel, ChangeEvent(kind=kind, data=data).to_json()))
+
+
+async def add_change(session: AsyncSession, kind: ChangeKind, **data: Any) -> None:
+    """Add the NOTIFY to the sessions transaction, it's sent when (and if) the transaction commits"""
+    await session.exec(change_statement(kind, **data))
+
+
+async def publish_change(kind: ChangeKind, **data: Any) -> None:
+    """Send the NOTIFY in its own transaction"""
+    async with EngineWrapper.get_async_session() as session:
+        await add_change(session, kind, **data)
+        await session.commit()
+
+
+@dataclass
+class ChangeListener:
+    """LISTEN on a dedicated (non-pooled) connection and dispatch events to subscribers"""
+
+    config: DBConfig = field(default_factory=DBConfig.singleton)
+    handlers: List[ChangeHandler] = field(default_factory=list)
+    connected: bool = field(default=False)
+    _listened: bool = field(default=False, repr=False)
+
+    _singleton: ClassVar[Optional["ChangeListener"]] = None
+
+    @classmethod
+    def singleton(cls) -> "ChangeListener":
+        """Return singleton"""
+        if not ChangeListener._singleton:
+            ChangeListener._singleton = ChangeListener()
+        return ChangeListener._singleton
+
+    def subscribe(self, handler: ChangeHandler) -> None:
+        """Add a handler, handlers must be quick and not block"""
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+
+    def dispatch(self, event: ChangeEvent) -> None:
+        """Call all handlers"""
+        LOGGER.debug("Dispatching {}".format(event))
+        for handler in self.handlers:
+            try:
+                handler(event)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Change handler {} failed on {}".format(handler, event))
+
+    def _on_notify(self, _conn: Any, _pid: int, _channel: str, payload: str) -> None:
+        """asyncpg notification callback"""
+        try:
+            event = ChangeEvent.from_json(payload)
+        except (ValueError, KeyError) as exc:
+            LOGGER.error("Invalid change payload {!r}: {}".format(payload, exc))
+            return
+        if event.origin == ORIGIN:
+            return
+        self.dispatch(event)
+
+    async def run(self) -> None:
+        """Listen until cancelled, reconnecting as needed"""
+        while True:
+            try:
+                await self.listen()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Change listener failed, reconnecting")
+            await asyncio.sleep(self.config.retry_interval)
+
+    async def listen(self) -> None:
+        """Connect and dispatch the notifications until the connection is lost"""
+        connect_args = self.config.async_dsn.translate_connect_args(username="user")
+        conn = await asyncpg.connect(**connect_args)
+        closed = asyncio.Event()
+        try:
+            conn.add_termination_listener(lambda _conn: closed.set())
+            await conn.add_listener(self.config.notify_channel, self._on_notify)
+            self.connected = True
+            LOGGER.info("Listening for changes on {}".format(self.config.notify_channel))
+            if self._listened:
+                # We may have missed events while disconnected
+                self.dispatch(ChangeEvent(kind=ChangeKind.RESET))
+            self._listened = True
+            await closed.wait()
+            LOGGER.warning("Change listener connection lost, reconnecting")
+        finally:
+            self.connected = False
+            if not conn.is_closed():
+                await conn.close()
+
+    def start(self) -> None:
+        """Start the listener task"""
+        if not self.config.listen_changes:
+            LOGGER.info("Change listener disabled")
+            return
+        tma = TaskMaster.singleton()
+        if tma.exists(LISTENER_TASK_NAME):
+            return
+        tma.create_task(self.run(), name=LISTENER_TASK_NAME)
+
+    async def stop(self) -> None:
+        """Stop the listener task"""
+        tma = TaskMaster.singleton()
+        if not tma.exists(LISTENER_TASK_NAME):
+            return
+        try:
+            await tma.stop_named_task_graceful(LISTENER_TASK_NAME)
+        except asyncio.CancelledError:
+            pass
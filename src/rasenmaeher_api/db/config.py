@@ -26,6 +26,11 @@ class DBConfig:
     driver: str = field(
         default_factory=cast(Callable[..., str], functools.partial(config, "RM_DATABASE_DRIVER", default="postgresql"))
     )
+    async_driver: str = field(
+        default_factory=cast(
+            Callable[..., str], functools.partial(config, "RM_DATABASE_ASYNC_DRIVER", default="postgresql+asyncpg")
+        )
+    )
     host: Optional[str] = field(default_factory=functools.partial(config, "RM_DATABASE_HOST", default=None))
     port: int = field(
         default_factory=cast(Callable[..., int], functools.partial(config, "RM_DATABASE_PORT", cast=int, default=None))
@@ -53,11 +58,24 @@ class DBConfig:
         )
     )
     pool_min_size: int = field(
-        default_factory=cast(Callable[..., int], functools.partial(config, "DB_POOL_MIN_SIZE", cast=int, default=1))
-    )
+        default_factory=cast(Callable[..., int], functools.partial(config, "DB_POOL_MIN_SIZE", cast=int, default=5))
+    )  # Connections kept open, more than this up to max size are closed when returned (default was 1 before)
     pool_max_size: int = field(
         default_factory=cast(Callable[..., int], functools.partial(config, "DB_POOL_MAX_SIZE", cast=int, default=16))
     )
+    pool_timeout: float = field(
+        default_factory=cast(
+            Callable[..., float], functools.partial(config, "DB_POOL_TIMEOUT", cast=float, default=30.0)
+        )
+    )  # How long to wait for a free connection before giving up
+    pool_recycle: int = field(
+        default_factory=cast(Callable[..., int], functools.partial(config, "DB_POOL_RECYCLE", cast=int, default=1800))
+    )  # Connections older than this (seconds) are replaced on checkout, -1 to disable
+    pool_pre_ping: bool = field(
+        default_factory=cast(
+            Callable[..., bool], functools.partial(config, "DB_POOL_PRE_PING", cast=bool, default=True)
+        )
+    )  # Ping on every checkout, costs a round trip, with recycle set it's mostly needed for DB restarts
     echo: bool = field(
         default_factory=cast(Callable[..., bool], functools.partial(config, "DB_ECHO", cast=bool, default=False))
     )
@@ -75,6 +93,21 @@ class DBConfig:
     retry_interval: int = field(
         default_factory=cast(Callable[..., int], functools.partial(config, "DB_RETRY_INTERVAL", cast=int, default=1))
     )
+    stream_batch_size: int = field(
+        default_factory=cast(
+            Callable[..., int], functools.partial(config, "DB_STREAM_BATCH_SIZE", cast=int, default=500)
+        )
+    )  # Rows fetched per round trip when streaming from a server-side cursor
+    notify_channel: str = field(
+        default_factory=cast(
+            Callable[..., str], functools.partial(config, "DB_NOTIFY_CHANNEL", default="rasenmaeher_changes")
+        )
+    )  # LISTEN/NOTIFY channel used to tell other workers about changes to cached data
+    listen_changes: bool = field(
+        default_factory=cast(
+            Callable[..., bool], functools.partial(config, "DB_LISTEN_CHANGES", cast=bool, default=True)
+        )
+    )
 
     # private
     _singleton: ClassVar[Optional["DBConfig"]] = None
@@ -101,5 +134,16 @@ class DBConfig:
             )
 
         LOGGER.debug("DSN={}".format(self.dsn))
+        LOGGER.debug("ASYNC_DSN={}".format(self.async_dsn))
         LOGGER.debug("HOST={}".format(self.host))
         LOGGER.debug("DATABASE={}".format(self.database))
+
+    @property
+    def async_dsn(self) -> URL:
+        """The DSN with the async driver swapped in"""
+        assert self.dsn  # nosec B101
+        dsn = self.dsn.set(drivername=self.async_driver)
+        if dsn.password is not None:
+            # asyncpg wants a plain str, not starlette Secret
+            dsn = dsn.set(password=str(dsn.password))
+        return dsn
@@ -19,8 +19,10 @@ from .enrollments import Enrollment, EnrollmentPool
 from .logincodes import LoginCode
 from .nonces import SeenToken
 from .people import Person, Role
+from .outbox import OutboxMessage
+from .certserials import CertSerial
 
-_ = (Person, Role, EnrollmentPool, Enrollment, SeenToken, LoginCode)
+_ = (Person, Role, EnrollmentPool, Enrollment, SeenToken, LoginCode, OutboxMessage, CertSerial)
 LOGGER = logging.getLogger(__name__)
 
 
@@ -30,19 +32,21 @@ async def init_db() -> None:
     lockpath = Path(tempfile.gettempdir()) / "dbinit.lock"
     lock = filelock.FileLock(lockpath)
     wrapper = EngineWrapper.singleton()
-    assert wrapper.engine  # nosec B101
-    engine = wrapper.engine
+    assert wrapper.async_engine  # nosec B101
+    engine = wrapper.async_engine
+    schema = ORMBaseModel.__table_args__["schema"]
     try:
         await asyncio.sleep(random.random() * 2)  # nosec B311
         lock.acquire(timeout=0.0)
         LOGGER.debug("Acquiring session")
-        with engine.connect() as connection:
-            if not sa.inspect(connection).has_schema(ORMBaseModel.__table_args__["schema"]):
-                LOGGER.debug("Creating schema {}".format(ORMBaseModel.__table_args__["schema"]))
-                connection.execute(CreateSchema(ORMBaseModel.__table_args__["schema"]))
-                connection.commit()
-                SQLModel.metadata.create_all(connection)
-                connection.commit()
+        async with engine.connect() as connection:
+            if not await connection.run_sync(lambda conn: sa.inspect(conn).has_schema(schema)):
+                LOGGER.debug("Creating schema {}".format(schema))
+                await connection.execute(CreateSchema(schema))
+                await connection.commit()
+            # Only creates the missing tables, so tables added later get created in existing databases too
+            await connection.run_sync(SQLModel.metadata.create_all)
+            await connection.commit()
     except filelock.Timeout:
         LOGGER.warning("Someone has already locked {}".format(lockpath))
         LOGGER.debug("Sleeping for ~5s and then recursing")
@@ -1,14 +1,59 @@
 """Engine stuff"""
 
-from typing import ClassVar, Optional, Any
+from typing import ClassVar, Optional, Any, Dict, Type, TypeVar, cast
 import logging
-from dataclasses import dataclass, field
+import time
+from dataclasses import dataclass, field, asdict
 
 from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, PoolProxiedConnection
+import sqlalchemy.exc
 
 from .config import DBConfig
 
 LOGGER = logging.getLogger(__name__)
+QueuePoolT = TypeVar("QueuePoolT", bound=QueuePool)
+
+
+@dataclass
+class PoolStats:
+    """Counters for pool checkouts, wait times are in seconds"""
+
+    # Checkouts started but not finished, blocked on a free connection or just connecting
+    checkouts_in_progress: int = 0
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+    def record(self, waited: float) -> None:
+        """Record a finished checkout attempt"""
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+
+def instrumented_pool(base: Type[QueuePoolT]) -> Type[QueuePoolT]:
+    """Subclass given pool class with its own PoolStats, the class is kept when the pool is recreated on dispose"""
+    stats = PoolStats()
+
+    def connect(self: QueuePoolT) -> PoolProxiedConnection:
+        """Count checkouts in progress and time them"""
+        stats.checkouts_in_progress += 1
+        started = time.monotonic()
+        try:
+            conn = base.connect(self)
+            stats.checkouts += 1
+            return conn
+        except sqlalchemy.exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            stats.checkouts_in_progress -= 1
+            stats.record(time.monotonic() - started)
+
+    return cast(Type[QueuePoolT], type(f"Instrumented{base.__name__}", (base,), {"connect": connect, "stats": stats}))
 
 
 @dataclass
@@ -18,6 +63,7 @@ class EngineWrapper:
     config: DBConfig = field(default_factory=DBConfig.singleton)
     # FIXME: correct typing
     engine: Optional[Any] = field(default=None)
+    async_engine: Optional[AsyncEngine] = field(default=None)
 
     _singleton: ClassVar[Optional["EngineWrapper"]] = None
 
@@ -30,30 +76,72 @@ class EngineWrapper:
         return EngineWrapper._singleton
 
     def __post_init__(self) -> None:
-        """create one engine"""
+        """create the engines, the sync one is only for tests and tooling, the app uses the async one"""
         assert self.config.dsn  # nosec B101
-        if self.config.pool_min_size and self.config.pool_max_size:
-            self.engine = create_engine(
-                self.config.dsn,
-                pool_pre_ping=True,
-                echo=self.config.echo,
-                # Not valid for psycopg
-                #                min_size=self.config.pool_min_size,
-                #                max_size=self.config.pool_max_size,
-                #                ssl=self.config.ssl,
-            )
-            return
         self.engine = create_engine(
             self.config.dsn,
-            pool_pre_ping=True,
             echo=self.config.echo,
+            poolclass=instrumented_pool(QueuePool),
+            **self.pool_kwargs(),
         )
+        self.async_engine = create_async_engine(
+            self.config.async_dsn,
+            echo=self.config.echo,
+            poolclass=instrumented_pool(AsyncAdaptedQueuePool),
+            **self.pool_kwargs(),
+        )
+
+    def pool_kwargs(self) -> Dict[str, Any]:
+        """Pool arguments from config, min_size connections are kept open and max_size is the hard limit"""
+        pool_size = max(self.config.pool_min_size, 1)
+        return {
+            "pool_size": pool_size,
+            "max_overflow": max(self.config.pool_max_size - pool_size, 0),
+            "pool_timeout": self.config.pool_timeout,
+            "pool_recycle": self.config.pool_recycle,
+            "pool_pre_ping": self.config.pool_pre_ping,
+            "pool_use_lifo": True,
+        }
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Current state of the async engine pool"""
+        assert self.async_engine  # nosec B101
+        pool = cast(AsyncAdaptedQueuePool, self.async_engine.pool)
+        stats: PoolStats = getattr(pool, "stats", PoolStats())
+        ret: Dict[str, Any] = {
+            "size": pool.size(),
+            "max_overflow": max(self.config.pool_max_size - pool.size(), 0),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+        ret.update(asdict(stats))
+        attempts = stats.checkouts + stats.timeouts
+        ret["wait_avg"] = stats.wait_total / attempts if attempts else 0.0
+        return ret
 
     @classmethod
     def get_session(cls) -> Session:
-        """Get a session from wrapper singleton"""
+        """Get a blocking session from wrapper singleton, do not use in the app (it blocks the event loop)"""
         return cls.singleton().session()
 
     def session(self) -> Session:
-        """Get a session"""
+        """Get a blocking session"""
         return Session(self.engine)
+
+    @classmethod
+    def get_async_session(cls) -> AsyncSession:
+        """Get an async session from wrapper singleton"""
+        return cls.singleton().async_session()
+
+    def async_session(self) -> AsyncSession:
+        """Get an async session, objects are not expired on commit so they stay usable after the session closes"""
+        return AsyncSession(self.async_engine, expire_on_commit=False)
+
+    async def dispose(self) -> None:
+        """Close the pooled connections"""
+        if self.async_engine is not None:
+            LOGGER.debug("Disposing pool, stats: {}".format(self.pool_stats()))
+            await self.async_engine.dispose()
+        if self.engine is not None:
+            self.engine.dispose()
@@ -18,6 +18,7 @@ from .people import Person
 from .errors import ForbiddenOperation, CallsignReserved, NotFound, Deleted, PoolInactive
 from ..rmsettings import RMSettings
 from .engine import EngineWrapper
+from .changes import ChangeKind, add_change
 from ..web.api.utils.csr_utils import verify_csr
 
 LOGGER = logging.getLogger(__name__)
@@ -62,11 +63,12 @@ class EnrollmentPool(ORMBaseModel, table=True):
 
     async def set_active(self, state: bool) -> "EnrollmentPool":
         """Set active and return refreshed object"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             self.active = bool(state)
             session.add(self)
-            session.commit()
-            session.refresh(self)
+            await add_change(session, ChangeKind.POOL_ACTIVE, pk=self.pk, active=self.active)
+            await session.commit()
+            await session.refresh(self)
             return self
 
     @classmethod
@@ -76,7 +78,7 @@ class EnrollmentPool(ORMBaseModel, table=True):
         include_deleted: bool = False,
     ) -> AsyncGenerator["EnrollmentPool", None]:
         """List pools, optionally by owner or including deleted pools"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(cls)
             if by_owner:
                 statement = statement.where(cls.owner == by_owner.pk)
@@ -84,8 +86,10 @@ class EnrollmentPool(ORMBaseModel, table=True):
                 statement = statement.where(
                     cls.deleted == None  # noqa: E711
                 )
-            results = session.exec(statement)
-            for result in results:
+            results = await session.stream_scalars(
+                statement.execution_options(yield_per=EngineWrapper.singleton().config.stream_batch_size)
+            )
+            async for result in results:
                 yield result
 
     @classmethod
@@ -107,7 +111,7 @@ class EnrollmentPool(ORMBaseModel, table=True):
     @classmethod
     async def create_for_owner(cls, person: Person, extra: Optional[Dict[str, Any]] = None) -> "EnrollmentPool":
         """Creates one for given owner"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             code = await cls._generate_unused_code()
             obj = EnrollmentPool(
                 invitecode=code,
@@ -116,25 +120,25 @@ class EnrollmentPool(ORMBaseModel, table=True):
                 extra=extra,
             )
             session.add(obj)
-            session.commit()
-            session.refresh(obj)
+            await session.commit()
+            await session.refresh(obj)
             return obj
 
     async def reset_invitecode(self) -> str:
         """Reset invitecode"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             self.invitecode = await EnrollmentPool._generate_unused_code()
             session.add(self)
-            session.commit()
-            session.refresh(self)
+            await session.commit()
+            await session.refresh(self)
             return self.invitecode
 
     @classmethod
     async def by_invitecode(cls, invitecode: str, allow_deleted: bool = False) -> "EnrollmentPool":
         """Get by invitecode"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(EnrollmentPool).where(EnrollmentPool.invitecode == invitecode)
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
         if not obj:
             raise NotFound()
         if obj.deleted and not allow_deleted:
@@ -181,44 +185,49 @@ class Enrollment(ORMBaseModel, table=True):
 
     async def approve(self, approver: Person) -> Person:
         """Creates the person record, their certs etc"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             person = await Person.create_with_cert(self.callsign, extra=self.extra, csrpem=self.csr)
             self.state = EnrollmentState.APPROVED
             self.decided_by = approver.pk
             self.decided_on = datetime.datetime.now(datetime.UTC)
             self.person = person.pk
             session.add(self)
-            session.commit()
-            session.refresh(self)
+            await add_change(
+                session, ChangeKind.ENROLLMENT_APPROVED, pk=self.pk, callsign=self.callsign, person=person.pk
+            )
+            await session.commit()
+            await session.refresh(self)
             return person
 
     async def reject(self, decider: Person) -> None:
         """Reject"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             self.state = EnrollmentState.REJECTED
             self.decided_by = decider.pk
             self.decided_on = datetime.datetime.now(datetime.UTC)
             session.add(self)
-            session.commit()
-            session.refresh(self)
+            await session.commit()
+            await session.refresh(self)
 
     @classmethod
     async def list(cls, by_pool: Optional[EnrollmentPool] = None) -> AsyncGenerator["Enrollment", None]:
         """List enrollments, optionally by pool (enrollment deletion is not allowed, they can only be rejected)"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(Enrollment)
             if by_pool:
                 statement = statement.where(Enrollment.pool == by_pool.pk)
-            results = session.exec(statement)
-            for result in results:
+            results = await session.stream_scalars(
+                statement.execution_options(yield_per=EngineWrapper.singleton().config.stream_batch_size)
+            )
+            async for result in results:
                 yield result
 
     @classmethod
     async def by_callsign(cls, callsign: str) -> "Enrollment":
         """Get by callsign"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(Enrollment).where(func.lower(Enrollment.callsign) == func.lower(callsign))
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
         if not obj:
             raise NotFound()
         if obj.deleted:
@@ -229,9 +238,9 @@ class Enrollment(ORMBaseModel, table=True):
     @classmethod
     async def by_approvecode(cls, code: str) -> "Enrollment":
         """Get by approvecode"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(Enrollment).where(Enrollment.approvecode == code)
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
         if not obj:
             raise NotFound()
         if obj.deleted:
@@ -250,11 +259,11 @@ class Enrollment(ORMBaseModel, table=True):
 
     async def reset_approvecode(self) -> str:
         """Reset approvecode"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             code = await Enrollment._generate_unused_code()
             self.approvecode = code
             session.add(self)
-            session.commit()
+            await session.commit()
             return code
 
     @classmethod
@@ -286,7 +295,7 @@ class Enrollment(ORMBaseModel, table=True):
             raise CallsignReserved("Using product CNs as callsigns is forbidden")
         if csr and not verify_csr(csr, callsign):
             raise CallsignReserved("CSR CN must match callsign")
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             try:
                 await Enrollment.by_callsign(callsign)
                 raise CallsignReserved()
@@ -305,8 +314,8 @@ class Enrollment(ORMBaseModel, table=True):
                 csr=csr,
             )
             session.add(obj)
-            session.commit()
-            session.refresh(obj)
+            await session.commit()
+            await session.refresh(obj)
             return obj
 
     async def delete(self) -> bool:
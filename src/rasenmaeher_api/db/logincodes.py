@@ -42,19 +42,19 @@ class LoginCode(ORMBaseModel, table=True):
             pass
         if not auditmeta:
             auditmeta = {}
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             obj.used_on = datetime.datetime.now(datetime.UTC)
             obj.auditmeta = auditmeta
             session.add(obj)
-            session.commit()
+            await session.commit()
             return Issuer.singleton().issue(obj.claims)
 
     @classmethod
     async def by_code(cls, code: str) -> "LoginCode":
         """Get by token"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(LoginCode).where(LoginCode.code == code)
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
         if not obj:
             raise NotFound()
         if obj.deleted:
@@ -67,7 +67,7 @@ class LoginCode(ORMBaseModel, table=True):
         """Create a new one with random code for the given claims"""
         # TODO: Do this in a transaction to avoid race conditions
         attempt = 0
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             while True:
                 attempt += 1
                 code = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_CHAR_COUNT))
@@ -81,7 +81,7 @@ class LoginCode(ORMBaseModel, table=True):
                 auditmeta = {}
             dbobj = LoginCode(code=code, claims=claims, auditmeta=auditmeta)
             session.add(dbobj)
-            session.commit()
+            await session.commit()
             return code
 
     async def delete(self) -> bool:
@@ -50,8 +50,8 @@ class DBWrapper:
                     raise
 
     async def app_shutdown_event(self) -> None:
-        """On app shutdown close the db connection"""
-        # we no longer need to manage connections like this
+        """On app shutdown close the db connection pools"""
+        await EngineWrapper.singleton().dispose()
 
 
 class DBConnectionMiddleware:
@@ -34,17 +34,17 @@ class SeenToken(ORMBaseModel, table=True):
             pass
         if not auditmeta:
             auditmeta = {}
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             dbtoken = SeenToken(token=token, auditmeta=auditmeta)
             session.add(dbtoken)
-            session.commit()
+            await session.commit()
 
     @classmethod
     async def by_token(cls, token: str) -> "SeenToken":
         """Get by token"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(SeenToken).where(SeenToken.token == token)
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
         if not obj:
             raise NotFound()
         if obj.deleted:
@@ -0,0 +1,353 @@
+"""Durable outbox for user lifecycle notifications to products and Keycloak
+
+The notifications are added to the same transaction as the change they describe, one message per
+target, so they are sent if and only if the change commits. An OutboxDispatcher in every worker
+claims due messages in batches and delivers them, retrying failures with backoff, and deletes
+finished messages after the retention period.
+"""
+
+from typing import ClassVar, Optional, Any, Dict, List, Iterable, TYPE_CHECKING
+import asyncio
+import datetime
+import enum
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import func
+from sqlmodel import Field, SQLModel, select, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+from libadvian.tasks import TaskMaster
+from libpvarki.schemas.generic import OperationResultResponse
+
+from .base import ORMBaseModel, utcnow
+from .engine import EngineWrapper
+from ..rmsettings import RMSettings
+from ..kchelpers import KCClient, KCUserData
+from ..productapihelpers import post_to_product, check_kraftwerk_manifest
+from ..cert.backend import refresh_ocsp
+from ..cert.errors import CertError
+
+if TYPE_CHECKING:
+    from .people import Person
+
+LOGGER = logging.getLogger(__name__)
+DISPATCHER_TASK_NAME = "outbox_dispatcher"
+KEYCLOAK_TARGET = "keycloak"
+# Seconds between deleting the messages past retention
+PRUNE_INTERVAL = 300.0
+
+
+class OutboxEvent(str, enum.Enum):
+    """User lifecycle events, the values are the product integration API endpoint names"""
+
+    CREATED = "created"
+    REVOKED = "revoked"
+    PROMOTED = "promoted"
+    DEMOTED = "demoted"
+
+
+class OutboxMessage(SQLModel, table=True):
+    """One notification to one target (product name or KEYCLOAK_TARGET)
+
+    Messages for the same user and target are delivered in pk order, a message that keeps failing
+    holds back the later ones until it's delivered or given up on (failed is set). Product messages
+    also wait for the users earlier Keycloak messages, like the products were notified only after
+    the KC update before the outbox.
+    """
+
+    __tablename__ = "outbox"
+    __table_args__ = ORMBaseModel.__table_args__
+
+    pk: Optional[int] = Field(default=None, primary_key=True, sa_type=sa.BigInteger)
+    created: datetime.datetime = Field(sa_column_kwargs={"default": utcnow}, nullable=False)
+    # Sent to products so they can drop duplicates if we retry after a lost response
+    idempotency_key: uuid.UUID = Field(default_factory=uuid.uuid4, nullable=False, unique=True)
+    user: uuid.UUID = Field(foreign_key=f"{ORMBaseModel.__table_args__['schema']}.users.pk", index=True)
+    event: str = Field(nullable=False)
+    target: str = Field(nullable=False, index=True)
+    payload: Dict[str, Any] = Field(sa_type=JSONB, nullable=False, sa_column_kwargs={"server_default": "{}"})
+    attempts: int = Field(default=0, nullable=False)
+    next_attempt: datetime.datetime = Field(sa_column_kwargs={"default": utcnow}, nullable=False)
+    # Set while a dispatcher is working on the message, others skip it until this has passed
+    locked_until: Optional[datetime.datetime] = Field(default=None, nullable=True)
+    delivered: Optional[datetime.datetime] = Field(default=None, nullable=True, index=True)
+    failed: Optional[datetime.datetime] = Field(default=None, nullable=True)
+    last_error: Optional[str] = Field(default=None, nullable=True)
+
+
+def outbox_targets(event: OutboxEvent) -> List[str]:
+    """Keycloak (if enabled) and the products in the manifest, KC first so products are delivered after it"""
+    targets: List[str] = []
+    # KC user is created synchronously since we need its data back right away
+    if RMSettings.singleton().kc_enabled and event != OutboxEvent.CREATED:
+        targets.append(KEYCLOAK_TARGET)
+    if check_kraftwerk_manifest():
+        targets += list(RMSettings.singleton().kraftwerk_manifest_dict.get("products", {}).keys())
+    return targets
+
+
+async def add_notifications(
+    session: AsyncSession, person: "Person", event: OutboxEvent, targets: Optional[Iterable[str]] = None
+) -> None:
+    """Add messages for the event to the sessions transaction, they're delivered after (and if) it commits
+
+    The product payload is taken now. It's only the users uuid, callsign and cert, none of which the
+    Keycloak update changes, so it's the same payload the products got after the KC update before.
+    """
+    if targets is None:
+        targets = outbox_targets(event)
+    payload = person.productapidata.model_dump()
+    for target in targets:
+        session.add(
+            OutboxMessage(
+                user=person.pk,
+                event=event.value,
+                target=target,
+                payload={} if target == KEYCLOAK_TARGET else payload,
+            )
+        )
+
+
+async def publish_notifications(person: "Person", event: OutboxEvent) -> None:
+    """Add the messages in their own transaction and wake up the dispatcher"""
+    async with EngineWrapper.get_async_session() as session:
+        await add_notifications(session, person, event)
+        await session.commit()
+    OutboxDispatcher.singleton().notify()
+
+
+@dataclass
+class OutboxDispatcher:  # pylint: disable=too-many-instance-attributes
+    """Claim due outbox messages in batches and deliver them
+
+    Targets in a batch are handled in parallel and each target gets up to concurrency messages
+    in flight, a batch never has more than one message per user and target so this keeps the order.
+    Failed deliveries are retried with capped exponential backoff (with jitter) and given up on
+    after max_attempts. Delivered and given up messages are deleted after retention seconds.
+    """
+
+    batch_size: int = field(default_factory=lambda: RMSettings.singleton().outbox_batch_size)
+    poll_interval: float = field(default_factory=lambda: RMSettings.singleton().outbox_poll_interval)
+    concurrency: int = field(default_factory=lambda: RMSettings.singleton().outbox_product_concurrency)
+    retry_base: float = field(default_factory=lambda: RMSettings.singleton().outbox_retry_base)
+    retry_max: float = field(default_factory=lambda: RMSettings.singleton().outbox_retry_max)
+    max_attempts: int = field(default_factory=lambda: RMSettings.singleton().outbox_max_attempts)
+    lease: float = field(default_factory=lambda: RMSettings.singleton().outbox_lease)
+    retention: float = field(default_factory=lambda: RMSettings.singleton().outbox_retention)
+    _wake: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    _pruned: Optional[float] = field(default=None, repr=False)
+
+    _singleton: ClassVar[Optional["OutboxDispatcher"]] = None
+
+    @classmethod
+    def singleton(cls) -> "OutboxDispatcher":
+        """Return singleton"""
+        if not OutboxDispatcher._singleton:
+            OutboxDispatcher._singleton = OutboxDispatcher()
+        return OutboxDispatcher._singleton
+
+    def notify(self) -> None:
+        """New messages were committed, check without waiting for the poll interval"""
+        self._wake.set()
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before the next attempt"""
+        delay = min(self.retry_base * 2.0 ** max(attempts - 1, 0), self.retry_max)
+        return delay / 2 + random.random() * delay / 2  # nosec B311
+
+    async def run(self) -> None:
+        """Dispatch until cancelled"""
+        while True:
+            self._wake.clear()
+            try:
+                claimed = await self.dispatch_batch()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Outbox dispatch failed")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue
+            if self._pruned is None or time.monotonic() - self._pruned >= PRUNE_INTERVAL:
+                try:
+                    await self.prune()
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Outbox pruning failed")
+                self._pruned = time.monotonic()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except (TimeoutError, asyncio.TimeoutError):
+                pass
+
+    async def dispatch_batch(self) -> int:
+        """Claim and deliver one batch, returns the number of messages claimed"""
+        messages = await self._claim()
+        if not messages:
+            return 0
+        if any(message.target != KEYCLOAK_TARGET for message in messages):
+            # Make sure the products see the current cert status
+            try:
+                await refresh_ocsp()
+            except CertError as exc:
+                LOGGER.warning("OCSP refresh failed, notifying anyway: {}".format(exc))
+        bytarget: Dict[str, List[OutboxMessage]] = {}
+        for message in messages:
+            bytarget.setdefault(message.target, []).append(message)
+        await asyncio.gather(*(self._dispatch_target(target_messages) for target_messages in bytarget.values()))
+        return len(messages)
+
+    async def _claim(self) -> List[OutboxMessage]:
+        """Lease the next batch of due messages"""
+        earlier = aliased(OutboxMessage)
+        statement = (
+            select(OutboxMessage)
+            .where(
+                col(OutboxMessage.delivered).is_(None),
+                col(OutboxMessage.failed).is_(None),
+                col(OutboxMessage.next_attempt) <= func.now(),
+                sa.or_(col(OutboxMessage.locked_until).is_(None), col(OutboxMessage.locked_until) < func.now()),
+                ~sa.exists().where(
+                    col(earlier.user) == col(OutboxMessage.user),
+                    sa.or_(
+                        col(earlier.target) == col(OutboxMessage.target),
+                        sa.and_(col(earlier.target) == KEYCLOAK_TARGET, col(OutboxMessage.target) != KEYCLOAK_TARGET),
+                    ),
+                    col(earlier.delivered).is_(None),
+                    col(earlier.failed).is_(None),
+                    col(earlier.pk) < col(OutboxMessage.pk),
+                ),
+            )
+            .order_by(col(OutboxMessage.pk))
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with EngineWrapper.get_async_session() as session:
+            messages = list((await session.exec(statement)).all())
+            if not messages:
+                return []
+            await session.exec(
+                sa.update(OutboxMessage)
+                .where(col(OutboxMessage.pk).in_([message.pk for message in messages]))
+                .values(locked_until=func.now() + datetime.timedelta(seconds=self.lease))
+            )
+            await session.commit()
+        LOGGER.debug("Claimed {} outbox messages".format(len(messages)))
+        return messages
+
+    async def prune(self) -> int:
+        """Delete messages delivered or given up on more than retention seconds ago"""
+        cutoff = func.now() - datetime.timedelta(seconds=self.retention)
+        statement = sa.delete(OutboxMessage).where(
+            sa.or_(col(OutboxMessage.delivered) < cutoff, col(OutboxMessage.failed) < cutoff)
+        )
+        async with EngineWrapper.get_async_session() as session:
+            result = await session.exec(statement)
+            await session.commit()
+        deleted = int(result.rowcount or 0)
+        if deleted:
+            LOGGER.info("Deleted {} finished outbox messages".format(deleted))
+        return deleted
+
+    async def _dispatch_target(self, messages: List[OutboxMessage]) -> None:
+        """Deliver messages for one target"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def handle_one(message: OutboxMessage) -> None:
+            """Deliver and record the result"""
+            async with semaphore:
+                try:
+                    error = await self.deliver(message)
+                except Exception as exc:  # pylint: disable=broad-except
+                    LOGGER.exception("Delivering outbox message {} failed".format(message.pk))
+                    error = repr(exc)
+                await self._record(message, error)
+
+        await asyncio.gather(*(handle_one(message) for message in messages))
+
+    async def _record(self, message: OutboxMessage, error: Optional[str]) -> None:
+        """Mark delivered or schedule retry"""
+        attempts = message.attempts + 1
+        values: Dict[str, Any] = {"attempts": attempts, "locked_until": None, "last_error": error}
+        if error is None:
+            values["delivered"] = func.now()
+        elif attempts >= self.max_attempts:
+            LOGGER.error(
+                "Giving up on {} to {} for {} after {} attempts: {}".format(
+                    message.event, message.target, message.user, attempts, error
+                )
+            )
+            values["failed"] = func.now()
+        else:
+            delay = self.backoff(attempts)
+            LOGGER.warning(
+                "{} to {} for {} failed, retrying in {:.1f}s: {}".format(
+                    message.event, message.target, message.user, delay, error
+                )
+            )
+            values["next_attempt"] = func.now() + datetime.timedelta(seconds=delay)
+        async with EngineWrapper.get_async_session() as session:
+            await session.exec(sa.update(OutboxMessage).where(col(OutboxMessage.pk) == message.pk).values(**values))
+            await session.commit()
+
+    async def deliver(self, message: OutboxMessage) -> Optional[str]:
+        """Send one message, returns None on success and the error otherwise"""
+        if message.target == KEYCLOAK_TARGET:
+            return await self._deliver_keycloak(message)
+        manifest = RMSettings.singleton().kraftwerk_manifest_dict
+        if message.target not in manifest.get("products", {}):
+            return "Product {} is not in the manifest".format(message.target)
+        resp = await post_to_product(
+            message.target,
+            f"api/v1/users/{message.event}",
+            message.payload,
+            OperationResultResponse,
+            headers={"Idempotency-Key": str(message.idempotency_key)},
+        )
+        if resp is None:
+            return "No valid response"
+        if isinstance(resp, OperationResultResponse) and not resp.success:
+            return "Product reported failure: {}".format(resp)
+        return None
+
+    @classmethod
+    async def _deliver_keycloak(cls, message: OutboxMessage) -> Optional[str]:
+        """Sync the user to Keycloak"""
+        # Lazy import to avoid circular imports, people needs to add notifications
+        from .people import Person  # pylint: disable=import-outside-toplevel
+
+        person = await Person.by_pk(message.user, allow_deleted=True)
+        kclient = KCClient.singleton()
+        kcdata = await person.get_kcdata()
+        if message.event == OutboxEvent.REVOKED.value:
+            if not kcdata.kc_id:
+                LOGGER.warning("{} has no KC id, nothing to delete".format(person.callsign))
+                return None
+            if not await kclient.delete_kc_user(kcdata):
+                return "Could not delete KC user"
+            return None
+        kcuser = await kclient.update_kc_user(kcdata)
+        if not kcuser or not isinstance(kcuser, KCUserData):
+            return "Could not update KC user"
+        await Person.update_from_kcdata(kcuser.kc_data)
+        return None
+
+    def start(self) -> None:
+        """Start the dispatcher task"""
+        tma = TaskMaster.singleton()
+        if tma.exists(DISPATCHER_TASK_NAME):
+            return
+        tma.create_task(self.run(), name=DISPATCHER_TASK_NAME)
+
+    async def stop(self) -> None:
+        """Stop the dispatcher task, messages in flight are retried after their lease runs out"""
+        tma = TaskMaster.singleton()
+        if not tma.exists(DISPATCHER_TASK_NAME):
+            return
+        try:
+            await tma.stop_named_task_graceful(DISPATCHER_TASK_NAME)
+        except asyncio.CancelledError:
+            pass
@@ -1,7 +1,6 @@
 """Abstractions for people"""
 
-from typing import Self, Optional, AsyncGenerator, Dict, Any, Set, Union
-import asyncio
+from typing import Self, Optional, AsyncGenerator, Dict, Any, Set, Union, Tuple
 import uuid
 import logging
 from pathlib import Path
@@ -10,13 +9,12 @@ import datetime
 
 import cryptography.x509
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlmodel import Field, SQLModel, select
+from sqlmodel import Field, SQLModel, select, col
 import sqlalchemy as sa
 from sqlalchemy.sql import func
+from sqlalchemy.orm import defer
 from libpvarki.mtlshelp.csr import PRIVDIR_MODE, async_create_keypair, async_create_client_csr
 from libpvarki.schemas.product import UserCRUDRequest
-from libpvarki.schemas.generic import OperationResultResponse
-from libpvarki.mtlshelp.pkcs12 import convert_pem_to_pkcs12
 from libadvian.tasks import TaskMaster
 
 
@@ -24,10 +22,16 @@ from .base import ORMBaseModel, utcnow
 from ..web.api.middleware.datatypes import MTLSorJWTPayload
 from .errors import NotFound, Deleted, BackendError, CallsignReserved
 from ..cert.backend import sign_csr, revoke_pem, validate_reason, ReasonTypes, refresh_ocsp
-from ..productapihelpers import post_to_all_products
 from ..rmsettings import RMSettings
 from ..kchelpers import KCClient, KCUserData
+from ..keypool import KeypairPool
+from ..pfxbuilder import PFXBuilder
 from .engine import EngineWrapper
+from .callsignindex import CallsignIndex
+from .principalcache import PrincipalCache
+from .changes import ChangeKind, add_change, publish_change
+from .outbox import OutboxEvent, OutboxDispatcher, add_notifications, publish_notifications
+from .certserials import add_cert_serial
 from ..web.api.utils.csr_utils import verify_csr
 
 LOGGER = logging.getLogger(__name__)
@@ -74,11 +78,13 @@ class Person(ORMBaseModel, table=True):
         )
         try:
             LOGGER.debug("Updating extra for {}".format(person.callsign))
-            with EngineWrapper.get_session() as session:
+            async with EngineWrapper.get_async_session() as session:
                 session.add(person)
-                session.commit()
-                session.refresh(person)
-                return person
+                await add_change(session, ChangeKind.PERSON_UPDATED, pk=person.pk, callsign=person.callsign)
+                await session.commit()
+                await session.refresh(person)
+            PrincipalCache.singleton().invalidate(person.callsign)
+            return person
         except Exception as exc:
             raise BackendError(str(exc)) from exc
 
@@ -108,31 +114,43 @@ class Person(ORMBaseModel, table=True):
         except NotFound:
             pass
 
-        with EngineWrapper.get_session() as session:
-            puuid = uuid.uuid4()
-            certspath = Path(cnf.persistent_data_dir) / "private" / "people" / str(puuid)
-            certspath.mkdir(parents=True)
-            certspath.chmod(PRIVDIR_MODE)
-            try:
-                newperson = Person(pk=puuid, callsign=callsign, certspath=str(certspath), extra=extra)
-                session.add(newperson)
-                session.commit()
-                if csrpem:
-                    newperson.csrfile.write_text(csrpem, encoding="utf-8")
-                else:
+        puuid = uuid.uuid4()
+        certspath = Path(cnf.persistent_data_dir) / "private" / "people" / str(puuid)
+        certspath.mkdir(parents=True)
+        certspath.chmod(PRIVDIR_MODE)
+        newperson = Person(pk=puuid, callsign=callsign, certspath=str(certspath), extra=extra)
+        certpem: Optional[str] = None
+        try:
+            # Keys and signing can take a while, don't hold a DB transaction (and the callsign lock) for it
+            if csrpem:
+                newperson.csrfile.write_text(csrpem, encoding="utf-8")
+            else:
+                ckp = await KeypairPool.singleton().take(newperson.privkeyfile, newperson.pubkeyfile)
+                if ckp is None:
                     ckp = await async_create_keypair(newperson.privkeyfile, newperson.pubkeyfile)
-                    csrpem = await async_create_client_csr(ckp, newperson.csrfile, newperson.certsubject)
-                certpem = (await sign_csr(csrpem)).replace("\\n", "\n")
-                newperson.certfile.write_text(certpem)
-            except Exception as exc:
-                LOGGER.exception("Something went wrong, doing cleanup")
-                shutil.rmtree(certspath)
-                remaining = list(certspath.rglob("*"))
-                LOGGER.debug("Remaining files: {}".format(remaining))
-                session.rollback()
-                raise BackendError(str(exc)) from exc
-            # refresh object if everything went ok
-            session.refresh(newperson)
+                csrpem = await async_create_client_csr(ckp, newperson.csrfile, newperson.certsubject)
+            certpem = (await sign_csr(csrpem)).replace("\\n", "\n")
+            newperson.certfile.write_text(certpem)
+            async with EngineWrapper.get_async_session() as session:
+                session.add(newperson)
+                await add_cert_serial(session, newperson, certpem)
+                await add_notifications(session, newperson, OutboxEvent.CREATED)
+                await add_change(session, ChangeKind.PERSON_CREATED, pk=puuid, callsign=callsign)
+                await session.commit()
+                await session.refresh(newperson)
+        except Exception as exc:
+            LOGGER.exception("Something went wrong, doing cleanup")
+            if certpem:
+                # ie. someone else took the callsign while we were signing, don't leave the cert valid
+                try:
+                    await revoke_pem(certpem, cryptography.x509.ReasonFlags.cessation_of_operation)
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Could not revoke the unused cert")
+            shutil.rmtree(certspath)
+            remaining = list(certspath.rglob("*"))
+            LOGGER.debug("Remaining files: {}".format(remaining))
+            raise BackendError(str(exc)) from exc
+        CallsignIndex.singleton().add(newperson.callsign)
         # Drop the DB transaction for rest of the actions
         return await newperson._post_create()
 
@@ -146,40 +164,30 @@ class Person(ORMBaseModel, table=True):
         else:
             LOGGER.debug("Calling update_from_kcdata")
             refresh = await Person.update_from_kcdata(kcdata.kc_data, refresh)
-        # Trigger some background tasks
-        TaskMaster.singleton().create_task(refresh.create_pfx())
+        # Trigger some background tasks, the PFX is built when it's first requested
         TaskMaster.singleton().create_task(refresh_ocsp())
-        TaskMaster.singleton().create_task(user_created(refresh))
+        OutboxDispatcher.singleton().notify()
         return refresh
 
     async def create_pfx(self) -> Path:
-        """Put cert and key to PKCS12 container"""
-        if self.pfxfile.exists():
-            return self.pfxfile
-
-        def write_pfx() -> None:
-            """Do the IO"""
-            nonlocal self
-            if self.privkeyfile.exists():
-                p12bytes = convert_pem_to_pkcs12(self.certfile, self.privkeyfile, self.callsign, None, self.callsign)
-            else:
-                p12bytes = convert_pem_to_pkcs12(self.certfile, None, self.callsign, None, self.callsign)
-            self.pfxfile.write_bytes(p12bytes)
-
-        await asyncio.get_event_loop().run_in_executor(None, write_pfx)
-        return self.pfxfile
+        """Put cert and key to PKCS12 container (built in the PFXBuilder process pool on first call)"""
+        return await PFXBuilder.singleton().get(self)
 
     async def revoke(self, reason: ReasonTypes) -> bool:
         """Revokes the cert with given reason and makes user deleted see validate_reason for info on reasons"""
         reason = validate_reason(reason)
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             try:
                 self.deleted = datetime.datetime.now(datetime.UTC)
                 self.revoke_reason = str(reason.value)
                 session.add(self)
-                session.commit()
+                await add_notifications(session, self, OutboxEvent.REVOKED)
+                await add_change(session, ChangeKind.PERSON_REVOKED, pk=self.pk, callsign=self.callsign)
+                await session.commit()
+                CallsignIndex.singleton().discard(self.callsign)
+                PrincipalCache.singleton().invalidate(self.callsign)
                 await revoke_pem(self.certfile, reason)
-                await user_revoked(self)
+                OutboxDispatcher.singleton().notify()
             except Exception as exc:
                 LOGGER.exception("Something went wrong, rolling back")
                 raise BackendError(str(exc)) from exc
@@ -191,7 +199,11 @@ class Person(ORMBaseModel, table=True):
             LOGGER.info("Calling self.revoke with reason=privilege_withdrawn")
             return await self.revoke(cryptography.x509.ReasonFlags.privilege_withdrawn)
         LOGGER.error("User has no certificate, this indicates someone created user without using create_with_cert")
-        return await super().delete()
+        deleted = await super().delete()
+        CallsignIndex.singleton().discard(self.callsign)
+        PrincipalCache.singleton().invalidate(self.callsign)
+        await publish_change(ChangeKind.PERSON_DELETED, pk=self.pk, callsign=self.callsign)
+        return deleted
 
     @property
     def productapidata(self) -> UserCRUDRequest:
@@ -253,7 +265,7 @@ class Person(ORMBaseModel, table=True):
     @classmethod
     async def list(cls, include_deleted: bool = False, *, only_deleted: bool = False) -> AsyncGenerator["Person", None]:
         """List people"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(cls)
             if only_deleted:
                 include_deleted = True
@@ -264,38 +276,105 @@ class Person(ORMBaseModel, table=True):
                 statement = statement.where(
                     cls.deleted == None  # noqa: E711
                 )
-            results = session.exec(statement)
-            for result in results:
+            results = await session.stream_scalars(
+                statement.execution_options(yield_per=EngineWrapper.singleton().config.stream_batch_size)
+            )
+            async for result in results:
                 yield result
 
+    @classmethod
+    async def list_with_roles(  # pylint: disable=too-many-arguments
+        cls,
+        include_deleted: bool = False,
+        *,
+        only_deleted: bool = False,
+        role: Optional[str] = None,
+        callsign_prefix: Optional[str] = None,
+        after: Optional[Tuple[datetime.datetime, uuid.UUID]] = None,
+        limit: Optional[int] = None,
+        with_extra: bool = True,
+    ) -> AsyncGenerator[Tuple["Person", Set[str]], None]:
+        """List people with their roles aggregated in the same query, ordered by (created, pk)
+
+        role limits to people having it, after is the (created, pk) keyset of the last row of the previous page.
+        If with_extra is False the extra column is not loaded at all and accessing it raises.
+        """
+        roles = func.array_remove(func.array_agg(Role.role), sa.null())
+        async with EngineWrapper.get_async_session() as session:
+            statement = (
+                select(cls, roles)
+                .outerjoin(Role, col(Role.user) == col(cls.pk))
+                .group_by(col(cls.pk))
+                .order_by(col(cls.created), col(cls.pk))
+            )
+            if only_deleted:
+                include_deleted = True
+                statement = statement.where(
+                    cls.deleted != None  # noqa: E711
+                )
+            if not include_deleted:
+                statement = statement.where(
+                    cls.deleted == None  # noqa: E711
+                )
+            if role is not None:
+                statement = statement.where(col(cls.pk).in_(select(Role.user).where(Role.role == role)))
+            if callsign_prefix:
+                statement = statement.where(
+                    func.lower(cls.callsign).startswith(callsign_prefix.lower(), autoescape=True)
+                )
+            if after is not None:
+                statement = statement.where(sa.tuple_(col(cls.created), col(cls.pk)) > sa.tuple_(*after))
+            if limit is not None:
+                statement = statement.limit(limit)
+            if not with_extra:
+                statement = statement.options(defer(cls.extra, raiseload=True))  # type: ignore[arg-type]
+            results = await session.stream(
+                statement.execution_options(yield_per=EngineWrapper.singleton().config.stream_batch_size)
+            )
+            async for person, person_roles in results:
+                yield person, set(person_roles)
+
     @classmethod
     async def by_role(cls, role: str) -> AsyncGenerator["Person", None]:
         """List people that have given role, if role is None list all people"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(Person, Role).join(Role).where(Role.role == role)
-            results = session.exec(statement)
+            results = await session.exec(statement)
             for person, _roleobj in results:
                 yield person
 
     @classmethod
     async def by_callsign(cls, callsign: str, allow_deleted: bool = False) -> Self:
         """Get by callsign"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(cls).where(func.lower(cls.callsign) == func.lower(callsign))
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
             if not obj:
                 raise NotFound()
             if obj.deleted and not allow_deleted:
                 raise Deleted()
             return obj
 
+    @classmethod
+    async def list_callsigns(cls, include_deleted: bool = False) -> AsyncGenerator[str, None]:
+        """List just the callsigns"""
+        async with EngineWrapper.get_async_session() as session:
+            statement = select(cls.callsign)
+            if not include_deleted:
+                statement = statement.where(
+                    cls.deleted == None  # noqa: E711
+                )
+            results = await session.exec(statement)
+            for result in results:
+                yield result
+
     # FIXME: Change the method name to be clearer about the purpose
     @classmethod
     async def is_callsign_available(cls, callsign: str) -> bool:
         """Is user with this callsign available?"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(cls).where(func.lower(cls.callsign) == func.lower(callsign))
-            data = session.exec(statement).first()
+            data = (await session.exec(statement)).first()
             if not data:
                 return False
             return True
@@ -317,9 +396,9 @@ class Person(ORMBaseModel, table=True):
 
     async def _get_role(self, role: str) -> Optional["Role"]:
         """Internal helper for DRY"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(Role).where(Role.role == role, Role.user == self.pk)
-            obj = session.exec(statement).first()
+            obj = (await session.exec(statement)).first()
             if obj:
                 return obj
         return None
@@ -336,18 +415,22 @@ class Person(ORMBaseModel, table=True):
         if await self.has_role(role):
             if role == "admin":
                 LOGGER.debug("{} already promoted but informing anyway".format(self.callsign))
-                TaskMaster.singleton().create_task(user_promoted(self))
+                await publish_notifications(self, OutboxEvent.PROMOTED)
             return False
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             dbrole = Role(user=self.pk, role=role)
             session.add_all([dbrole])
             self.updated = datetime.datetime.now(datetime.UTC)
             session.add(self)
-            session.commit()
-            session.refresh(self)
+            if role == "admin":
+                await add_notifications(session, self, OutboxEvent.PROMOTED)
+            await add_change(session, ChangeKind.ROLE_ASSIGNED, pk=self.pk, callsign=self.callsign, role=role)
+            await session.commit()
+            await session.refresh(self)
+        PrincipalCache.singleton().invalidate(self.callsign)
         if role == "admin":
             LOGGER.debug("{} promoted, informing".format(self.callsign))
-            TaskMaster.singleton().create_task(user_promoted(self))
+            OutboxDispatcher.singleton().notify()
         return True
 
     async def remove_role(self, role: str) -> bool:
@@ -356,17 +439,21 @@ class Person(ORMBaseModel, table=True):
         if not obj:
             if role == "admin":
                 LOGGER.debug("{} already demoted but informing anyway".format(self.callsign))
-                TaskMaster.singleton().create_task(user_demoted(self))
+                await publish_notifications(self, OutboxEvent.DEMOTED)
             return False
-        with EngineWrapper.get_session() as session:
-            session.delete(obj)
+        async with EngineWrapper.get_async_session() as session:
+            await session.delete(obj)
             self.updated = datetime.datetime.now(datetime.UTC)
             session.add(self)
-            session.commit()
-            session.refresh(self)
+            if role == "admin":
+                await add_notifications(session, self, OutboxEvent.DEMOTED)
+            await add_change(session, ChangeKind.ROLE_REMOVED, pk=self.pk, callsign=self.callsign, role=role)
+            await session.commit()
+            await session.refresh(self)
+        PrincipalCache.singleton().invalidate(self.callsign)
         if role == "admin":
             LOGGER.debug("{} demoted, informing".format(self.callsign))
-            TaskMaster.singleton().create_task(user_demoted(self))
+            OutboxDispatcher.singleton().notify()
         return True
 
     async def roles_set(self) -> Set[str]:
@@ -375,9 +462,9 @@ class Person(ORMBaseModel, table=True):
 
     async def roles(self) -> AsyncGenerator[str, None]:
         """Roles of this person"""
-        with EngineWrapper.get_session() as session:
+        async with EngineWrapper.get_async_session() as session:
             statement = select(Role).where(Role.user == self.pk)
-            results = session.exec(statement)
+            results = await session.exec(statement)
             for result in results:
                 yield result.role
 
@@ -395,46 +482,3 @@ class Role(SQLModel, table=True):
     user: uuid.UUID = Field(foreign_key=f"{ORMBaseModel.__table_args__['schema']}.users.pk")
     role: str = Field(nullable=False, index=True)
     _idx = sa.Index("user_role_unique", "user", "role", unique=True)
-
-
-async def post_user_crud(userinfo: UserCRUDRequest, endpoint_suffix: str) -> None:
-    """Wrapper to be more DRY in the basic CRUD things"""
-    endpoint = f"api/v1/users/{endpoint_suffix}"
-    # We can't do anything about any issues with the responses so don't collect them
-    await post_to_all_products(endpoint, userinfo.model_dump(), OperationResultResponse, collect_responses=False)
-
-
-async def user_created(person: Person) -> None:
-    """New user was created"""
-    await post_user_crud(person.productapidata, "created")
-
-
-async def user_revoked(person: Person) -> None:
-    """Old user was revoked"""
-    kclient = KCClient.singleton()
-    # NOTE: asyncio.gather breaks things in Gino
-    # https://github.com/python-gino/gino/issues/313#issuecomment-427708709
-    await post_user_crud(person.productapidata, "revoked")
-    await kclient.delete_kc_user(await person.get_kcdata())
-
-
-async def user_promoted(person: Person) -> None:
-    """Old user was promoted to admin (granted role 'admin')"""
-    kclient = KCClient.singleton()
-    # NOTE: asyncio.gather breaks things in Gino
-    # https://github.com/python-gino/gino/issues/313#issuecomment-427708709
-    kcuser = await kclient.update_kc_user(await person.get_kcdata())
-    if kcuser and isinstance(kcuser, KCUserData):
-        await Person.update_from_kcdata(kcuser.kc_data)
-    await post_user_crud(person.productapidata, "promoted")
-
-
-async def user_demoted(person: Person) -> None:
-    """Old user was demoted from admin (removed role 'admin')"""
-    kclient = KCClient.singleton()
-    # NOTE: asyncio.gather breaks things in Gino
-    # https://github.com/python-gino/gino/issues/313#issuecomment-427708709
-    kcuser = await kclient.update_kc_user(await person.get_kcdata())
-    if kcuser and isinstance(kcuser, KCUserData):
-        await Person.update_from_kcdata(kcuser.kc_data)
-    await post_user_crud(person.productapidata, "demoted")
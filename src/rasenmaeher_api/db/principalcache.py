@@ -0,0 +1,120 @@
+"""In-process cache of authenticated principals (person + roles) for the ValidUser dependency"""
+
+from typing import ClassVar, Optional, FrozenSet, TYPE_CHECKING
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from ..rmsettings import RMSettings
+from .changes import ChangeListener, ChangeEvent, ChangeKind
+from .callsignindex import fold
+
+if TYPE_CHECKING:
+    from .people import Person
+
+LOGGER = logging.getLogger(__name__)
+
+
+def detached_copy(person: "Person") -> "Person":
+    """Copy of the person that can be changed and added to a session without touching the original"""
+    copied = type(person).model_validate(person.model_dump())
+    make_transient_to_detached(copied)
+    return copied
+
+
+@dataclass
+class Principal:
+    """Cached person and their roles"""
+
+    person: "Person"
+    roles: FrozenSet[str]
+    expires: float
+
+
+@dataclass
+class PrincipalCache:
+    """Active persons and their role sets keyed by case-folded callsign
+
+    The cached Person instances are shared between requests, treat them as read-only and use
+    detached_copy() to get one that can be changed or added to a session. Entries are dropped on revoke/delete and role changes (locally and via change events
+    from other workers) and expire after max_age seconds, least recently used entries
+    are evicted once there are more than max_size of them.
+    """
+
+    entries: "OrderedDict[str, Principal]" = field(default_factory=OrderedDict)
+    max_age: float = field(default_factory=lambda: RMSettings.singleton().principal_cache_max_age)
+    max_size: int = field(default_factory=lambda: RMSettings.singleton().principal_cache_max_size)
+    # Bumped on every invalidation so loads that raced with one are not stored
+    generation: int = field(default=0)
+
+    _singleton: ClassVar[Optional["PrincipalCache"]] = None
+
+    @classmethod
+    def singleton(cls) -> "PrincipalCache":
+        """Return singleton"""
+        if not PrincipalCache._singleton:
+            PrincipalCache._singleton = PrincipalCache()
+            ChangeListener.singleton().subscribe(PrincipalCache._singleton.handle_change)
+        return PrincipalCache._singleton
+
+    def handle_change(self, event: ChangeEvent) -> None:
+        """Drop entries changed by other workers"""
+        if event.kind == ChangeKind.RESET:
+            self.clear()
+        elif event.kind in (
+            ChangeKind.PERSON_REVOKED,
+            ChangeKind.PERSON_DELETED,
+            ChangeKind.PERSON_UPDATED,
+            ChangeKind.ROLE_ASSIGNED,
+            ChangeKind.ROLE_REMOVED,
+        ):
+            self.invalidate(event.data["callsign"])
+
+    def get(self, callsign: str) -> Optional[Principal]:
+        """Return the cached principal if there is a fresh one"""
+        key = fold(callsign)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    async def lookup(self, callsign: str) -> Principal:
+        """Return cached principal or load it from the DB, raises NotFound/Deleted like Person.by_callsign"""
+        entry = self.get(callsign)
+        if entry is not None:
+            return entry
+        # Lazy import to avoid circular imports, people needs to invalidate us
+        from .people import Person  # pylint: disable=import-outside-toplevel
+
+        generation = self.generation
+        person = await Person.by_callsign(callsign)
+        roles = frozenset(await person.roles_set())
+        entry = Principal(person=person, roles=roles, expires=time.monotonic() + self.max_age)
+        if generation == self.generation:
+            self.store(callsign, entry)
+        return entry
+
+    def store(self, callsign: str, entry: Principal) -> None:
+        """Add entry, evicting the least recently used ones if needed"""
+        key = fold(callsign)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, callsign: str) -> None:
+        """Drop the entry for callsign"""
+        self.generation += 1
+        self.entries.pop(fold(callsign), None)
+
+    def clear(self) -> None:
+        """Drop everything"""
+        self.generation += 1
+        self.entries.clear()
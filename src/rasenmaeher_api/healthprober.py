@@ -0,0 +1,121 @@
+"""Periodic background health checks of the product APIs"""
+
+from typing import ClassVar, Optional, Dict, List
+import asyncio
+import datetime
+import logging
+import time
+from dataclasses import dataclass, field
+
+from libadvian.tasks import TaskMaster
+from libpvarki.schemas.product import ProductHealthCheckResponse
+
+from .rmsettings import RMSettings
+from .productapihelpers import check_kraftwerk_manifest, get_from_product
+
+LOGGER = logging.getLogger(__name__)
+PROBER_TASK_NAME = "product_health_prober"
+
+
+@dataclass
+class ProductHealth:
+    """Latest probe result for one product"""
+
+    healthy: bool
+    checked: datetime.datetime
+    latency: float  # seconds
+
+
+@dataclass
+class HealthProber:
+    """Probe every product's healthcheck every interval seconds and keep the latest results
+
+    Concurrent probe() calls (the background loop and ?fresh=true requests) share one round of calls.
+    """
+
+    interval: float = field(default_factory=lambda: RMSettings.singleton().product_health_interval)
+    results: Dict[str, ProductHealth] = field(default_factory=dict)
+    _probing: Optional["asyncio.Task[Dict[str, ProductHealth]]"] = field(default=None, repr=False)
+
+    _singleton: ClassVar[Optional["HealthProber"]] = None
+
+    @classmethod
+    def singleton(cls) -> "HealthProber":
+        """Return singleton"""
+        if not HealthProber._singleton:
+            HealthProber._singleton = HealthProber()
+        return HealthProber._singleton
+
+    @staticmethod
+    def products() -> List[str]:
+        """Names of products in the manifest"""
+        if not check_kraftwerk_manifest():
+            return []
+        return list(RMSettings.singleton().kraftwerk_manifest_dict.get("products", {}).keys())
+
+    async def snapshot(self) -> Dict[str, ProductHealth]:
+        """Latest results, probes first if some product has not been probed yet"""
+        if any(name not in self.results for name in self.products()):
+            return await self.probe()
+        return dict(self.results)
+
+    async def probe(self) -> Dict[str, ProductHealth]:
+        """Probe all products now"""
+        if self._probing is None or self._probing.done():
+            self._probing = TaskMaster.singleton().create_task(self._probe_all())
+        return await asyncio.shield(self._probing)
+
+    async def _probe_all(self) -> Dict[str, ProductHealth]:
+        """Do the calls in parallel"""
+        names = self.products()
+        results = await asyncio.gather(*(self._probe_one(name) for name in names))
+        # Drop products no longer in the manifest
+        self.results = dict(zip(names, results))
+        return dict(self.results)
+
+    @classmethod
+    async def _probe_one(cls, name: str) -> ProductHealth:
+        """Call the healthcheck of one product"""
+        started = time.monotonic()
+        healthy = False
+        try:
+            response = await get_from_product(name, "api/v1/healthcheck", ProductHealthCheckResponse)
+            if response is None:
+                LOGGER.warning("No response from {}".format(name))
+            elif not isinstance(response, ProductHealthCheckResponse) or not response.healthy:
+                LOGGER.warning("Unhealthy report from {}".format(name))
+            else:
+                healthy = True
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Probing {} failed".format(name))
+        return ProductHealth(
+            healthy=healthy,
+            checked=datetime.datetime.now(datetime.UTC),
+            latency=time.monotonic() - started,
+        )
+
+    async def run(self) -> None:
+        """Probe until cancelled"""
+        while True:
+            try:
+                await self.probe()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Health probe round failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Start the prober task"""
+        tma = TaskMaster.singleton()
+        if tma.exists(PROBER_TASK_NAME):
+            return
+        tma.create_task(self.run(), name=PROBER_TASK_NAME)
+
+    async def stop(self) -> None:
+        """Stop the prober task"""
+        tma = TaskMaster.singleton()
+        if not tma.exists(PROBER_TASK_NAME):
+            return
+        try:
+            await tma.stop_named_task_graceful(PROBER_TASK_NAME)
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,192 @@
+"""Pool of pre-generated keypairs for enrollments that do not bring their own CSR"""
+
+from typing import ClassVar, Optional, List, Any
+import asyncio
+import concurrent.futures
+import logging
+import time
+import uuid
+from pathlib import Path
+from dataclasses import dataclass, field
+
+from cryptography.hazmat.primitives import serialization
+from libadvian.tasks import TaskMaster
+from libpvarki.mtlshelp.csr import PRIVDIR_MODE, create_keypair
+
+from .rmsettings import RMSettings
+
+LOGGER = logging.getLogger(__name__)
+REFILLER_TASK_NAME = "keypool_refiller"
+KEY_MODE = 0o600
+# Temporary files older than this are leftovers from interrupted generations
+STALE_TMP_AGE = 600.0
+
+
+def generate_pooled_keypair(privkeypath: Path, pubkeypath: Path) -> None:
+    """Generate keypair under temporary names and rename them ready (runs in the process pool)"""
+    tmppriv = privkeypath.with_suffix(".key.tmp")
+    tmppub = pubkeypath.with_suffix(".pub.tmp")
+    create_keypair(tmppriv, tmppub)
+    tmppriv.chmod(KEY_MODE)
+    # The key file appearing marks the pair ready so rename the public key first
+    tmppub.rename(pubkeypath)
+    tmppriv.rename(privkeypath)
+
+
+@dataclass
+class KeypairPool:
+    """Keep size keypairs ready in persistent_data_dir/private/keypool
+
+    Keys are generated in a process pool so the event loop and the approval path never wait for RSA
+    keygen. take() moves a ready pair to where the person's keys go, the pool is refilled in the
+    background. The directory is shared by the workers, taking a pair is an atomic rename so each pair
+    is used only once. Pairs being generated by any worker are counted from their temporary files so the
+    workers together keep size pairs, not size each. If the pool is disabled (size 0) or empty take()
+    returns None and the caller generates the keys itself.
+    """
+
+    size: int = field(default_factory=lambda: RMSettings.singleton().keypool_size)
+    processes: int = field(default_factory=lambda: RMSettings.singleton().keypool_processes)
+    _executor: Optional[concurrent.futures.ProcessPoolExecutor] = field(default=None, repr=False)
+    _wake: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    _singleton: ClassVar[Optional["KeypairPool"]] = None
+
+    @classmethod
+    def singleton(cls) -> "KeypairPool":
+        """Return singleton"""
+        if not KeypairPool._singleton:
+            KeypairPool._singleton = KeypairPool()
+        return KeypairPool._singleton
+
+    @property
+    def enabled(self) -> bool:
+        """Is the pool in use"""
+        return self.size > 0
+
+    @property
+    def directory(self) -> Path:
+        """Where the keys are kept"""
+        return Path(RMSettings.singleton().persistent_data_dir) / "private" / "keypool"
+
+    def ensure_directory(self) -> Path:
+        """Create the directory with the right permissions"""
+        pooldir = self.directory
+        pooldir.mkdir(parents=True, exist_ok=True)
+        pooldir.chmod(PRIVDIR_MODE)
+        return pooldir
+
+    def ready(self) -> List[Path]:
+        """Private keys of the ready pairs"""
+        try:
+            return sorted(path for path in self.directory.glob("*.key") if path.with_suffix(".pub").exists())
+        except OSError:
+            return []
+
+    def generating(self) -> int:
+        """Pairs being generated by any worker, stale temporary files are not counted"""
+        cutoff = time.time() - STALE_TMP_AGE
+        try:
+            return sum(1 for path in self.directory.glob("*.key.tmp") if path.stat().st_mtime >= cutoff)
+        except OSError:
+            return 0
+
+    async def take(self, privkeypath: Path, pubkeypath: Path) -> Optional[Any]:
+        """Move a ready keypair to the given paths and return the loaded private key, None if none is ready"""
+        if not self.enabled:
+            return None
+        try:
+            for pooledkey in self.ready():
+                try:
+                    # Only one worker can win the rename
+                    pooledkey.rename(privkeypath)
+                except FileNotFoundError:
+                    continue
+                pooledkey.with_suffix(".pub").rename(pubkeypath)
+                LOGGER.debug("Took pre-generated keypair {}".format(pooledkey.stem))
+                return await asyncio.to_thread(
+                    serialization.load_pem_private_key, privkeypath.read_bytes(), password=None
+                )
+            LOGGER.warning("Keypair pool is empty, generating keys inline")
+            return None
+        finally:
+            self.refill()
+
+    def refill(self) -> None:
+        """Wake up the refiller"""
+        self._wake.set()
+
+    async def fill(self) -> int:
+        """Generate keypairs until there are size of them (counting ones being generated by all workers)"""
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=max(self.processes, 1))
+        pooldir = self.ensure_directory()
+        missing = self.size - len(self.ready()) - self.generating()
+        if missing <= 0:
+            return 0
+        loop = asyncio.get_running_loop()
+
+        async def generate_one() -> None:
+            """Generate one pair in the process pool"""
+            privkeypath = pooldir / f"{uuid.uuid4()}.key"
+            pubkeypath = privkeypath.with_suffix(".pub")
+            # Claim the slot right away so the other workers see it, keygen only writes the file at the end
+            tmppriv = privkeypath.with_suffix(".key.tmp")
+            tmppriv.touch(mode=KEY_MODE)
+            try:
+                await loop.run_in_executor(self._executor, generate_pooled_keypair, privkeypath, pubkeypath)
+            finally:
+                # Renamed away on success
+                tmppriv.unlink(missing_ok=True)
+                pubkeypath.with_suffix(".pub.tmp").unlink(missing_ok=True)
+
+        results = await asyncio.gather(*(generate_one() for _ in range(missing)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                LOGGER.error("Generating pooled keypair failed: {}".format(repr(result)))
+        return missing
+
+    def cleanup(self) -> None:
+        """Remove leftovers of generations that were interrupted"""
+        cutoff = time.time() - STALE_TMP_AGE
+        try:
+            for tmpfile in self.directory.glob("*.tmp"):
+                if tmpfile.stat().st_mtime < cutoff:
+                    tmpfile.unlink(missing_ok=True)
+        except OSError as exc:
+            LOGGER.warning("Could not clean up {}: {}".format(self.directory, exc))
+
+    async def run(self) -> None:
+        """Refill when woken up"""
+        while True:
+            self._wake.clear()
+            try:
+                generated = await self.fill()
+                if generated:
+                    LOGGER.info("Generated {} keypairs for the pool".format(generated))
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Keypair pool refill failed")
+            await self._wake.wait()
+
+    def start(self) -> None:
+        """Start the refiller task if the pool is enabled"""
+        if not self.enabled:
+            return
+        tma = TaskMaster.singleton()
+        if tma.exists(REFILLER_TASK_NAME):
+            return
+        self.ensure_directory()
+        self.cleanup()
+        tma.create_task(self.run(), name=REFILLER_TASK_NAME)
+
+    async def stop(self) -> None:
+        """Stop the refiller task and the process pool"""
+        tma = TaskMaster.singleton()
+        if tma.exists(REFILLER_TASK_NAME):
+            try:
+                await tma.stop_named_task_graceful(REFILLER_TASK_NAME)
+            except asyncio.CancelledError:
+                pass
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
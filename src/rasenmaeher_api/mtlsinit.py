@@ -1,12 +1,15 @@
 """Init mTLS client cert for RASENMAEHER itself"""
 
-from typing import Optional
+from typing import Optional, ClassVar
 import asyncio
+import ssl
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
 import logging
 import random
 
-from libpvarki.mtlshelp.session import get_session as libsession
+from libpvarki.mtlshelp import get_ssl_context
 from libpvarki.mtlshelp.csr import async_create_client_csr, async_create_keypair, resolve_filepaths
 import aiohttp
 import filelock
@@ -114,13 +117,79 @@ async def mtls_init() -> None:
         lock.release()
 
 
+@dataclass
+class MTLSIdentity:
+    """Our mTLS client cert and key loaded into one SSLContext that is reused for all outbound connections
+
+    The cert file is checked at most every check_interval seconds and reloaded into the same context
+    when it has changed (renewal), so pooled connectors pick up the new cert for new connections.
+    """
+
+    ssl_context: Optional[ssl.SSLContext] = field(default=None)
+    cert_mtime: Optional[int] = field(default=None)
+    checked_at: Optional[float] = field(default=None)
+    check_interval: float = field(default_factory=lambda: RMSettings.singleton().mtls_client_check_interval)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    _singleton: ClassVar[Optional["MTLSIdentity"]] = None
+
+    @classmethod
+    def singleton(cls) -> "MTLSIdentity":
+        """Return singleton"""
+        if not MTLSIdentity._singleton:
+            MTLSIdentity._singleton = MTLSIdentity()
+        return MTLSIdentity._singleton
+
+    @property
+    def fresh(self) -> bool:
+        """Is the context loaded and recently checked"""
+        if self.ssl_context is None or self.checked_at is None:
+            return False
+        return (time.monotonic() - self.checked_at) < self.check_interval
+
+    async def get_context(self) -> ssl.SSLContext:
+        """Get the context, check for changes if it's time"""
+        if not self.fresh:
+            async with self._lock:
+                if not self.fresh:
+                    await self._load()
+        assert self.ssl_context is not None  # nosec B101
+        return self.ssl_context
+
+    def invalidate(self) -> None:
+        """Check the cert file on next use"""
+        self.checked_at = None
+
+    async def _load(self) -> None:
+        """Init if needed and (re)load the cert if it has changed, caller must hold the lock"""
+        await mtls_init()
+        check_settings_clientpaths()
+        config = RMSettings.singleton()
+        assert config.mtls_client_cert_path is not None  # nosec B101
+        assert config.mtls_client_key_path is not None  # nosec B101
+        cert_path = Path(config.mtls_client_cert_path)
+        key_path = Path(config.mtls_client_key_path)
+        mtime = cert_path.stat().st_mtime_ns
+        if self.ssl_context is None:
+            LOGGER.debug("Loading mTLS client identity from {}".format(cert_path))
+            self.ssl_context = get_ssl_context(ssl.Purpose.SERVER_AUTH, (cert_path, key_path))
+        elif mtime != self.cert_mtime:
+            LOGGER.info("mTLS client cert {} has changed, reloading".format(cert_path))
+            self.ssl_context.load_cert_chain(cert_path, key_path)
+        self.cert_mtime = mtime
+        self.checked_at = time.monotonic()
+
+
 async def get_session_winit() -> aiohttp.ClientSession:
-    """wrap libpvarki get_session to init checks"""
-    await mtls_init()
-    check_settings_clientpaths()
-    config = RMSettings.singleton()
-    assert config.mtls_client_cert_path is not None  # nosec B101
-    assert config.mtls_client_key_path is not None  # nosec B101
-    cert_path = Path(config.mtls_client_cert_path)
-    key_path = Path(config.mtls_client_key_path)
-    return libsession((cert_path, key_path))
+    """New session using our cached mTLS client identity, caller must close it
+
+    libpvarki get_session only takes the cert paths and builds a new context on every call, so this
+    is the same session it makes (default ClientSession over TCPConnector(ssl=context)), keep them in sync.
+    The context itself comes from libpvarki get_ssl_context so its defaults (CA paths, purpose) apply."""
+    connector = aiohttp.TCPConnector(ssl=await get_ssl_context_winit())
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def get_ssl_context_winit() -> ssl.SSLContext:
+    """mTLS client SSL context with our cert, shared by everyone, do not modify"""
+    return await MTLSIdentity.singleton().get_context()
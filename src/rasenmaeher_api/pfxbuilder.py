@@ -0,0 +1,81 @@
+"""PKCS#12 containers built in a process pool on demand"""
+
+from typing import ClassVar, Optional, Dict, TYPE_CHECKING
+import asyncio
+import concurrent.futures
+import logging
+import os
+import uuid
+from pathlib import Path
+from dataclasses import dataclass, field
+
+from libadvian.tasks import TaskMaster
+from libpvarki.mtlshelp.pkcs12 import convert_pem_to_pkcs12
+
+from .rmsettings import RMSettings
+
+if TYPE_CHECKING:
+    from .db.people import Person
+
+LOGGER = logging.getLogger(__name__)
+
+
+def write_pfx(certfile: Path, privkeyfile: Optional[Path], callsign: str, pfxfile: Path) -> None:
+    """Encode the PFX and write it atomically (runs in the process pool)"""
+    p12bytes = convert_pem_to_pkcs12(certfile, privkeyfile, callsign, None, callsign)
+    tmpfile = pfxfile.with_suffix(f".pfx.{os.getpid()}.tmp")
+    tmpfile.write_bytes(p12bytes)
+    tmpfile.replace(pfxfile)
+
+
+@dataclass
+class PFXBuilder:
+    """Build the PFX files of people in a process pool so the encoding does not hold our GIL
+
+    Concurrent builds for the same person share one job. The file is written atomically so if
+    it exists it's complete.
+    """
+
+    processes: int = field(default_factory=lambda: RMSettings.singleton().pfx_processes)
+    _inflight: Dict[uuid.UUID, "asyncio.Task[Path]"] = field(default_factory=dict, repr=False)
+    _executor: Optional[concurrent.futures.ProcessPoolExecutor] = field(default=None, repr=False)
+
+    _singleton: ClassVar[Optional["PFXBuilder"]] = None
+
+    @classmethod
+    def singleton(cls) -> "PFXBuilder":
+        """Return singleton"""
+        if not PFXBuilder._singleton:
+            PFXBuilder._singleton = PFXBuilder()
+        return PFXBuilder._singleton
+
+    async def get(self, person: "Person") -> Path:
+        """Path to persons PFX, built if needed"""
+        task = self._inflight.get(person.pk)
+        if task is None:
+            if person.pfxfile.exists():
+                return person.pfxfile
+            task = TaskMaster.singleton().create_task(self._build(person))
+            self._inflight[person.pk] = task
+        return await asyncio.shield(task)
+
+    async def _build(self, person: "Person") -> Path:
+        """Build unless someone else did it already"""
+        try:
+            if not person.pfxfile.exists():
+                if self._executor is None:
+                    self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=max(self.processes, 1))
+                privkeyfile = person.privkeyfile if person.privkeyfile.exists() else None
+                LOGGER.debug("Building PFX for {}".format(person.callsign))
+                await asyncio.get_running_loop().run_in_executor(
+                    self._executor, write_pfx, person.certfile, privkeyfile, person.callsign, person.pfxfile
+                )
+            return person.pfxfile
+        finally:
+            self._inflight.pop(person.pk, None)
+
+    async def stop(self) -> None:
+        """Shut down the process pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -1,8 +1,13 @@
 """Product integration API helpers"""
 
-from typing import Dict, Optional, Type, Any, Mapping, Tuple
+from typing import Dict, Optional, Type, Any, Mapping, Tuple, ClassVar, Callable, Awaitable
 import asyncio
+import enum
+import hashlib
+import json
 import logging
+import time
+from dataclasses import dataclass, field
 
 import aiohttp
 import pydantic
@@ -11,12 +16,168 @@ from libadvian.tasks import TaskMaster
 
 
 from .rmsettings import RMSettings
-from .mtlsinit import get_session_winit
+from .productclients import ProductClients
 from .cert.backend import refresh_ocsp
+from .cert.errors import CertError
 
 LOGGER = logging.getLogger(__name__)
 
 
+class BreakerState(str, enum.Enum):
+    """Circuit breaker states"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@dataclass
+class CircuitBreaker:
+    """Stop calling a product that keeps failing
+
+    Closed: calls go through, failure_threshold consecutive failures open the breaker.
+    Open: calls are refused right away until reset_timeout seconds have passed.
+    Half-open: up to half_open_calls trial calls go through, a success closes the breaker
+    and a failure opens it again.
+    """
+
+    name: str = field()
+    failure_threshold: int = field(default_factory=lambda: RMSettings.singleton().integration_api_breaker_failures)
+    reset_timeout: float = field(default_factory=lambda: RMSettings.singleton().integration_api_breaker_reset)
+    half_open_calls: int = field(default_factory=lambda: RMSettings.singleton().integration_api_breaker_half_open_calls)
+    state: BreakerState = field(default=BreakerState.CLOSED)
+    failures: int = field(default=0)
+    opened_at: float = field(default=0.0)
+    last_error: Optional[str] = field(default=None)
+    _trials: int = field(default=0, repr=False)
+
+    @property
+    def retry_in(self) -> Optional[float]:
+        """Seconds until an open breaker lets a trial call through"""
+        if self.state != BreakerState.OPEN:
+            return None
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        """Should the call be made, if this returns True the result must be recorded or released"""
+        if self.state == BreakerState.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            LOGGER.info("Circuit for {} half-open, trying again".format(self.name))
+            self.state = BreakerState.HALF_OPEN
+            self._trials = 0
+        if self.state == BreakerState.HALF_OPEN:
+            if self._trials >= self.half_open_calls:
+                return False
+            self._trials += 1
+        return True
+
+    def record_success(self) -> None:
+        """Call went through"""
+        if self.state != BreakerState.CLOSED:
+            LOGGER.info("Circuit for {} closed".format(self.name))
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.last_error = None
+
+    def record_failure(self, error: str) -> None:
+        """Call failed"""
+        self.failures += 1
+        self.last_error = error
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != BreakerState.OPEN:
+                LOGGER.warning("Circuit for {} opened after {} failures".format(self.name, self.failures))
+            self.state = BreakerState.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Allowed call ended without a result (cancelled), give back the trial slot"""
+        if self.state == BreakerState.HALF_OPEN and self._trials > 0:
+            self._trials -= 1
+
+
+@dataclass
+class ProductBreakers:
+    """The circuit breakers for each product"""
+
+    breakers: Dict[str, CircuitBreaker] = field(default_factory=dict)
+
+    _singleton: ClassVar[Optional["ProductBreakers"]] = None
+
+    @classmethod
+    def singleton(cls) -> "ProductBreakers":
+        """Return singleton"""
+        if not ProductBreakers._singleton:
+            ProductBreakers._singleton = ProductBreakers()
+        return ProductBreakers._singleton
+
+    def get(self, productname: str) -> CircuitBreaker:
+        """Get the breaker for named product"""
+        if productname not in self.breakers:
+            self.breakers[productname] = CircuitBreaker(name=productname)
+        return self.breakers[productname]
+
+
+# (product, method, url_suffix, payload hash, response schema)
+CallKey = Tuple[str, str, str, str, Type[pydantic.BaseModel]]
+
+
+def call_key(
+    productname: str,
+    methodname: str,
+    url_suffix: str,
+    data: Optional[Mapping[str, Any]],
+    response_schema: Type[pydantic.BaseModel],
+    headers: Optional[Mapping[str, str]] = None,
+) -> CallKey:
+    """Key identifying identical calls, headers are hashed together with the payload"""
+    payload = json.dumps({"data": data, "headers": headers}, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return (productname, methodname.lower(), url_suffix, digest, response_schema)
+
+
+@dataclass
+class InflightCalls:
+    """Single-flight for product calls, identical concurrent calls share one upstream call and its result
+
+    Only for calls that do not change anything upstream (GETs and the read-only POSTs), a mutating
+    call must reach the product every time. The shared result model is handed to every caller,
+    treat it as read-only.
+    """
+
+    calls: Dict[CallKey, "asyncio.Task[Optional[pydantic.BaseModel]]"] = field(default_factory=dict)
+
+    _singleton: ClassVar[Optional["InflightCalls"]] = None
+
+    @classmethod
+    def singleton(cls) -> "InflightCalls":
+        """Return singleton"""
+        if not InflightCalls._singleton:
+            InflightCalls._singleton = InflightCalls()
+        return InflightCalls._singleton
+
+    async def call(
+        self, key: CallKey, factory: Callable[[], Awaitable[Optional[pydantic.BaseModel]]]
+    ) -> Optional[pydantic.BaseModel]:
+        """Join the call in flight for key or start a new one with factory"""
+        task = self.calls.get(key)
+        if task is None:
+
+            async def run() -> Optional[pydantic.BaseModel]:
+                """Do the call and stop sharing it once done"""
+                try:
+                    return await factory()
+                finally:
+                    self.calls.pop(key, None)
+
+            task = TaskMaster.singleton().create_task(run())
+            self.calls[key] = task
+        else:
+            LOGGER.debug("Joining call in flight to {} {}".format(key[1], key[2]))
+        # One caller giving up must not cancel the call for the others
+        return await asyncio.shield(task)
+
+
 def check_kraftwerk_manifest() -> bool:
     """Check that settings has manifest"""
     RMSettings.singleton().load_manifest()
@@ -24,10 +185,16 @@ def check_kraftwerk_manifest() -> bool:
 
 
 async def post_to_all_products(
-    url_suffix: str, data: Mapping[str, Any], response_schema: Type[pydantic.BaseModel], collect_responses: bool = True
+    url_suffix: str,
+    data: Mapping[str, Any],
+    response_schema: Type[pydantic.BaseModel],
+    collect_responses: bool = True,
+    coalesce: bool = False,
 ) -> Optional[Dict[str, Optional[pydantic.BaseModel]]]:
-    """Call given POST endpoint on all products in the manifest"""
-    return await _method_to_all_products("post", url_suffix, data, response_schema, collect_responses)
+    """Call given POST endpoint on all products in the manifest
+
+    Set coalesce only for read-only endpoints, see InflightCalls"""
+    return await _method_to_all_products("post", url_suffix, data, response_schema, collect_responses, coalesce)
 
 
 async def put_to_all_products(
@@ -41,21 +208,28 @@ async def get_from_all_products(
     url_suffix: str, response_schema: Type[pydantic.BaseModel], collect_responses: bool = True
 ) -> Optional[Dict[str, Optional[pydantic.BaseModel]]]:
     """Call given GET endpoint on all products in the manifest"""
-    return await _method_to_all_products("get", url_suffix, None, response_schema, collect_responses)
+    return await _method_to_all_products("get", url_suffix, None, response_schema, collect_responses, True)
 
 
 async def get_from_product(
     name: str, url_suffix: str, response_schema: Type[pydantic.BaseModel]
 ) -> Optional[pydantic.BaseModel]:
     """Call given GET endpoint on named product in the manifest"""
-    return await _method_to_product(name, "get", url_suffix, None, response_schema)
+    return await _method_to_product(name, "get", url_suffix, None, response_schema, coalesce=True)
 
 
 async def post_to_product(
-    name: str, url_suffix: str, data: Mapping[str, Any], response_schema: Type[pydantic.BaseModel]
+    name: str,
+    url_suffix: str,
+    data: Mapping[str, Any],
+    response_schema: Type[pydantic.BaseModel],
+    headers: Optional[Mapping[str, str]] = None,
+    coalesce: bool = False,
 ) -> Optional[pydantic.BaseModel]:
-    """Call given POST endpoint on named product in the manifest"""
-    return await _method_to_product(name, "post", url_suffix, data, response_schema)
+    """Call given POST endpoint on named product in the manifest
+
+    Set coalesce only for read-only endpoints, see InflightCalls"""
+    return await _method_to_product(name, "post", url_suffix, data, response_schema, headers, coalesce)
 
 
 async def put_to_product(
@@ -71,6 +245,7 @@ async def _method_to_all_products(
     data: Optional[Mapping[str, Any]],
     response_schema: Type[pydantic.BaseModel],
     collect_responses: bool = True,
+    coalesce: bool = False,
 ) -> Optional[Dict[str, Optional[pydantic.BaseModel]]]:
     """Call given POST endpoint on call products in the manifest"""
     if not check_kraftwerk_manifest():
@@ -79,14 +254,22 @@ async def _method_to_all_products(
     if "products" not in manifest:
         LOGGER.error("Manifest does not have products key")
         return None
-    await refresh_ocsp()
+    try:
+        await refresh_ocsp()
+    except CertError as exc:
+        # Reads still get answered, the products just may not have seen the latest revocations yet
+        if not coalesce:
+            raise
+        LOGGER.error("OCSP refresh failed, calling products anyway: {}".format(exc))
     LOGGER.debug("data={}".format(data))
 
     async def handle_one(name: str) -> Tuple[str, Optional[pydantic.BaseModel]]:
         """Do one call"""
-        nonlocal url_suffix, methodname, response_schema, data
+        nonlocal url_suffix, methodname, response_schema, data, coalesce
         try:
-            return name, await _method_to_product(name, methodname, url_suffix, data, response_schema)
+            return name, await _method_to_product(
+                name, methodname, url_suffix, data, response_schema, coalesce=coalesce
+            )
         except Exception as exc:
             LOGGER.exception(exc)
             return name, None
@@ -109,7 +292,26 @@ async def _method_to_product(
     url_suffix: str,
     data: Optional[Mapping[str, Any]],
     response_schema: Type[pydantic.BaseModel],
+    headers: Optional[Mapping[str, str]] = None,
+    coalesce: bool = False,
 ) -> Optional[Optional[pydantic.BaseModel]]:
+    """Do a call to named product, if coalesce is set share it with identical calls in flight"""
+    if not coalesce:
+        return await _call_product(productname, methodname, url_suffix, data, response_schema, headers)
+    key = call_key(productname, methodname, url_suffix, data, response_schema, headers)
+    return await InflightCalls.singleton().call(
+        key, lambda: _call_product(productname, methodname, url_suffix, data, response_schema, headers)
+    )
+
+
+async def _call_product(
+    productname: str,
+    methodname: str,
+    url_suffix: str,
+    data: Optional[Mapping[str, Any]],
+    response_schema: Type[pydantic.BaseModel],
+    headers: Optional[Mapping[str, str]] = None,
+) -> Optional[pydantic.BaseModel]:
     """Do a call to named product"""
 
     manifest = RMSettings.singleton().kraftwerk_manifest_dict
@@ -119,32 +321,50 @@ async def _method_to_product(
     rmconf = RMSettings.singleton()
     productconf = manifest["products"][productname]
 
-    session = await get_session_winit()
-    async with session as client:
-        try:
-            url = f"{productconf['api']}{url_suffix}"
-            LOGGER.debug("calling {}({})".format(methodname, url))
-            if data is None:
-                resp = await getattr(client, methodname)(url, timeout=rmconf.integration_api_timeout)
-            else:
-                resp = await getattr(client, methodname)(
-                    url, json=data, timeout=aiohttp.ClientTimeout(total=rmconf.integration_api_timeout)
-                )
+    breaker = ProductBreakers.singleton().get(productname)
+    url = f"{productconf['api']}{url_suffix}"
+    if not breaker.allow():
+        LOGGER.debug("Circuit for {} is open, not calling {}".format(productname, url))
+        return None
+    try:
+        client = await ProductClients.singleton().get(productname)
+        LOGGER.debug("calling {}({})".format(methodname, url))
+        timeout = aiohttp.ClientTimeout(total=rmconf.integration_api_timeout)
+        if data is None:
+            request = getattr(client, methodname)(url, timeout=timeout, headers=headers)
+        else:
+            request = getattr(client, methodname)(url, json=data, timeout=timeout, headers=headers)
+        # Leaving the context releases the connection back to the pool
+        async with request as resp:
             resp.raise_for_status()
             payload = await resp.json()
-            LOGGER.debug("{}({}) payload={}".format(methodname, url, payload))
-            retval = response_schema.parse_obj(payload)
-            # Log a common error case here for DRY
-            if isinstance(retval, OperationResultResponse):
-                if not retval.success:
-                    LOGGER.error("Failure at {}, response: {}".format(url, retval))
-            return retval
-        except (aiohttp.ClientError, TimeoutError, asyncio.TimeoutError) as exc:
-            LOGGER.error("Failure to call {}: {}".format(url, repr(exc)))
-            return None
-        except pydantic.ValidationError as exc:
-            LOGGER.error("Invalid response from {}: {}".format(url, repr(exc)))
-            return None
-        except Exception:
-            LOGGER.exception("Something went seriously wrong calling {}".format(url))
-            return None
+        breaker.record_success()
+        LOGGER.debug("{}({}) payload={}".format(methodname, url, payload))
+        retval = response_schema.parse_obj(payload)
+        # Log a common error case here for DRY
+        if isinstance(retval, OperationResultResponse):
+            if not retval.success:
+                LOGGER.error("Failure at {}, response: {}".format(url, retval))
+        return retval
+    except aiohttp.ClientResponseError as exc:
+        # The product is up if it can tell us we did something wrong
+        if exc.status < 500:
+            breaker.record_success()
+        else:
+            breaker.record_failure(repr(exc))
+        LOGGER.error("Failure to call {}: {}".format(url, repr(exc)))
+        return None
+    except (aiohttp.ClientError, TimeoutError, asyncio.TimeoutError) as exc:
+        breaker.record_failure(repr(exc))
+        LOGGER.error("Failure to call {}: {}".format(url, repr(exc)))
+        return None
+    except pydantic.ValidationError as exc:
+        LOGGER.error("Invalid response from {}: {}".format(url, repr(exc)))
+        return None
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception as exc:
+        breaker.record_failure(repr(exc))
+        LOGGER.exception("Something went seriously wrong calling {}".format(url))
+        return None
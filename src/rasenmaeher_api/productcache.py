@@ -0,0 +1,126 @@
+"""Stale-while-revalidate cache for product API responses that only change on deploy"""
+
+from typing import ClassVar, Optional, Dict, Tuple, Type
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import pydantic
+from libadvian.tasks import TaskMaster
+
+from .rmsettings import RMSettings
+from .productapihelpers import check_kraftwerk_manifest, get_from_product
+
+LOGGER = logging.getLogger(__name__)
+# (product, url_suffix, language)
+CacheKey = Tuple[str, str, str]
+
+
+@dataclass
+class CachedResponse:
+    """Parsed response and when we got it"""
+
+    value: pydantic.BaseModel
+    fetched: float
+
+
+@dataclass
+class ProductResponseCache:
+    """Cache GET responses from products
+
+    Entries younger than ttl are served as is, older ones (up to ttl + stale seconds) are served
+    while a background refresh fetches a new one. Concurrent misses for the same key share one call,
+    failed calls are not cached (a stale entry stays in use until it's too old). Least recently used
+    entries are evicted once there are more than max_size of them.
+    The cached models are shared between requests, treat them as read-only.
+    """
+
+    ttl: float = field(default_factory=lambda: RMSettings.singleton().product_cache_ttl)
+    stale: float = field(default_factory=lambda: RMSettings.singleton().product_cache_stale)
+    max_size: int = field(default_factory=lambda: RMSettings.singleton().product_cache_max_size)
+    entries: "OrderedDict[CacheKey, CachedResponse]" = field(default_factory=OrderedDict)
+    _inflight: Dict[CacheKey, "asyncio.Task[Optional[pydantic.BaseModel]]"] = field(default_factory=dict, repr=False)
+
+    _singleton: ClassVar[Optional["ProductResponseCache"]] = None
+
+    @classmethod
+    def singleton(cls) -> "ProductResponseCache":
+        """Return singleton"""
+        if not ProductResponseCache._singleton:
+            ProductResponseCache._singleton = ProductResponseCache()
+        return ProductResponseCache._singleton
+
+    async def get(
+        self, productname: str, url_suffix: str, language: str, response_schema: Type[pydantic.BaseModel]
+    ) -> Optional[pydantic.BaseModel]:
+        """Cached get_from_product"""
+        key = (productname, url_suffix, language)
+        entry = self.entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched
+            if age < self.ttl + self.stale:
+                self.entries.move_to_end(key)
+                if age >= self.ttl:
+                    self._refresh(key, response_schema)
+                return entry.value
+            del self.entries[key]
+        return await asyncio.shield(self._refresh(key, response_schema))
+
+    def _refresh(
+        self, key: CacheKey, response_schema: Type[pydantic.BaseModel]
+    ) -> "asyncio.Task[Optional[pydantic.BaseModel]]":
+        """Start fetching key unless it's already being fetched"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = TaskMaster.singleton().create_task(self._fetch(key, response_schema))
+            self._inflight[key] = task
+        return task
+
+    async def _fetch(self, key: CacheKey, response_schema: Type[pydantic.BaseModel]) -> Optional[pydantic.BaseModel]:
+        """Do the call and store the result"""
+        productname, url_suffix, _ = key
+        try:
+            LOGGER.debug("Refreshing {}".format(key))
+            value = await get_from_product(productname, url_suffix, response_schema)
+            if value is not None:
+                self.store(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def store(self, key: CacheKey, value: pydantic.BaseModel) -> None:
+        """Add entry, evicting the least recently used ones if needed"""
+        self.entries[key] = CachedResponse(value=value, fetched=time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop everything"""
+        self.entries.clear()
+
+
+async def cached_get_from_product(
+    name: str, url_suffix: str, language: str, response_schema: Type[pydantic.BaseModel]
+) -> Optional[pydantic.BaseModel]:
+    """Call given GET endpoint on named product in the manifest, through the cache"""
+    return await ProductResponseCache.singleton().get(name, url_suffix, language, response_schema)
+
+
+async def cached_get_from_all_products(
+    url_suffix: str, language: str, response_schema: Type[pydantic.BaseModel]
+) -> Optional[Dict[str, Optional[pydantic.BaseModel]]]:
+    """Call given GET endpoint on all products in the manifest, through the cache"""
+    if not check_kraftwerk_manifest():
+        return None
+    manifest = RMSettings.singleton().kraftwerk_manifest_dict
+    if "products" not in manifest:
+        LOGGER.error("Manifest does not have products key")
+        return None
+    names = list(manifest["products"])
+    results = await asyncio.gather(
+        *(cached_get_from_product(name, url_suffix, language, response_schema) for name in names)
+    )
+    return dict(zip(names, results))
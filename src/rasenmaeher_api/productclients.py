@@ -0,0 +1,67 @@
+"""Long-lived mTLS HTTP clients for the product integration APIs"""
+
+from typing import ClassVar, Optional, Dict
+import logging
+from dataclasses import dataclass, field
+
+import aiohttp
+
+from .rmsettings import RMSettings
+from .mtlsinit import get_ssl_context_winit
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class ProductClients:
+    """One pooled keep-alive aiohttp session per product, all sharing our mTLS SSL context
+
+    Sessions are created at app startup (or on first use) and closed in app shutdown,
+    never close the sessions returned by get() yourself.
+    """
+
+    sessions: Dict[str, aiohttp.ClientSession] = field(default_factory=dict)
+
+    _singleton: ClassVar[Optional["ProductClients"]] = None
+
+    @classmethod
+    def singleton(cls) -> "ProductClients":
+        """Return singleton"""
+        if not ProductClients._singleton:
+            ProductClients._singleton = ProductClients()
+        return ProductClients._singleton
+
+    async def startup(self) -> None:
+        """Create the sessions for products in the manifest"""
+        config = RMSettings.singleton()
+        config.load_manifest()
+        for name in config.kraftwerk_manifest_dict.get("products", {}):
+            await self.get(name)
+
+    async def get(self, productname: str) -> aiohttp.ClientSession:
+        """Get the session for named product"""
+        session = self.sessions.get(productname)
+        if session is not None and not session.closed:
+            return session
+        ssl_ctx = await get_ssl_context_winit()
+        # Someone else may have created it while we awaited
+        session = self.sessions.get(productname)
+        if session is not None and not session.closed:
+            return session
+        config = RMSettings.singleton()
+        connector = aiohttp.TCPConnector(
+            ssl=ssl_ctx,
+            limit=config.integration_api_connections,
+            keepalive_timeout=config.integration_api_keepalive,
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        LOGGER.debug("Created session for {}".format(productname))
+        self.sessions[productname] = session
+        return session
+
+    async def close(self) -> None:
+        """Close all sessions"""
+        sessions, self.sessions = self.sessions, {}
+        for name, session in sessions.items():
+            LOGGER.debug("Closing session for {}".format(name))
+            await session.close()
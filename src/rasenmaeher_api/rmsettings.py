@@ -75,6 +75,38 @@ class RMSettings(BaseSettings):
     kraftwerk_manifest_bool: bool = False
     kraftwerk_manifest_dict: Dict[Any, Any] = {}
     integration_api_timeout: float = 3.0
+    # Pooled keep-alive connections to each product
+    integration_api_connections: int = 16
+    integration_api_keepalive: float = 30.0
+    # How often (seconds) to check if our mTLS client cert file has changed and needs reloading
+    mtls_client_check_interval: float = 60.0
+    # Minimum interval (seconds) between OCSP refreshes, requests in between are coalesced into the next one
+    ocsp_refresh_window: float = 1.0
+    # Stop calling a product after this many consecutive failures, let half_open_calls trial calls through
+    # after reset seconds and close again if they succeed
+    integration_api_breaker_failures: int = 5
+    integration_api_breaker_reset: float = 30.0
+    integration_api_breaker_half_open_calls: int = 1
+    # Product descriptions and instruction fragments are cached for ttl seconds and after that served
+    # for up to stale more seconds while a background refresh runs
+    product_cache_ttl: float = 300.0
+    product_cache_stale: float = 3600.0
+    product_cache_max_size: int = 1024
+    # How often (seconds) the background prober checks the product healthchecks
+    product_health_interval: float = 15.0
+    # User lifecycle notification outbox: claim this many messages at a time, poll this often (seconds)
+    outbox_batch_size: int = 100
+    outbox_poll_interval: float = 5.0
+    # Deliveries in flight per target (product or Keycloak)
+    outbox_product_concurrency: int = 4
+    # Retry failed deliveries after base * 2^(attempts-1) seconds (capped to max), give up after max_attempts
+    outbox_retry_base: float = 2.0
+    outbox_retry_max: float = 600.0
+    outbox_max_attempts: int = 20
+    # Claimed messages not finished within this many seconds can be claimed by another worker
+    outbox_lease: float = 120.0
+    # Delivered and given up outbox messages are deleted after this many seconds
+    outbox_retention: float = 86400.0
 
     # Api access management
     api_client_cert_header: str = "X-ClientCert-DN"
@@ -96,6 +128,16 @@ class RMSettings(BaseSettings):
     ocsprest_host: str = "http://127.0.0.1"
     ocsprest_port: str = "8887"
     cfssl_timeout: float = 2.5
+    # Signing and revocation calls to CFSSL in flight at once, retry on CFSSL DB lock after
+    # base * 2^(attempts-1) seconds (capped to max, with jitter) and give up after max_attempts
+    cfssl_concurrency: int = 4
+    cfssl_retry_base: float = 0.1
+    cfssl_retry_max: float = 5.0
+    cfssl_max_attempts: int = 10
+    # Cache the CA chain for this many seconds (it's also reloaded when the CA files change)
+    ca_cache_ttl: float = 3600.0
+    # Reload the cached CRLs at least this often (also on revocations and on the CRL's nextUpdate)
+    crl_cache_max_age: float = 300.0
 
     # Cert-Manager configuration (used when cert_backend == CERT_MANAGER)
     cert_manager_namespace: str = "opendefense-system"
@@ -106,13 +148,34 @@ class RMSettings(BaseSettings):
     cert_manager_cert_duration: str = "8760h"
     cert_manager_ca_bundle_path: str = "/pvarki-ca/opendefense-ca-cert.pem"
     cert_manager_cleanup_on_revoke: bool = True
+    # Key and cert (with cRLSign usage, normally the issuing CA) for signing the CRL locally,
+    # no CRL is published under cert-manager unless both are set
+    cert_manager_crl_key_path: Optional[str] = None
+    cert_manager_crl_cert_path: Optional[str] = None
+    # Seconds the CRL is valid for, it's re-signed at half of that even if there are no new revocations
+    cert_manager_crl_validity: float = 86400.0
 
     # Shared secret used by the Traefik callsign-validity plugin to auth to the
     # internal websocket. Optional — if unset, the websocket accepts any caller
     # (suitable for in-cluster-only Service exposure during local dev).
     callsign_validity_secret: Optional[str] = None
+    # Max age (seconds) of the in-process callsign index before it's reloaded in background,
+    # bounds how long revocations done by other workers can go unnoticed.
+    callsign_index_max_age: float = 30.0
+    # Cache of authenticated persons and their roles for the ValidUser dependency, entries are also
+    # dropped on revoke and role changes so max_age only bounds staleness of other data (like extra).
+    principal_cache_max_age: float = 60.0
+    principal_cache_max_size: int = 4096
+    # Upper limit for the page size of paginated listings
+    list_max_page_size: int = 500
 
     persistent_data_dir: str = "/data/persistent"
+    # Keep this many keypairs pre-generated for enrollments without CSR (0 disables the pool),
+    # generated in this many processes
+    keypool_size: int = 0
+    keypool_processes: int = 1
+    # Processes building the PKCS#12 (PFX) files
+    pfx_processes: int = 2
 
     # mtls
     mtls_client_cert_path: Optional[str] = None
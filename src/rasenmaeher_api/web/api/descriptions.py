@@ -7,7 +7,7 @@ from fastapi import APIRouter, Depends
 from pydantic import BaseModel, Field, ConfigDict, RootModel
 from libpvarki.middleware import MTLSHeader
 from rasenmaeher_api.web.api.middleware.user import ValidUser
-from ...productapihelpers import get_from_all_products, get_from_product
+from ...productcache import cached_get_from_all_products, cached_get_from_product
 
 LOGGER = logging.getLogger(__name__)
 
@@ -65,7 +65,7 @@ class ProductDescriptionExtendedList(RootModel[List[ProductDescriptionExtended]]
 )
 async def list_product_descriptions(language: str) -> ProductDescriptionList:
     """Fetch description from each product in manifest"""
-    responses = await get_from_all_products(f"api/v1/description/{language}", ProductDescription)
+    responses = await cached_get_from_all_products(f"api/v1/description/{language}", language, ProductDescription)
     if responses is None:
         raise ValueError("Everything is broken")
     return ProductDescriptionList([cast(ProductDescription, res) for res in responses.values() if res])
@@ -77,7 +77,7 @@ async def list_product_descriptions(language: str) -> ProductDescriptionList:
 )
 async def get_product_description(language: str, product: str) -> Optional[ProductDescription]:
     """Fetch description from given product in manifest"""
-    response = await get_from_product(product, f"api/v1/description/{language}", ProductDescription)
+    response = await cached_get_from_product(product, f"api/v1/description/{language}", language, ProductDescription)
     if response is None:
         # TODO: Raise a reasonable error instead
         return None
@@ -91,7 +91,9 @@ async def get_product_description(language: str, product: str) -> Optional[Produ
 )
 async def list_product_descriptions_extended(language: str) -> ProductDescriptionExtendedList:
     """Fetch description from each product in manifest"""
-    responses = await get_from_all_products(f"api/v2/description/{language}", ProductDescriptionExtended)
+    responses = await cached_get_from_all_products(
+        f"api/v2/description/{language}", language, ProductDescriptionExtended
+    )
     if responses is None:
         raise ValueError("Everything is broken")
     return ProductDescriptionExtendedList([cast(ProductDescriptionExtended, res) for res in responses.values() if res])
@@ -103,7 +105,9 @@ async def list_product_descriptions_extended(language: str) -> ProductDescriptio
 )
 async def get_product_description_extended(language: str, product: str) -> Optional[ProductDescriptionExtended]:
     """Fetch description from given product in manifest"""
-    response = await get_from_product(product, f"api/v2/description/{language}", ProductDescriptionExtended)
+    response = await cached_get_from_product(
+        product, f"api/v2/description/{language}", language, ProductDescriptionExtended
+    )
 
     if response is None:
         # TODO: Raise a reasonable error instead
@@ -119,7 +123,9 @@ async def get_product_description_extended(language: str, product: str) -> Optio
 )
 async def list_admin_product_descriptions_extended(language: str) -> ProductDescriptionExtendedList:
     """Fetch admin description from each product in manifest"""
-    responses = await get_from_all_products(f"api/v2/admin/description/{language}", ProductDescriptionExtended)
+    responses = await cached_get_from_all_products(
+        f"api/v2/admin/description/{language}", language, ProductDescriptionExtended
+    )
     if responses is None:
         raise ValueError("Everything is broken")
     return ProductDescriptionExtendedList([cast(ProductDescriptionExtended, res) for res in responses.values() if res])
@@ -132,7 +138,9 @@ async def list_admin_product_descriptions_extended(language: str) -> ProductDesc
 )
 async def get_admin_product_description_extended(language: str, product: str) -> Optional[ProductDescriptionExtended]:
     """Fetch admin description from given product in manifest"""
-    response = await get_from_product(product, f"api/v2/admin/description/{language}", ProductDescriptionExtended)
+    response = await cached_get_from_product(
+        product, f"api/v2/admin/description/{language}", language, ProductDescriptionExtended
+    )
 
     if response is None:
         # TODO: Raise a reasonable error instead
@@ -42,8 +42,6 @@ async def get_user_pem(
             ),
         )
         raise HTTPException(status_code=403, detail="Callsign must match authenticated user")
-    # Make sure the pfx exists, this is no-op if it does
-    await person.create_pfx()
 
     LOGGER.audit(  # type: ignore[attr-defined]
         "Certificate downloaded",
@@ -99,8 +97,8 @@ async def get_user_pfx(
             ),
         )
         raise HTTPException(status_code=403, detail="Callsign must match authenticated user")
-    # Make sure the pfx exists, this is no-op if it does
-    await person.create_pfx()
+    # Built on first request, later ones get the remembered path
+    pfxfile = await person.create_pfx()
 
     LOGGER.audit(  # type: ignore[attr-defined]
         "Certificate downloaded",
@@ -114,7 +112,7 @@ async def get_user_pfx(
     )
 
     return FileResponse(
-        path=person.pfxfile,
+        path=pfxfile,
         media_type="application/x-pkcs12",
         filename=f"{callsign}_{RMSettings.singleton().deployment_name}.pfx",
     )
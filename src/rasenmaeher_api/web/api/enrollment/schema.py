@@ -331,6 +331,14 @@ class EnrollmentIsInvitecodeActiveOut(BaseModel):
     invitecode_is_active: bool
 
 
+class EnrollmentListItem(BaseModel):
+    """Items for EnrollmentListOut when streaming, the non-streaming response uses plain dicts of the same shape"""
+
+    callsign: str
+    approvecode: str
+    state: int
+
+
 class EnrollmentListOut(BaseModel, extra="forbid"):
     """Enrollment list out response schema"""
 
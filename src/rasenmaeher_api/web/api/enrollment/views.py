@@ -1,11 +1,12 @@
 """Enrollment API views."""
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union, AsyncGenerator
 import logging
 import uuid
 
 
 from fastapi import APIRouter, Request, Body, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from multikeyjwt import Issuer
 from multikeyjwt import config as jwtconfig
 
@@ -32,10 +33,12 @@ from .schema import (
     EnrollmentInviteCodeDeactivateIn,
     EnrollmentPoolListOut,
     EnrollmentPoolListItem,
+    EnrollmentListItem,
 )
 from ..middleware.mtls import MTLSorJWT
 from ..middleware.user import ValidUser
 from ..utils.auditcontext import build_audit_extra
+from ..utils.streaming import streaming_json_list
 from ....db import Person
 from ....db import Enrollment, EnrollmentPool
 from ....db.errors import NotFound
@@ -52,25 +55,30 @@ NO_JWT_ENROLLMENT_ROUTER = APIRouter()
     response_model=EnrollmentPoolListOut,
     dependencies=[Depends(ValidUser(auto_error=True, require_roles=["admin"]))],
 )
-async def list_pools(owner_cs: Optional[str] = None) -> EnrollmentPoolListOut:
-    """List EnrollmentPools (aka invitecodes)"""
+async def list_pools(
+    owner_cs: Optional[str] = None, stream: bool = False
+) -> Union[EnrollmentPoolListOut, StreamingResponse]:
+    """List EnrollmentPools (aka invitecodes), stream=true sends them as they are read from the DB"""
     owner: Optional[Person] = None
     if owner_cs:
         owner = await Person.by_callsign(owner_cs)
-    pools: List[EnrollmentPoolListItem] = []
     owner_cache: Dict[uuid.UUID, Person] = {}
-    async for pool in EnrollmentPool.list(owner):
-        if pool.owner not in owner_cache:
-            owner_cache[pool.owner] = await Person.by_pk(pool.owner, allow_deleted=True)
-        pools.append(
-            EnrollmentPoolListItem(
+
+    async def items() -> AsyncGenerator[EnrollmentPoolListItem, None]:
+        """Pools to list items"""
+        async for pool in EnrollmentPool.list(owner):
+            if pool.owner not in owner_cache:
+                owner_cache[pool.owner] = await Person.by_pk(pool.owner, allow_deleted=True)
+            yield EnrollmentPoolListItem(
                 invitecode=pool.invitecode,
                 active=pool.active,
                 owner_cs=owner_cache[pool.owner].callsign,
                 created=pool.created.isoformat(),
             )
-        )
-    return EnrollmentPoolListOut(pools=pools)
+
+    if stream:
+        return streaming_json_list("pools", items())
+    return EnrollmentPoolListOut(pools=[item async for item in items()])
 
 
 @ENROLLMENT_ROUTER.post("/generate-verification-code", response_model=EnrollmentGenVerifiOut)
@@ -166,12 +174,15 @@ async def request_enrolment_status(
     response_model=EnrollmentListOut,
     dependencies=[Depends(ValidUser(auto_error=True, require_roles=["admin"]))],
 )
-async def request_enrollment_list(code: Optional[str] = None) -> EnrollmentListOut:
+async def request_enrollment_list(
+    code: Optional[str] = None, stream: bool = False
+) -> Union[EnrollmentListOut, StreamingResponse]:
     """
     /list
     Return users/callsign/enrollments. If 'accepted' has something else than '', it has been accepted.
     Returns a list of dicts, callsign_list = [ {  "callsign":'x', 'state':'init', 'approvecode':'' } ]
     if ?code= is given the results are filtered by that approvecode
+    stream=true sends the enrollments as they are read from the DB instead of collecting them first
     """
 
     result_list: List[Dict[Any, Any]] = []
@@ -182,6 +193,15 @@ async def request_enrollment_list(code: Optional[str] = None) -> EnrollmentListO
         except NotFound:
             pass
         return EnrollmentListOut(callsign_list=result_list)
+
+    if stream:
+        return streaming_json_list(
+            "callsign_list",
+            (
+                EnrollmentListItem(callsign=enrollment.callsign, approvecode="", state=enrollment.state)
+                async for enrollment in Enrollment.list()
+            ),
+        )
     async for enrollment in Enrollment.list():
         result_list.append({"callsign": enrollment.callsign, "approvecode": "", "state": enrollment.state})
 
@@ -1,6 +1,7 @@
 """Healthcheck response schemas"""
 
-from typing import Dict
+from typing import Dict, Optional
+import datetime
 
 from pydantic import BaseModel, Field, ConfigDict
 
@@ -30,6 +31,42 @@ class BasicHealthCheckResponse(BaseModel):
     rm_version: str = Field(description="Version of the API package")
 
 
+class ProductCircuitState(BaseModel):
+    """Circuit breaker state for a product API"""
+
+    model_config = ConfigDict(
+        extra="forbid",
+        json_schema_extra={
+            "examples": [
+                {"state": "closed", "failures": 0, "retry_in": None, "last_error": None},
+                {"state": "open", "failures": 5, "retry_in": 12.5, "last_error": "ClientConnectorError(...)"},
+            ]
+        },
+    )
+
+    state: str = Field(description="closed (calls go through), open (calls are skipped) or half_open (trying again)")
+    failures: int = Field(description="Consecutive failed calls")
+    retry_in: Optional[float] = Field(default=None, description="Seconds until an open circuit is tried again")
+    last_error: Optional[str] = Field(default=None, description="Error from the latest failed call")
+
+
+class ProductProbeResult(BaseModel):
+    """Latest healthcheck probe of a product API"""
+
+    model_config = ConfigDict(
+        extra="forbid",
+        json_schema_extra={
+            "examples": [
+                {"healthy": True, "checked": "2024-01-01T12:00:00Z", "latency": 0.012},
+            ]
+        },
+    )
+
+    healthy: bool = Field(description="Did the product report itself healthy")
+    checked: datetime.datetime = Field(description="When the probe was made")
+    latency: float = Field(description="How long the probe took (seconds)")
+
+
 class AllProductsHealthCheckResponse(BaseModel):
     """Check status of all products in manifest"""
 
@@ -56,3 +93,40 @@ class AllProductsHealthCheckResponse(BaseModel):
 
     all_ok: bool = Field(description="Is everything ok ?")
     products: Dict[str, bool] = Field(description="Status for each product")
+    probes: Dict[str, ProductProbeResult] = Field(
+        default_factory=dict, description="Latest probe result for each product"
+    )
+    circuits: Dict[str, ProductCircuitState] = Field(
+        default_factory=dict, description="Circuit breaker state for each product"
+    )
+
+
+class SignQueueState(BaseModel):
+    """Counters of the CFSSL signing/revocation queue"""
+
+    model_config = ConfigDict(
+        extra="forbid",
+        json_schema_extra={
+            "examples": [
+                {
+                    "depth": 3,
+                    "waiting": 0,
+                    "running": 2,
+                    "backing_off": 1,
+                    "max_waiting": 12,
+                    "completed": 120,
+                    "retries": 7,
+                    "failed": 0,
+                },
+            ]
+        },
+    )
+
+    depth: int = Field(description="Calls not finished yet")
+    waiting: int = Field(description="Calls waiting for a slot")
+    running: int = Field(description="Calls in progress")
+    backing_off: int = Field(description="Calls waiting to retry after CFSSL reported its database locked")
+    max_waiting: int = Field(description="Most calls seen waiting for a slot at once")
+    completed: int = Field(description="Successful calls")
+    retries: int = Field(description="Retries due to locked database")
+    failed: int = Field(description="Calls that failed (including the ones that ran out of attempts)")
@@ -1,17 +1,24 @@
 """Healthcheck API views."""
 
-from typing import cast
 import logging
 import os
+from contextlib import aclosing
 
 from fastapi import APIRouter
-from libpvarki.schemas.product import ProductHealthCheckResponse
 
 from rasenmaeher_api import __version__
-from .schema import BasicHealthCheckResponse, AllProductsHealthCheckResponse
+from .schema import (
+    BasicHealthCheckResponse,
+    AllProductsHealthCheckResponse,
+    ProductCircuitState,
+    ProductProbeResult,
+    SignQueueState,
+)
 from ....db import Person
 from ....rmsettings import switchme_to_singleton_call
-from ....productapihelpers import check_kraftwerk_manifest, get_from_all_products
+from ....productapihelpers import check_kraftwerk_manifest, ProductBreakers
+from ....healthprober import HealthProber
+from ....cert.cfssl.signqueue import SignQueue
 
 router = APIRouter()
 LOGGER = logging.getLogger(__name__)
@@ -25,8 +32,9 @@ async def request_healthcheck() -> BasicHealthCheckResponse:
     - Domain name from manifest
     """
     # Do at least little bit something to check backend functionality
-    async for _ in Person.list():
-        break
+    async with aclosing(Person.list()) as people:
+        async for _ in people:
+            break  # aclosing releases the streaming cursor right away
 
     # Get the DNS from manifest
     my_dn: str = "Manifest not defined"
@@ -49,27 +57,51 @@ async def request_healthcheck() -> BasicHealthCheckResponse:
 
 
 @router.get("/services")
-async def request_healthcheck_services() -> AllProductsHealthCheckResponse:
+async def request_healthcheck_services(fresh: bool = False) -> AllProductsHealthCheckResponse:
     """Return the states of products' apis and if everything is ok
 
+    The states come from the background prober, use fresh=true to probe the products now.
+    Products whose circuit is open are not called and are reported as not ok.
     Note that HTTP status-code is 200 even if all_ok is False"""
 
     ret = AllProductsHealthCheckResponse(all_ok=True, products={})
-    statuses = await get_from_all_products("api/v1/healthcheck", ProductHealthCheckResponse)
+    prober = HealthProber.singleton()
+    statuses = await (prober.probe() if fresh else prober.snapshot())
     if not statuses:
         LOGGER.error("Did not get anything back")
         ret.all_ok = False
         return ret
-    for productname, response in statuses.items():
-        if not response:
-            LOGGER.warning("No response from {}, setting all_ok to False".format(productname))
-            ret.products[productname] = False
-            ret.all_ok = False
-            continue
-        response = cast(ProductHealthCheckResponse, response)
-        ret.products[productname] = response.healthy
-        if not response.healthy:
-            LOGGER.warning("Unhealthy report from {}, setting all_ok to False".format(productname))
+    breakers = ProductBreakers.singleton()
+    for productname, status in statuses.items():
+        breaker = breakers.get(productname)
+        ret.circuits[productname] = ProductCircuitState(
+            state=breaker.state.value,
+            failures=breaker.failures,
+            retry_in=breaker.retry_in,
+            last_error=breaker.last_error,
+        )
+        ret.probes[productname] = ProductProbeResult(
+            healthy=status.healthy, checked=status.checked, latency=status.latency
+        )
+        ret.products[productname] = status.healthy
+        if not status.healthy:
+            LOGGER.warning("{} is not healthy, setting all_ok to False".format(productname))
             ret.all_ok = False
 
     return ret
+
+
+@router.get("/signing")
+async def request_healthcheck_signing() -> SignQueueState:
+    """Return the CFSSL signing/revocation queue counters"""
+    queue = SignQueue.singleton()
+    return SignQueueState(
+        depth=queue.depth,
+        waiting=queue.waiting,
+        running=queue.running,
+        backing_off=queue.backing_off,
+        max_waiting=queue.max_waiting,
+        completed=queue.completed,
+        retries=queue.retries,
+        failed=queue.failed,
+    )
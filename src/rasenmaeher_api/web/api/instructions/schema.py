@@ -72,3 +72,24 @@ class ProductData(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
     data: Dict[str, Any] = Field(description="User data required for modular UI.")
+
+
+class AllProductsData(BaseModel):
+    """Product user data for modular UI from all products"""
+
+    model_config = ConfigDict(
+        extra="forbid",
+        json_schema_extra={
+            "examples": [
+                {
+                    "products": {"tak": {"data": {"foo": "bar"}}, "nosuchproduct": None},
+                    "errors": {"nosuchproduct": "No valid response"},
+                },
+            ],
+        },
+    )
+
+    products: Dict[str, Optional[ProductData]] = Field(
+        description="Data keyed by product short name, if fetching failed value for that product is null"
+    )
+    errors: Dict[str, str] = Field(default_factory=dict, description="Why fetching failed, keyed by product short name")
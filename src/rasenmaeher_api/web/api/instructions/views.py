@@ -13,9 +13,11 @@ from .schema import (
     AllProductsInstructionFiles,
     InstructionData,
     ProductData,
+    AllProductsData,
 )
 from ..middleware.user import ValidUser
-from ....productapihelpers import get_from_all_products, post_to_all_products, post_to_product
+from ....productapihelpers import post_to_all_products, post_to_product, ProductBreakers, BreakerState
+from ....productcache import cached_get_from_all_products
 from ....db import Person
 
 LOGGER = logging.getLogger(__name__)
@@ -32,7 +34,8 @@ router_v2_admin = APIRouter(dependencies=[Depends(MTLSHeader(auto_error=True))])
 )
 async def admin_instruction_fragment() -> AllProductsInstructionFragments:
     """Return admin instructions"""
-    responses = await get_from_all_products("api/v1/admins/fragment", UserInstructionFragment)
+    # Same for everyone, user specific instructions below are not cached
+    responses = await cached_get_from_all_products("api/v1/admins/fragment", "", UserInstructionFragment)
     if responses is None:
         raise ValueError("Everything is broken")
     return AllProductsInstructionFragments(
@@ -53,7 +56,7 @@ async def user_instruction_fragment(request: Request) -> AllProductsInstructionF
         uuid=str(person.pk), callsign=person.callsign, x509cert=person.certfile.read_text(encoding="utf-8")
     )
     LOGGER.debug("person={}, user={}".format(person, user))
-    responses = await post_to_all_products("api/v1/clients/fragment", user.model_dump(), ProductFileList)
+    responses = await post_to_all_products("api/v1/clients/fragment", user.model_dump(), ProductFileList, coalesce=True)
     if responses is None:
         raise ValueError("Everything is broken")
     return AllProductsInstructionFiles(files={key: cast(ProductFileList, val) for key, val in responses.items()})
@@ -71,7 +74,7 @@ async def get_product_instructions(request: Request, product: str, language: str
         uuid=str(person.pk), callsign=person.callsign, x509cert=person.certfile.read_text(encoding="utf-8")
     )
     endpoint_url = f"api/v1/instructions/{language}"
-    response = await post_to_product(product, endpoint_url, user.model_dump(), InstructionData)
+    response = await post_to_product(product, endpoint_url, user.model_dump(), InstructionData, coalesce=True)
     if response is None:
         _reason = f"Unable to get instructions for {product}"
         LOGGER.error("{} : {}".format(request.url, _reason))
@@ -80,6 +83,33 @@ async def get_product_instructions(request: Request, product: str, language: str
     return response
 
 
+@router_v2.get(
+    "/data",
+    dependencies=[Depends(ValidUser(auto_error=True))],
+)
+async def get_all_products_data(request: Request) -> AllProductsData:
+    """Get component data from all products at once
+
+    The products are called concurrently, each with its own timeout, and failures are reported per product"""
+    person = cast(Person, request.state.person)
+    user = UserCRUDRequest(
+        uuid=str(person.pk), callsign=person.callsign, x509cert=person.certfile.read_text(encoding="utf-8")
+    )
+    responses = await post_to_all_products("api/v2/clients/data", user.model_dump(), ProductData, coalesce=True)
+    if responses is None:
+        raise HTTPException(status_code=500, detail="No products in manifest")
+    ret = AllProductsData(products={})
+    for productname, response in responses.items():
+        ret.products[productname] = cast(Optional[ProductData], response)
+        if response is None:
+            if ProductBreakers.singleton().get(productname).state == BreakerState.OPEN:
+                ret.errors[productname] = "Product is not responding, not called"
+            else:
+                ret.errors[productname] = "No valid response"
+            LOGGER.error("{} : Unable to get data for {}".format(request.url, productname))
+    return ret
+
+
 @router_v2.get(
     "/data/{product}",
     dependencies=[Depends(ValidUser(auto_error=True))],
@@ -91,7 +121,7 @@ async def get_product_data(request: Request, product: str) -> Optional[ProductDa
         uuid=str(person.pk), callsign=person.callsign, x509cert=person.certfile.read_text(encoding="utf-8")
     )
     endpoint_url = "api/v2/clients/data"
-    response = await post_to_product(product, endpoint_url, user.model_dump(), ProductData)
+    response = await post_to_product(product, endpoint_url, user.model_dump(), ProductData, coalesce=True)
     if response is None:
         _reason = f"Unable to get data for {product}"
         LOGGER.error("{} : {}".format(request.url, _reason))
@@ -111,7 +141,7 @@ async def get_admin_product_data(request: Request, product: str) -> Optional[Pro
         uuid=str(person.pk), callsign=person.callsign, x509cert=person.certfile.read_text(encoding="utf-8")
     )
     endpoint_url = "api/v2/admin/clients/data"
-    response = await post_to_product(product, endpoint_url, user.model_dump(), ProductData)
+    response = await post_to_product(product, endpoint_url, user.model_dump(), ProductData, coalesce=True)
     if response is None:
         _reason = f"Unable to get data for {product}"
         LOGGER.error("{} : {}".format(request.url, _reason))
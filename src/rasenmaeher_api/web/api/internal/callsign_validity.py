@@ -16,6 +16,10 @@ Wire protocol:
     -> 200 {"valid": <bool>}
     -> 400 if body is malformed
 
+Answers come from the in-process ``CallsignIndex`` (see ``db/callsignindex.py``),
+built at startup and kept current by user create/revoke and change events from
+other workers, misses are not re-checked from the DB.
+
 Auth: if ``RM_CALLSIGN_VALIDITY_SECRET`` is set, the client must send a
 matching ``X-Validity-Secret`` header. Otherwise the endpoint is open
 (suitable for in-cluster-only Service exposure).
@@ -31,8 +35,7 @@ import logging
 from fastapi import APIRouter, Header, HTTPException, status
 from pydantic import BaseModel
 
-from ....db.errors import NotFound, Deleted
-from ....db.people import Person
+from ....db.callsignindex import CallsignIndex
 from ....rmsettings import RMSettings
 
 
@@ -57,22 +60,11 @@ def _check_secret(provided: Optional[str]) -> None:
 
 
 async def _is_valid(callsign: str) -> bool:
-    settings = RMSettings.singleton()
     # Service identities from the kraftwerk manifest (product backends like TAK,
     # battlelog) and the rmapi self-CN are trusted by virtue of the CA chain;
-    # they don't appear in the Person table.
-    if callsign == settings.mtls_client_cert_cn:
-        return True
-    try:
-        if callsign in settings.valid_product_cns:
-            return True
-    except Exception:  # pylint: disable=broad-except
-        LOGGER.debug("valid_product_cns lookup failed", exc_info=True)
-    try:
-        await Person.by_callsign(callsign)
-        return True
-    except (NotFound, Deleted):
-        return False
+    # they don't appear in the Person table. The index holds both those and
+    # the active callsigns so the common case never touches the DB.
+    return await CallsignIndex.singleton().is_valid(callsign)
 
 
 @router.post("/check", response_model=CheckResponse)
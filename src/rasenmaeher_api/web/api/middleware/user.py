@@ -7,6 +7,7 @@ from fastapi import Request, HTTPException
 
 
 from ....db.people import Person
+from ....db.principalcache import PrincipalCache
 from ....db.errors import DBError, NotFound, Deleted
 from .mtls import MTLSorJWT
 from .datatypes import MTLSorJWTPayloadType
@@ -16,7 +17,11 @@ LOGGER = logging.getLogger(__name__)
 
 
 class ValidUser(MTLSorJWT):
-    """Check that the subject is a valid user"""
+    """Check that the subject is a valid user
+
+    The returned person (also in request.state.person) comes from PrincipalCache and is shared with
+    other requests, use principalcache.detached_copy() before changing it or adding it to a session.
+    """
 
     def __init__(self, *, auto_error: bool = True, require_roles: Sequence[str] = ()):
         self.require_roles = require_roles
@@ -41,18 +46,16 @@ class ValidUser(MTLSorJWT):
             return cast(None, request.state.person)
 
         try:
-            request.state.person = await Person.by_callsign(payload.userid)
+            principal = await PrincipalCache.singleton().lookup(payload.userid)
         except DBError as exc:
             if isinstance(exc, (NotFound, Deleted)):
                 if self.auto_error:
                     raise HTTPException(status_code=403, detail="Invalid userid in payload") from exc
-            else:
-                raise HTTPException(status_code=500, detail="DB failure when looking for user") from exc
-
-        if not request.state.person:
-            return cast(None, request.state.person)
+                return cast(None, request.state.person)
+            raise HTTPException(status_code=500, detail="DB failure when looking for user") from exc
 
-        roles = await request.state.person.roles_set()
+        request.state.person = principal.person
+        roles = principal.roles
         required = set(self.require_roles)
         LOGGER.debug("required={} roles={}".format(required, roles))
         if not required.issubset(roles):
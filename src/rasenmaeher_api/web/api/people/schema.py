@@ -2,7 +2,7 @@
 
 from typing import List, Dict, Any, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class CallSignPerson(BaseModel):
@@ -18,3 +18,6 @@ class PeopleListOut(BaseModel, extra="forbid"):
     """People list out response schema"""
 
     callsign_list: List[CallSignPerson]
+    next_cursor: Optional[str] = Field(
+        default=None, description="Pass as cursor to get the next page, null when there are no more pages"
+    )
@@ -1,9 +1,13 @@
 """People API views."""
 
-from typing import List, Optional
+from typing import List, Optional, Tuple, Set, Union, AsyncIterable, AsyncGenerator
+import base64
+import datetime
 import logging
+import uuid
 
-from fastapi import APIRouter, Request, Depends, HTTPException
+from fastapi import APIRouter, Request, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from libpvarki.schemas.generic import OperationResultResponse
 
 from .schema import (
@@ -13,41 +17,123 @@ from .schema import (
 from ..middleware.mtls import MTLSorJWT
 from ..middleware.user import ValidUser
 from ..utils.auditcontext import build_audit_extra
+from ..utils.streaming import streaming_json_list
 from ....db import Person
 from ....db.errors import BackendError, NotFound
+from ....rmsettings import RMSettings
 
 LOGGER = logging.getLogger(__name__)
 
 router = APIRouter(dependencies=[Depends(MTLSorJWT(auto_error=True))])
 
 
+def _encode_cursor(person: Person) -> str:
+    """Opaque cursor for the keyset (created, pk) of the last person on page"""
+    return base64.urlsafe_b64encode(f"{person.created.isoformat()}|{person.pk}".encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime.datetime, uuid.UUID]:
+    """Parse cursor from _encode_cursor"""
+    try:
+        created, pk = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.datetime.fromisoformat(created), uuid.UUID(pk)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+
+def _list_item(dbperson: Person, roles: Set[str], extra: bool = True) -> CallSignPerson:
+    """Person to list item"""
+    revoked_date: Optional[str] = None
+    if dbperson.deleted:
+        revoked_date = dbperson.deleted.isoformat()
+    return CallSignPerson(
+        callsign=dbperson.callsign,
+        roles=list(roles),
+        extra=dbperson.extra if extra else None,
+        revoked=revoked_date,
+    )
+
+
+async def _skip_anon(
+    people: AsyncIterable[Tuple[Person, Set[str]]],
+) -> AsyncGenerator[Tuple[Person, Set[str]], None]:
+    """Skip the "dummy" user for anon_admin"""
+    async for dbperson, roles in people:
+        if dbperson.callsign == "anon_admin":
+            continue
+        yield dbperson, roles
+
+
 @router.get(
     "/list", response_model=PeopleListOut, dependencies=[Depends(ValidUser(auto_error=True, require_roles=["admin"]))]
 )
-async def request_people_list(revoked: bool = False) -> PeopleListOut:
+async def request_people_list(  # pylint: disable=too-many-arguments,too-many-locals
+    revoked: bool = False,
+    only_revoked: bool = False,
+    role: Optional[str] = None,
+    callsign_prefix: Optional[str] = None,
+    extra: bool = True,
+    limit: Optional[int] = Query(default=None, ge=1),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+) -> Union[PeopleListOut, StreamingResponse]:
     """
     /list
     Return people/list.
     Returns a list of dicts, callsign_list = [ {  "callsign":'x', "roles": ["str"] 'extra':'x' } ]
 
-    if revoked is given will list *also* revoked users.
+    if revoked is given will list *also* revoked users, only_revoked lists only them.
+    role and callsign_prefix (case-insensitive) filter the list, extra=false leaves out the extra data.
+
+    If limit or cursor is given returns one page (at most list_max_page_size people) ordered by creation time,
+    pass next_cursor as cursor to get the next one.
+
+    stream=true sends the people as they are read from the DB instead of collecting them first,
+    use it for unpaginated listing of large deployments (next_cursor is not available in this mode).
     """
+    after: Optional[Tuple[datetime.datetime, uuid.UUID]] = None
+    page_size: Optional[int] = None
+    if limit is not None or cursor is not None:
+        page_size = min(limit or RMSettings.singleton().list_max_page_size, RMSettings.singleton().list_max_page_size)
+    if cursor is not None:
+        after = _decode_cursor(cursor)
+    fetch = page_size
+    if page_size is not None and not stream:
+        fetch = page_size + 1  # One extra to tell if there is another page
+
+    people = Person.list_with_roles(
+        include_deleted=revoked,
+        only_deleted=only_revoked,
+        role=role,
+        callsign_prefix=callsign_prefix,
+        after=after,
+        limit=fetch,
+        with_extra=extra,
+    )
+    if stream:
+        return streaming_json_list(
+            "callsign_list",
+            (_list_item(dbperson, roles, extra) async for dbperson, roles in _skip_anon(people)),
+            {"next_cursor": None},
+        )
 
     result_list: List[CallSignPerson] = []
-    async for dbperson in Person.list(include_deleted=revoked):
+    last: Optional[Person] = None
+    count = 0
+    async for dbperson, roles in people:
+        count += 1
+        if page_size is not None and count > page_size:
+            continue  # The extra row only tells there is another page
+        last = dbperson
         if dbperson.callsign == "anon_admin":
             # Skip the "dummy" user for anon_admin
             continue
-        roles = await dbperson.roles_set()
-        revoked_date: Optional[str] = None
-        if dbperson.deleted:
-            revoked_date = dbperson.deleted.isoformat()
-        listitem = CallSignPerson(
-            callsign=dbperson.callsign, roles=list(roles), extra=dbperson.extra, revoked=revoked_date
-        )
-        result_list.append(listitem)
+        result_list.append(_list_item(dbperson, roles, extra))
 
-    return PeopleListOut(callsign_list=result_list)
+    next_cursor: Optional[str] = None
+    if page_size is not None and count > page_size and last is not None:
+        next_cursor = _encode_cursor(last)
+    return PeopleListOut(callsign_list=result_list, next_cursor=next_cursor)
 
 
 @router.get(
@@ -64,12 +150,12 @@ async def request_people_list_onlydeleted() -> PeopleListOut:
     """
 
     result_list: List[CallSignPerson] = []
-    async for dbperson in Person.list(only_deleted=True):
+    async for dbperson, roles in Person.list_with_roles(only_deleted=True):
         if dbperson.callsign == "anon_admin":
             # Skip the "dummy" user for anon_admin, this should never be revoked though...
             continue
         listitem = CallSignPerson(
-            callsign=dbperson.callsign, roles=[], extra=dbperson.extra, revoked=dbperson.deleted.isoformat()
+            callsign=dbperson.callsign, roles=list(roles), extra=dbperson.extra, revoked=dbperson.deleted.isoformat()
         )
         result_list.append(listitem)
 
@@ -90,11 +176,10 @@ async def request_people_list_byrole(role: str) -> PeopleListOut:
     """
 
     result_list: List[CallSignPerson] = []
-    async for dbperson in Person.by_role(role):
+    async for dbperson, roles in Person.list_with_roles(include_deleted=True, role=role):
         if dbperson.callsign == "anon_admin":
             # Skip the "dummy" user for anon_admin
             continue
-        roles = await dbperson.roles_set()
         listitem = CallSignPerson(callsign=dbperson.callsign, roles=list(roles), extra=dbperson.extra, revoked=None)
         result_list.append(listitem)
 
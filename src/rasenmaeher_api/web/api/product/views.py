@@ -1,10 +1,13 @@
 """Product registration API views."""
 
-from typing import cast
+from typing import cast, AsyncGenerator, Dict, Mapping
+import asyncio
 import logging
 
 import aiohttp
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from libadvian.binpackers import ensure_utf8, ensure_str
 from libpvarki.middleware.mtlsheader import MTLSHeader
 from libpvarki.schemas.generic import OperationResultResponse
@@ -23,11 +26,35 @@ from ....cert.backend import get_ca, get_bundle, sign_csr, revoke_pem, CertError
 from ....rmsettings import RMSettings
 from ....kchelpers import KCClient
 from ....productapihelpers import post_to_product
-from ....mtlsinit import get_session_winit
+from ....productclients import ProductClients
 from ..middleware.user import ValidUser
 
 router = APIRouter()
 LOGGER = logging.getLogger(__name__)
+# Proxied bodies are passed on in chunks of at most this size
+PROXY_CHUNK_SIZE = 64 * 1024
+# These describe the upstream connection, not the content, see RFC 9110 section 7.6.1
+HOP_BY_HOP_HEADERS = frozenset(
+    (
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "proxy-connection",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    )
+)
+
+
+def proxy_response_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    """Drop hop-by-hop headers, including the ones named in the Connection header"""
+    drop = set(HOP_BY_HOP_HEADERS)
+    for value in headers.get("Connection", "").split(","):
+        drop.add(value.strip().lower())
+    return {key: value for key, value in headers.items() if key.lower() not in drop}
 
 
 async def csr_common(certs: CertificatesRequest) -> CertificatesResponse:
@@ -176,8 +203,8 @@ async def get_product_proxy(
     tgtproduct: str,
     tgtpath: str,
     request: Request,
-) -> Response:
-    """Proxy request to the product in any path, POSTing the user context"""
+) -> StreamingResponse:
+    """Proxy request to the product in any path, POSTing the user context, the response is streamed back"""
     rmconf = RMSettings.singleton()
     manifest = rmconf.kraftwerk_manifest_dict
     person = cast(Person, request.state.person)
@@ -189,21 +216,54 @@ async def get_product_proxy(
     productconf = manifest["products"][tgtproduct]
     # We do not read the cert for these because it takes time and is not really needed
     user = UserCRUDRequest(uuid=str(person.pk), callsign=person.callsign, x509cert="")
-    session = await get_session_winit()
-    session.headers.update(
-        {
-            "X-Rasenmaeher-Proxy": "productproxy",
-            "X-Proxy-Callsign": person.callsign,
-        }
+    client = await ProductClients.singleton().get(tgtproduct)
+    url = f"{productconf['api']}{tgtpath}"
+    LOGGER.debug("calling POST({})".format(url))
+    # No total timeout so large bodies can take their time, but a stalled upstream still times out
+    timeout = aiohttp.ClientTimeout(
+        total=None, sock_connect=rmconf.integration_api_timeout, sock_read=rmconf.integration_api_timeout * 2
     )
-    async with session as client:
-        url = f"{productconf['api']}{tgtpath}"
-        LOGGER.debug("calling POST({})".format(url))
-        response = await client.post(
-            url, json=user.model_dump(), timeout=aiohttp.ClientTimeout(total=rmconf.integration_api_timeout * 2)
+    try:
+        upstream = await client.post(
+            url,
+            json=user.model_dump(),
+            headers={
+                "X-Rasenmaeher-Proxy": "productproxy",
+                "X-Proxy-Callsign": person.callsign,
+            },
+            timeout=timeout,
+            # Pass the body through as is, Content-Encoding and Content-Length stay valid
+            auto_decompress=False,
         )
-        return Response(
-            status_code=response.status,
-            headers=response.headers,
-            content=await response.read(),
+    except (aiohttp.ClientError, TimeoutError, asyncio.TimeoutError) as exc:
+        LOGGER.error("Failure to call {}: {}".format(url, repr(exc)))
+        raise HTTPException(status_code=502, detail=f"Could not reach {tgtproduct}") from exc
+
+    async def body() -> AsyncGenerator[bytes, None]:
+        """Stream the upstream body, if the client goes away we get cancelled and close the upstream"""
+        complete = False
+        try:
+            async for chunk in upstream.content.iter_chunked(PROXY_CHUNK_SIZE):
+                yield chunk
+            complete = True
+        finally:
+            if complete:
+                # Connection goes back to the pool
+                upstream.release()
+            else:
+                upstream.close()
+
+    async def close_upstream() -> None:
+        """Make sure upstream is closed even if body() never ran, a no-op after release"""
+        upstream.close()
+
+    try:
+        return StreamingResponse(
+            body(),
+            status_code=upstream.status,
+            headers=proxy_response_headers(upstream.headers),
+            background=BackgroundTask(close_upstream),
         )
+    except Exception:
+        upstream.close()
+        raise
@@ -0,0 +1,44 @@
+"""Helpers for streaming large JSON list responses without building the whole list in memory"""
+
+from typing import AsyncIterable, AsyncGenerator, Any, Dict, Optional
+import json
+import logging
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+LOGGER = logging.getLogger(__name__)
+# Collect serialized items up to this many bytes before sending a chunk
+CHUNK_SIZE = 64 * 1024
+
+
+async def json_list_chunks(
+    key: str, items: AsyncIterable[BaseModel], extra: Optional[Dict[str, Any]] = None
+) -> AsyncGenerator[bytes, None]:
+    """Serialize {key: [items...], **extra} incrementally"""
+    buffer = bytearray(b"{" + json.dumps(key).encode("utf-8") + b":[")
+    first = True
+    async for item in items:
+        if not first:
+            buffer += b","
+        first = False
+        buffer += item.model_dump_json().encode("utf-8")
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    for extrakey, value in (extra or {}).items():
+        buffer += b"," + json.dumps(extrakey).encode("utf-8") + b":" + json.dumps(value).encode("utf-8")
+    buffer += b"}"
+    yield bytes(buffer)
+
+
+def streaming_json_list(
+    key: str, items: AsyncIterable[BaseModel], extra: Optional[Dict[str, Any]] = None
+) -> StreamingResponse:
+    """Response that streams {key: [items...], **extra}
+
+    The status is sent before the first item so errors while iterating can only cut the response short,
+    the DB connection behind items is held until the client has read everything.
+    """
+    return StreamingResponse(json_list_chunks(key, items, extra), media_type="application/json")
@@ -1,15 +1,17 @@
 """Utils API views."""
 
+from typing import Optional
 import logging
+import email.utils
 
-from fastapi import APIRouter, Depends, Response
+from fastapi import APIRouter, Depends, Request, Response
 from fastapi.responses import FileResponse
 from libpvarki.middleware.mtlsheader import MTLSHeader
 
 
 from .schema import LdapConnString
 from ....rmsettings import RMSettings
-from ....cert.backend import get_ocsprest_crl
+from ....cert.crlcache import CRLCache, CachedCRL
 from ....jwtinit import resolve_rm_jwt_pubkey_path
 
 LOGGER = logging.getLogger(__name__)
@@ -45,19 +47,46 @@ async def request_utils_ldap_conn_string() -> LdapConnString:
     )
 
 
+def crl_not_modified(request: Request, entry: CachedCRL) -> bool:
+    """Check the conditional request headers against the cached CRL"""
+    if_none_match: Optional[str] = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or entry.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        return since >= entry.last_modified.replace(microsecond=0)
+    return False
+
+
+async def crl_response(request: Request, suffix: str, media_type: str) -> Response:
+    """Serve the cached CRL, or 304 if the client already has it"""
+    cache = CRLCache.singleton()
+    entry = await cache.get(suffix)
+    headers = cache.headers(entry)
+    if crl_not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.content, media_type=media_type, headers=headers)
+
+
 @router.get("/crl")
 @router.get("/crl/crl.der")
-async def return_crl_der() -> Response:
+async def return_crl_der(request: Request) -> Response:
     """Get the DER CRL from OCSPREST"""
-    crl_der = await get_ocsprest_crl("crl.der")
-    return Response(content=crl_der, media_type="application/pkix-crl")
+    return await crl_response(request, "crl.der", "application/pkix-crl")
 
 
 @router.get("/crl/crl.pem")
-async def return_crl_pem() -> Response:
+async def return_crl_pem(request: Request) -> Response:
     """Get the PEM CRL from OCSPREST"""
-    crl_pem = await get_ocsprest_crl("crl.pem")
-    return Response(content=crl_pem, media_type="application/x-pem-file")
+    return await crl_response(request, "crl.pem", "application/x-pem-file")
 
 
 @router.get("/jwt.pub")
@@ -16,8 +16,16 @@ from ..db.config import DBConfig
 from ..rmsettings import RMSettings
 from .api.router import api_router, api_router_v2
 from ..mtlsinit import mtls_init
+from ..productclients import ProductClients
+from ..healthprober import HealthProber
+from ..cert.crlcache import CRLCache
+from ..keypool import KeypairPool
+from ..pfxbuilder import PFXBuilder
 from ..jwtinit import jwt_init
 from ..db.middleware import DBConnectionMiddleware, DBWrapper
+from ..db.callsignindex import CallsignIndex
+from ..db.changes import ChangeListener
+from ..db.outbox import OutboxDispatcher
 from .. import __version__
 
 LOGGER = logging.getLogger(__name__)
@@ -30,10 +38,18 @@ async def app_lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     LOGGER.debug("DB startup")
     dbwrapper = DBWrapper(config=DBConfig.singleton())
     await dbwrapper.app_startup_event()
+    # Listen first so changes made while we load are not missed
+    ChangeListener.singleton().start()
+    await CallsignIndex.singleton().load()
     _ = app
     LOGGER.debug("JWT and mTLS inits")
     await jwt_init()
     await mtls_init()
+    await ProductClients.singleton().startup()
+    OutboxDispatcher.singleton().start()
+    HealthProber.singleton().start()
+    CRLCache.singleton().start()
+    KeypairPool.singleton().start()
     reporter = asyncio.get_running_loop().create_task(report_to_kraftwerk())
     # App runs
     LOGGER.debug("Yield")
@@ -41,7 +57,14 @@ async def app_lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     # Cleanup
     LOGGER.debug("Cleanup")
     await reporter  # Just to avoid warning about task that was not awaited
+    await ChangeListener.singleton().stop()
+    await OutboxDispatcher.singleton().stop()
+    await HealthProber.singleton().stop()
+    await CRLCache.singleton().stop()
+    await KeypairPool.singleton().stop()
+    await PFXBuilder.singleton().stop()
     await TaskMaster.singleton().stop_lingering_tasks()  # Make sure teasks get finished
+    await ProductClients.singleton().close()
     await dbwrapper.app_shutdown_event()
 
 
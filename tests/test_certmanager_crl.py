@@ -0,0 +1,76 @@
+"""Test the locally signed CRL of the cert-manager backend"""
+
+from pathlib import Path
+import datetime
+import logging
+
+import cryptography.x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from rasenmaeher_api.cert.cert_manager.crl import sign_crl, revocations_fingerprint
+from rasenmaeher_api.db.certserials import RevokedSerial
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _create_ca(tmp_path: Path) -> cryptography.x509.Certificate:
+    """Write self-signed CA key and cert to tmp_path"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = cryptography.x509.Name([cryptography.x509.NameAttribute(NameOID.COMMON_NAME, "Test CRL CA")])
+    now = datetime.datetime.now(datetime.UTC)
+    cert = (
+        cryptography.x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(cryptography.x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(cryptography.x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    (tmp_path / "crl.key").write_bytes(
+        key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    )
+    (tmp_path / "crl.pem").write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    return cert
+
+
+def test_sign_crl(tmp_path: Path) -> None:
+    """Check the CRL is signed by the CA and has the revocations of that CA"""
+    cacert = _create_ca(tmp_path)
+    issuer = cacert.subject.rfc4514_string()
+    revoked_at = datetime.datetime(2025, 1, 1, tzinfo=datetime.UTC)
+    revoked = [
+        RevokedSerial(serial="1a2b", issuer=issuer, revoked=revoked_at, reason="keyCompromise"),
+        RevokedSerial(serial="3c4d", issuer=issuer, revoked=revoked_at, reason="unspecified"),
+        RevokedSerial(serial="5e6f", issuer="CN=Some other CA", revoked=revoked_at, reason=None),
+    ]
+    der, signed = sign_crl(tmp_path / "crl.key", tmp_path / "crl.pem", revoked, datetime.timedelta(hours=1))
+    crl = cryptography.x509.load_der_x509_crl(der)
+    assert crl.is_signature_valid(cacert.public_key())  # type: ignore[arg-type]
+    assert crl.issuer == cacert.subject
+    assert crl.last_update_utc == signed
+    assert crl.next_update_utc == signed + datetime.timedelta(hours=1)
+    assert len(crl) == 2
+    compromised = crl.get_revoked_certificate_by_serial_number(0x1A2B)
+    assert compromised
+    assert compromised.revocation_date_utc == revoked_at
+    reason = compromised.extensions.get_extension_for_class(cryptography.x509.CRLReason).value
+    assert reason.reason == cryptography.x509.ReasonFlags.key_compromise
+    unspecified = crl.get_revoked_certificate_by_serial_number(0x3C4D)
+    assert unspecified
+    assert not list(unspecified.extensions)
+    assert crl.get_revoked_certificate_by_serial_number(0x5E6F) is None
+
+
+def test_revocations_fingerprint() -> None:
+    """Check the fingerprint changes with the revocations"""
+    revoked_at = datetime.datetime(2025, 1, 1, tzinfo=datetime.UTC)
+    first = [RevokedSerial(serial="1a2b", issuer="CN=CA", revoked=revoked_at, reason="keyCompromise")]
+    second = first + [RevokedSerial(serial="3c4d", issuer="CN=CA", revoked=revoked_at, reason=None)]
+    assert revocations_fingerprint(first) == revocations_fingerprint(list(first))
+    assert revocations_fingerprint(first) != revocations_fingerprint(second)
+    assert revocations_fingerprint([]) != revocations_fingerprint(first)
@@ -1,15 +1,27 @@
 """Test CFSSL wrappers"""
 
+import asyncio
 import logging
+import os
 import uuid
+from pathlib import Path
 
 import pytest
 import cryptography.x509
+from cryptography.hazmat.primitives import serialization
 import pytest_asyncio
 from async_asgi_testclient import TestClient  # type: ignore[import-untyped]
+from libpvarki.mtlshelp.csr import async_create_keypair, async_create_client_csr
 
-from rasenmaeher_api.cert.backend import get_ca, get_crl, validate_reason
+from rasenmaeher_api.cert.backend import get_ca, get_crl, get_bundle, sign_csr, validate_reason
+from rasenmaeher_api.cert.cfssl.public import CFSSLCAChain, fetch_bundle
 from rasenmaeher_api.db import Person
+from rasenmaeher_api.mtlsinit import MTLSIdentity
+from rasenmaeher_api.cert.cfssl.ocsprefresh import OCSPRefresher
+from rasenmaeher_api.cert.cfssl.signqueue import SignQueue
+from rasenmaeher_api.cert.crlcache import CRLCache
+from rasenmaeher_api.cert.errors import DBLocked
+from rasenmaeher_api.rmsettings import RMSettings
 
 LOGGER = logging.getLogger(__name__)
 
@@ -21,6 +33,95 @@ async def test_get_ca() -> None:
     assert capem.startswith("-----BEGIN CERTIFICATE-----")
 
 
+@pytest.mark.asyncio(loop_scope="session")
+async def test_ca_cached() -> None:
+    """Test the CA chain is cached and reloaded when the CA certs change"""
+    cache = CFSSLCAChain.singleton()
+    capem = await get_ca()
+    fetched = cache.fetched
+    assert await get_ca() == capem
+    assert cache.fetched == fetched
+    capath = cache.watch_path()
+    assert capath
+    marker = capath / "cachetest.txt"
+    marker.write_text("touched", encoding="utf-8")
+    try:
+        assert await get_ca() == capem
+        assert cache.fetched > fetched
+    finally:
+        marker.unlink()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_bundle_local(nice_tmpdir: str) -> None:
+    """Test the locally built bundle has the same certs as the one from CFSSL and no duplicates"""
+    tempdir = Path(nice_tmpdir)
+    ckp = await async_create_keypair(tempdir / "bundle.key", tempdir / "bundle.pub")
+    csrpem = await async_create_client_csr(ckp, tempdir / "bundle.csr", {"CN": "bundletest"})
+    # sign_csr returns the cert with its chain
+    signed = (await sign_csr(csrpem)).replace("\\n", "\n")
+    signed_certs = cryptography.x509.load_pem_x509_certificates(signed.encode("utf-8"))
+    assert len(signed_certs) > 1
+    certpem = signed_certs[0].public_bytes(serialization.Encoding.PEM).decode("utf-8")
+    local = await get_bundle(signed)
+    assert local.startswith(certpem)
+    local_certs = cryptography.x509.load_pem_x509_certificates(local.encode("utf-8"))
+    assert len(set(local_certs)) == len(local_certs)
+    assert await get_bundle(certpem) == local
+    remote = await fetch_bundle(certpem)
+    assert local_certs == cryptography.x509.load_pem_x509_certificates(remote.encode("utf-8"))
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_mtls_identity_reload() -> None:
+    """Test the mTLS client context is loaded once and reloaded in place when the cert changes"""
+    identity = MTLSIdentity.singleton()
+    ctx = await identity.get_context()
+    mtime = identity.cert_mtime
+    assert mtime is not None
+    assert await identity.get_context() is ctx
+    assert identity.cert_mtime == mtime
+    assert RMSettings.singleton().mtls_client_cert_path
+    cert_path = Path(RMSettings.singleton().mtls_client_cert_path)
+    os.utime(cert_path, ns=(mtime + 1_000_000_000, mtime + 1_000_000_000))
+    assert await identity.get_context() is ctx  # Not checked yet
+    assert identity.cert_mtime == mtime
+    identity.invalidate()
+    assert await identity.get_context() is ctx
+    assert identity.cert_mtime == mtime + 1_000_000_000
+    # The reloaded context still works
+    capem = await get_ca()
+    assert capem.startswith("-----BEGIN CERTIFICATE-----")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_ocsp_refresh_coalesced(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a burst of refresh requests results in few actual refreshes"""
+    refresher = OCSPRefresher(window=0.2)
+    calls = 0
+
+    async def counting_refresh() -> None:
+        """Count the calls"""
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(refresher, "_refresh", counting_refresh)
+    generations = await asyncio.gather(*(refresher.refresh() for _ in range(50)))
+    assert calls <= 2
+    assert refresher.completed >= max(generations)
+    # A request after the burst gets its own refresh
+    await refresher.refresh()
+    assert refresher.completed == refresher.requested
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_ocsp_refresh() -> None:
+    """Test the actual refresh call"""
+    generation = await OCSPRefresher.singleton().refresh()
+    assert OCSPRefresher.singleton().completed >= generation
+
+
 @pytest_asyncio.fixture(scope="function")
 async def one_revoked_cert(ginosession: None) -> None:
     """Make sure we have at least one revoked cert"""
@@ -75,3 +176,80 @@ async def test_crl_pem_route(unauth_client_session: TestClient, one_revoked_cert
     resp.raise_for_status()
     crl = cryptography.x509.load_pem_x509_crl(resp.content)
     assert crl
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_crl_conditional_get(unauth_client_session: TestClient, one_revoked_cert: None) -> None:
+    """Check the CRL is served with caching headers and conditional requests get 304"""
+    _ = one_revoked_cert
+    client = unauth_client_session
+    resp = await client.get("/api/v1/utils/crl/crl.pem")
+    resp.raise_for_status()
+    etag = resp.headers["etag"]
+    assert resp.headers["last-modified"]
+    assert resp.headers["cache-control"].startswith("public, max-age=")
+    resp = await client.get("/api/v1/utils/crl/crl.pem", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert not resp.content
+    assert resp.headers["etag"] == etag
+    resp = await client.get("/api/v1/utils/crl/crl.pem", headers={"If-Modified-Since": resp.headers["last-modified"]})
+    assert resp.status_code == 304
+    resp = await client.get("/api/v1/utils/crl/crl.pem", headers={"If-None-Match": '"nosuchtag"'})
+    assert resp.status_code == 200
+    assert resp.content
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_crl_cache_serves_stale(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check the old CRL is served when reloading fails with an unexpected error"""
+    cache = CRLCache(max_age=0.0)
+    old = await cache.get("crl.der")
+
+    async def broken(suffix: str) -> bytes:
+        """Fail like a DB error would"""
+        raise RuntimeError(f"simulated failure for {suffix}")
+
+    monkeypatch.setattr("rasenmaeher_api.cert.backend.get_ocsprest_crl", broken)
+    assert await cache.get("crl.der") is old
+    with pytest.raises(RuntimeError):
+        await cache.get("crl.pem")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_sign_queue_retries() -> None:
+    """Check DBLocked is retried, concurrency is limited and attempts are capped"""
+    queue = SignQueue(concurrency=2, retry_base=0.01, retry_max=0.02, max_attempts=3)
+    in_flight = 0
+    max_in_flight = 0
+    locks_left = 2
+
+    async def locked_twice() -> str:
+        """Fail with DBLocked on the first two calls"""
+        nonlocal in_flight, max_in_flight, locks_left
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if locks_left > 0:
+                locks_left -= 1
+                raise DBLocked("locked")
+            return "ok"
+        finally:
+            in_flight -= 1
+
+    results = await asyncio.gather(*(queue.call("test", locked_twice) for _ in range(5)))
+    assert results == ["ok"] * 5
+    assert max_in_flight <= 2
+    assert queue.retries == 2
+    assert queue.completed == 5
+    assert queue.depth == 0
+
+    async def always_locked() -> str:
+        """Never succeeds"""
+        raise DBLocked("locked")
+
+    with pytest.raises(DBLocked):
+        await queue.call("test", always_locked)
+    assert queue.failed == 1
+    assert queue.retries == 4
+    assert queue.depth == 0
@@ -0,0 +1,136 @@
+"""Test the shared CertificateRequest watch against a fake Kubernetes API server"""
+
+from typing import Any, Dict, Generator, List, Optional
+import asyncio
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from cloudcoil.client import Config
+
+from rasenmaeher_api.cert.cert_manager.crwatch import CertificateRequestWatcher
+from rasenmaeher_api.cert.errors import CertError
+
+LOGGER = logging.getLogger(__name__)
+NAMESPACE = "rmtest"
+CRS_PATH = f"/apis/cert-manager.io/v1/namespaces/{NAMESPACE}/certificaterequests"
+DISCOVERY: Dict[str, Any] = {
+    "/version": {"major": "1", "minor": "29"},
+    "/api": {"versions": []},
+    "/apis": {"groups": [{"name": "cert-manager.io", "versions": [{"version": "v1"}]}]},
+    "/apis/cert-manager.io/v1": {
+        "resources": [
+            {"name": "certificaterequests", "kind": "CertificateRequest", "namespaced": True},
+            {"name": "certificaterequests/status", "kind": "CertificateRequest", "namespaced": True},
+        ]
+    },
+}
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """Serves API discovery and streams queued watch events"""
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FakeAPIHandler)
+        self.events: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self.watches = 0
+
+    @property
+    def url(self) -> str:
+        """Base URL"""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def send_event(self, event: str, name: str, status: Optional[Dict[str, Any]] = None) -> None:
+        """Queue a watch event for CR with given name"""
+        obj: Dict[str, Any] = {
+            "apiVersion": "cert-manager.io/v1",
+            "kind": "CertificateRequest",
+            "metadata": {"name": name, "namespace": NAMESPACE, "resourceVersion": str(self.events.qsize() + 1)},
+            "spec": {"request": "Zm9v", "issuerRef": {"name": "test-issuer"}},
+        }
+        if status is not None:
+            obj["status"] = status
+        self.events.put({"type": event, "object": obj})
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """Just enough of the Kubernetes API"""
+
+    server: FakeAPIServer
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Discovery or watch"""
+        url = urlparse(self.path)
+        if url.path == CRS_PATH and parse_qs(url.query).get("watch") == ["true"]:
+            self.server.watches += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            while (event := self.server.events.get()) is not None:
+                self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            return
+        if url.path not in DISCOVERY:
+            self.send_error(404)
+            return
+        body = json.dumps(DISCOVERY[url.path]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        """Log via logging"""
+        LOGGER.debug(format, *args)
+
+
+@pytest.fixture
+def fake_api(monkeypatch: pytest.MonkeyPatch) -> Generator[FakeAPIServer, None, None]:
+    """Fake API server in a thread (cloudcoil does the discovery with a sync client)"""
+    monkeypatch.delenv("KUBECONFIG", raising=False)
+    server = FakeAPIServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.events.put(None)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_shared_watch(fake_api: FakeAPIServer) -> None:
+    """Check one watch serves all the waiters and failures are reported"""
+    async with Config(server=fake_api.url, token="test", namespace=NAMESPACE):
+        watcher = CertificateRequestWatcher(namespace=NAMESPACE)
+        # Completed before we started watching, the initial ADDED events cover it
+        fake_api.send_event("ADDED", "cr-done", {"certificate": "DONECERT"})
+        done = watcher.expect("cr-done")
+        pending: List["asyncio.Future[str]"] = [watcher.expect("cr-pending") for _ in range(5)]
+        denied = watcher.expect("cr-denied")
+        try:
+            assert await watcher.wait("cr-done", done, timeout=5.0) == "DONECERT"
+            fake_api.send_event("ADDED", "cr-pending")
+            fake_api.send_event("MODIFIED", "cr-pending", {"conditions": [{"type": "Ready", "status": "False"}]})
+            fake_api.send_event("MODIFIED", "cr-pending", {"certificate": "PENDINGCERT"})
+            results = await asyncio.gather(*(watcher.wait("cr-pending", future, timeout=5.0) for future in pending))
+            assert results == ["PENDINGCERT"] * 5
+            fake_api.send_event(
+                "MODIFIED",
+                "cr-denied",
+                {"conditions": [{"type": "Denied", "status": "True", "reason": "Denied", "message": "nope"}]},
+            )
+            with pytest.raises(CertError):
+                await watcher.wait("cr-denied", denied, timeout=5.0)
+            with pytest.raises(CertError):
+                await watcher.wait("cr-never", watcher.expect("cr-never"), timeout=0.2)
+            assert fake_api.watches == 1
+            assert not watcher._waiters  # pylint: disable=protected-access
+        finally:
+            await watcher.stop()
@@ -1,11 +1,16 @@
 """DB specific tests"""
 
+from typing import Any, List, Optional
 import asyncio
+import datetime
 import logging
 import uuid
 from pathlib import Path
 
+import asyncpg  # type: ignore[import-untyped]
 import pytest
+import sqlalchemy as sa
+from sqlmodel import select, func, col
 from flaky import flaky  # type: ignore[import-untyped]
 from libadvian.binpackers import uuid_to_b64
 from multikeyjwt import Verifier
@@ -22,6 +27,16 @@ from rasenmaeher_api.db import (
     LoginCode,
     EngineWrapper,
 )
+from rasenmaeher_api.db.callsignindex import CallsignIndex
+from rasenmaeher_api.db.principalcache import PrincipalCache, detached_copy
+from rasenmaeher_api.db.changes import ChangeListener, ChangeEvent, ChangeKind, publish_change
+from rasenmaeher_api.db.outbox import (
+    OutboxDispatcher,
+    OutboxMessage,
+    OutboxEvent,
+    KEYCLOAK_TARGET,
+    add_notifications,
+)
 from rasenmaeher_api.db.errors import (
     NotFound,
     Deleted,
@@ -33,6 +48,7 @@ from rasenmaeher_api.db.errors import (
 )
 from rasenmaeher_api.jwtinit import jwt_init
 from rasenmaeher_api.mtlsinit import mtls_init
+from rasenmaeher_api.pfxbuilder import PFXBuilder
 from rasenmaeher_api.rmsettings import switchme_to_singleton_call, RMSettings
 from rasenmaeher_api.cert.backend import get_crl
 
@@ -56,6 +72,17 @@ def test_dbconfig_env(monkeypatch: pytest.MonkeyPatch) -> None:
         assert config.dsn
 
 
+def test_dbconfig_async_dsn(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the async DSN uses the async driver and plain str password"""
+    passwd = str(uuid.uuid4())
+    with monkeypatch.context() as mpatch:
+        mpatch.setenv("RM_DATABASE_PASSWORD", passwd)
+        config = DBConfig()
+        assert config.async_dsn.drivername == "postgresql+asyncpg"
+        assert config.async_dsn.password == passwd
+        assert config.async_dsn.host == config.host
+
+
 def test_dbconfig_defaults(docker_ip: str) -> None:
     """Check that the fixture set port and host correctly"""
     config = DBConfig()
@@ -63,6 +90,19 @@ def test_dbconfig_defaults(docker_ip: str) -> None:
     assert config.host == docker_ip
 
 
+@pytest.mark.asyncio(loop_scope="session")
+async def test_pool_stats(ginosession: None) -> None:
+    """Check the pool is sized from config and stats are counted"""
+    _ = ginosession
+    wrapper = EngineWrapper.singleton()
+    await Person.is_callsign_available("nosuchuser")
+    stats = wrapper.pool_stats()
+    LOGGER.debug("stats={}".format(stats))
+    assert stats["size"] == wrapper.config.pool_min_size
+    assert stats["size"] + stats["max_overflow"] == wrapper.config.pool_max_size
+    assert stats["checkouts"] > 0
+
+
 @pytest.mark.asyncio(loop_scope="session")
 async def test_person_crud(ginosession: None) -> None:
     """Test the db abstraction of persons and roles"""
@@ -129,6 +169,46 @@ async def test_person_crud(ginosession: None) -> None:
     assert "DOGGO01a" in callsigns
     assert "DOGGO01b" in callsigns
 
+    await person.assign_role("fleetcommander")
+    await person.assign_role("admin")
+    with_roles = {user.callsign: roles async for user, roles in Person.list_with_roles()}
+    assert with_roles["DOGGO01b"] == {"fleetcommander", "admin"}
+    assert "DOGGO01a" not in with_roles
+    deleted = {user.callsign: roles async for user, roles in Person.list_with_roles(only_deleted=True)}
+    assert deleted["DOGGO01a"] == set()
+    assert "DOGGO01b" not in deleted
+    by_role = {user.callsign: roles async for user, roles in Person.list_with_roles(role="fleetcommander")}
+    assert by_role == {"DOGGO01b": {"fleetcommander", "admin"}}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_person_list_pages(ginosession: None) -> None:
+    """Test keyset pagination and filters of the people listing"""
+    _ = ginosession
+    with EngineWrapper.singleton().get_session() as session:
+        for idx in range(5):
+            session.add(Person(callsign=f"PAGER{idx:02d}a", certspath=str(uuid.uuid4())))
+        session.commit()
+
+    seen = []
+    after = None
+    while True:
+        page = [
+            person
+            async for person, _roles in Person.list_with_roles(
+                callsign_prefix="pager", after=after, limit=2, with_extra=False
+            )
+        ]
+        if not page:
+            break
+        assert len(page) <= 2
+        seen += [person.callsign for person in page]
+        after = (page[-1].created, page[-1].pk)
+    assert sorted(seen) == [f"PAGER{idx:02d}a" for idx in range(5)]
+    assert len(set(seen)) == len(seen)
+    # Wildcards in the prefix are literal
+    assert not [person async for person, _roles in Person.list_with_roles(callsign_prefix="pager%1")]
+
 
 @pytest.mark.asyncio(loop_scope="session")
 async def test_enrollments_crud(ginosession: None) -> None:
@@ -361,6 +441,244 @@ async def test_person_with_cert(ginosession: None) -> None:
     assert refresh.revoke_reason
 
 
+@flaky(max_runs=3, min_passes=1)
+@pytest.mark.asyncio(loop_scope="session")
+async def test_callsign_index(ginosession: None) -> None:
+    """Check the callsign index follows creates and revokes"""
+    _ = ginosession
+    await mtls_init()
+    index = CallsignIndex.singleton()
+    await index.load()
+    assert index.lookup(RMSettings.singleton().mtls_client_cert_cn)
+    assert not index.lookup("INDEXED01a")
+    person = await Person.create_with_cert("INDEXED01a")
+    assert index.lookup("indexed01A")
+    assert await index.is_valid("INDEXED01a")
+    await person.revoke("key_compromise")
+    assert not index.lookup("INDEXED01a")
+    assert not await index.is_valid("INDEXED01a")
+    await index.load()
+    assert not index.lookup("INDEXED01a")
+    # Misses are answered from the index, not the DB
+    other = await Person.create_with_cert("INDEXED02a")
+    index.discard(other.callsign)
+    assert not await index.is_valid("INDEXED02a")
+    await index.load()
+    assert await index.is_valid("INDEXED02a")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_principal_cache(ginosession: None) -> None:
+    """Check the principal cache is dropped on role changes and revoke"""
+    _ = ginosession
+    await mtls_init()
+    cache = PrincipalCache.singleton()
+    person = await Person.create_with_cert("PRINCIPAL01a")
+    principal = await cache.lookup("principal01A")
+    assert principal.person.pk == person.pk
+    assert not principal.roles
+    assert cache.get("PRINCIPAL01a") is principal
+    # Copies can be changed without touching the shared cached instance
+    copied = detached_copy(principal.person)
+    copied.extra["leaked"] = True
+    assert copied.pk == principal.person.pk
+    assert "leaked" not in (await cache.lookup("PRINCIPAL01a")).person.extra
+    # KC data updates in other workers drop the entry
+    cache.handle_change(ChangeEvent(kind=ChangeKind.PERSON_UPDATED, data={"callsign": "PRINCIPAL01a"}))
+    assert cache.get("PRINCIPAL01a") is None
+    await person.assign_role("admin")
+    assert cache.get("PRINCIPAL01a") is None
+    principal = await cache.lookup("PRINCIPAL01a")
+    assert principal.roles == {"admin"}
+    await person.remove_role("admin")
+    assert not (await cache.lookup("PRINCIPAL01a")).roles
+    await person.revoke("key_compromise")
+    assert cache.get("PRINCIPAL01a") is None
+    with pytest.raises(Deleted):
+        await cache.lookup("PRINCIPAL01a")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_change_listener(ginosession: None) -> None:
+    """Check changes from other workers reach the callsign index"""
+    _ = ginosession
+    index = CallsignIndex.singleton()
+    await index.load()
+    listener = ChangeListener.singleton()
+    listener.start()
+
+    async def wait_for_connected() -> None:
+        """wait for the listener to connect"""
+        while not listener.connected:
+            await asyncio.sleep(0.1)
+
+    await asyncio.wait_for(wait_for_connected(), timeout=5.0)
+    remote = ChangeEvent(kind=ChangeKind.PERSON_CREATED, data={"callsign": "REMOTE01a"}, origin="otherworker")
+    async with EngineWrapper.get_async_session() as session:
+        await session.exec(select(func.pg_notify(DBConfig.singleton().notify_channel, remote.to_json())))
+        await session.commit()
+
+    async def wait_for_index() -> None:
+        """wait for the event to be dispatched"""
+        while not index.lookup("REMOTE01a"):
+            await asyncio.sleep(0.1)
+
+    await asyncio.wait_for(wait_for_index(), timeout=5.0)
+    # Our own events are skipped, they're already applied locally
+    index.discard("REMOTE01a")
+    await publish_change(ChangeKind.PERSON_CREATED, callsign="REMOTE01a")
+    await asyncio.sleep(0.5)
+    assert not index.lookup("REMOTE01a")
+    await listener.stop()
+    assert not listener.connected
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_change_listener_survives_errors(ginosession: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check a failure after connecting does not end the listener"""
+    _ = ginosession
+    listener = ChangeListener(config=DBConfig(retry_interval=0))
+    original = asyncpg.Connection.add_listener
+    failures: List[str] = []
+
+    async def failing_add_listener(self: asyncpg.Connection, channel: str, callback: Any) -> None:
+        """Fail the first time"""
+        if not failures:
+            failures.append(channel)
+            raise RuntimeError("simulated failure")
+        await original(self, channel, callback)
+
+    monkeypatch.setattr(asyncpg.Connection, "add_listener", failing_add_listener)
+    task = asyncio.create_task(listener.run())
+    try:
+
+        async def wait_for_connected() -> None:
+            """wait for the listener to connect"""
+            while not listener.connected:
+                await asyncio.sleep(0.1)
+
+        await asyncio.wait_for(wait_for_connected(), timeout=5.0)
+        assert failures
+    finally:
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    assert not listener.connected
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_outbox_dispatch(ginosession: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check outbox messages are retried and delivered in order"""
+    _ = ginosession
+    person = Person(callsign="OUTBOX01a", certspath=str(uuid.uuid4()))
+    async with EngineWrapper.get_async_session() as session:
+        session.add(person)
+        await session.commit()
+        await session.refresh(person)
+        await add_notifications(session, person, OutboxEvent.CREATED, targets=["fakeproduct"])
+        await add_notifications(session, person, OutboxEvent.REVOKED, targets=["fakeproduct"])
+        await session.commit()
+
+    dispatcher = OutboxDispatcher(retry_base=0.0)
+    delivered: List[str] = []
+    failures = [OutboxEvent.CREATED.value]
+
+    async def fake_deliver(message: OutboxMessage) -> Optional[str]:
+        """Fail the first created, record the rest"""
+        if message.user != person.pk:
+            return None
+        if message.event in failures:
+            failures.remove(message.event)
+            return "simulated failure"
+        delivered.append(message.event)
+        return None
+
+    monkeypatch.setattr(dispatcher, "deliver", fake_deliver)
+    for _round in range(10):
+        if len(delivered) == 2:
+            break
+        await dispatcher.dispatch_batch()
+    assert delivered == [OutboxEvent.CREATED.value, OutboxEvent.REVOKED.value]
+
+    async with EngineWrapper.get_async_session() as session:
+        statement = select(OutboxMessage).where(OutboxMessage.user == person.pk).order_by(OutboxMessage.pk)
+        messages = (await session.exec(statement)).all()
+    assert [message.attempts for message in messages] == [2, 1]
+    assert all(message.delivered for message in messages)
+    assert messages[0].idempotency_key != messages[1].idempotency_key
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_outbox_keycloak_first(ginosession: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check product messages wait for the users Keycloak message"""
+    _ = ginosession
+    person = Person(callsign="OUTBOX02a", certspath=str(uuid.uuid4()))
+    async with EngineWrapper.get_async_session() as session:
+        session.add(person)
+        await session.commit()
+        await session.refresh(person)
+        await add_notifications(session, person, OutboxEvent.PROMOTED, targets=[KEYCLOAK_TARGET, "fakeproduct"])
+        await session.commit()
+
+    dispatcher = OutboxDispatcher(retry_base=0.0)
+    delivered: List[str] = []
+    failures = [KEYCLOAK_TARGET]
+
+    async def fake_deliver(message: OutboxMessage) -> Optional[str]:
+        """Fail the first KC delivery, record the rest"""
+        if message.user != person.pk:
+            return None
+        if message.target in failures:
+            failures.remove(message.target)
+            return "simulated failure"
+        delivered.append(message.target)
+        return None
+
+    monkeypatch.setattr(dispatcher, "deliver", fake_deliver)
+    await dispatcher.dispatch_batch()
+    assert not delivered
+    for _round in range(10):
+        if len(delivered) == 2:
+            break
+        await dispatcher.dispatch_batch()
+    assert delivered == [KEYCLOAK_TARGET, "fakeproduct"]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_outbox_prune(ginosession: None) -> None:
+    """Check finished messages are deleted after retention and pending ones are kept"""
+    _ = ginosession
+    person = Person(callsign="OUTBOX03a", certspath=str(uuid.uuid4()))
+    async with EngineWrapper.get_async_session() as session:
+        session.add(person)
+        await session.commit()
+        await session.refresh(person)
+        await add_notifications(session, person, OutboxEvent.CREATED, targets=["delivered", "failed", "pending"])
+        await session.commit()
+        await session.exec(
+            sa.update(OutboxMessage)
+            .where(col(OutboxMessage.user) == person.pk, col(OutboxMessage.target) == "delivered")
+            .values(delivered=func.now() - datetime.timedelta(hours=2))
+        )
+        await session.exec(
+            sa.update(OutboxMessage)
+            .where(col(OutboxMessage.user) == person.pk, col(OutboxMessage.target) == "failed")
+            .values(failed=func.now() - datetime.timedelta(hours=2))
+        )
+        await session.commit()
+
+    async def targets() -> List[str]:
+        """Targets of the persons messages still in the outbox"""
+        async with EngineWrapper.get_async_session() as session:
+            statement = select(OutboxMessage).where(OutboxMessage.user == person.pk).order_by(OutboxMessage.pk)
+            return [message.target for message in (await session.exec(statement)).all()]
+
+    await OutboxDispatcher(retention=3 * 3600.0).prune()
+    assert await targets() == ["delivered", "failed", "pending"]
+    assert await OutboxDispatcher(retention=3600.0).prune() >= 2
+    assert await targets() == ["pending"]
+
+
 @pytest.mark.xfail(reason="monkeypatching the host does not work as expected")
 @pytest.mark.asyncio(loop_scope="session")
 async def test_person_with_cert_cfsslfail(ginosession: None, monkeypatch: pytest.MonkeyPatch) -> None:
@@ -408,16 +726,13 @@ async def test_pfx_parse(ginosession: None) -> None:
     _ = ginosession
     await mtls_init()
     person = await Person.create_with_cert("PFXMAN01a")
-
-    async def wait_for_pfxfile() -> None:
-        """wait for the background task to do it's work"""
-        nonlocal person
-        while not person.pfxfile.exists():
-            await asyncio.sleep(0.5)
-
-    await asyncio.wait_for(wait_for_pfxfile(), timeout=5.0)
-
+    # Built only when requested
+    assert not person.pfxfile.exists()
+    pfxfiles = await asyncio.gather(*(person.create_pfx() for _ in range(3)))
+    assert pfxfiles == [person.pfxfile] * 3
     assert person.pfxfile.exists()
+    assert not PFXBuilder.singleton()._inflight  # pylint: disable=protected-access
+    assert await person.create_pfx() == person.pfxfile
     pfxbytes = person.pfxfile.read_bytes()
     pfxdata = cryptography.hazmat.primitives.serialization.pkcs12.load_pkcs12(pfxbytes, b"PFXMAN01a")
     assert pfxdata.key
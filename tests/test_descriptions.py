@@ -1,10 +1,14 @@
 """Test the descriptions endpoint"""
 
+import asyncio
 import logging
 
 import pytest
 from async_asgi_testclient import TestClient  # type: ignore[import-untyped]
 
+from rasenmaeher_api.productcache import ProductResponseCache
+from rasenmaeher_api.web.api.product.views import proxy_response_headers
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -44,13 +48,56 @@ async def test_product_instructions(user_mtls_client: TestClient, lang: str) ->
     assert payload["callsign"]
 
 
-@pytest.mark.asyncio
 @pytest.mark.asyncio(loop_scope="session")
 async def test_proxy(user_mtls_client: TestClient) -> None:
     """Test requesting interop with product 'fake' with product that is not valid"""
     client = user_mtls_client
     resp = await client.get("/api/v1/product/proxy/fake/api/v1/healthcheck")
     assert resp.status_code == 200
+    assert resp.json()["healthy"]
+    assert "transfer-encoding" not in {key.lower() for key in resp.headers.keys()}
+
+
+def test_proxy_response_headers() -> None:
+    """Make sure hop-by-hop headers are not passed on"""
+    headers = proxy_response_headers(
+        {
+            "Content-Type": "application/json",
+            "Connection": "keep-alive, X-Hop",
+            "Keep-Alive": "timeout=5",
+            "Transfer-Encoding": "chunked",
+            "X-Hop": "yes",
+            "X-Other": "yes",
+        }
+    )
+    assert headers == {"Content-Type": "application/json", "X-Other": "yes"}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_product_description_cached(unauth_client: TestClient) -> None:
+    """Make sure repeated requests are served from the cache and stale entries get refreshed"""
+    cache = ProductResponseCache.singleton()
+    cache.clear()
+    resp = await unauth_client.get("/api/v2/descriptions/fake/fi")
+    assert resp.status_code == 200
+    key = ("fake", "api/v2/description/fi", "fi")
+    entry = cache.entries[key]
+    resp = await unauth_client.get("/api/v2/descriptions/fake/fi")
+    assert resp.status_code == 200
+    assert cache.entries[key] is entry
+
+    # Stale entry is served and refreshed in the background
+    entry.fetched -= cache.ttl + 1.0
+    resp = await unauth_client.get("/api/v2/descriptions/fake/fi")
+    assert resp.status_code == 200
+    assert resp.json()["shortname"]
+
+    async def wait_for_refresh() -> None:
+        """wait for the new entry"""
+        while cache.entries[key] is entry:
+            await asyncio.sleep(0.1)
+
+    await asyncio.wait_for(wait_for_refresh(), timeout=5.0)
 
 
 @pytest.mark.parametrize("lang", ["fi", "en"])
@@ -108,6 +155,19 @@ async def test_product_instructions_v2(user_mtls_client: TestClient) -> None:
     assert "data:application/zip;base64," in payload["data"]["tak_zips"][0]["data"]
 
 
+@pytest.mark.asyncio(loop_scope="session")
+async def test_all_products_data_v2(user_mtls_client: TestClient) -> None:
+    """Make sure we get data from all products in one go and failures are reported per product"""
+    resp = await user_mtls_client.get("/api/v2/instructions/data")
+    assert resp.status_code == 200
+    payload = resp.json()
+    LOGGER.debug(payload)
+    assert payload["products"]["fake"]["data"]["tak_zips"][0]["title"] == "atak.zip"
+    assert payload["products"]["nonexistent"] is None
+    assert "nonexistent" in payload["errors"]
+    assert "fake" not in payload["errors"]
+
+
 @pytest.mark.parametrize("lang", ["fi", "en"])
 @pytest.mark.asyncio(loop_scope="session")
 async def test_description_list_v2_admin(user_mtls_admin_client: TestClient, lang: str) -> None:
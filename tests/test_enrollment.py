@@ -224,6 +224,24 @@ async def test_list_as_adm(tilauspalvelu_jwt_admin_client: TestClient) -> None:
     assert resp.status_code == 200
 
 
+@pytest.mark.asyncio(loop_scope="session")
+async def test_list_as_adm_streaming(tilauspalvelu_jwt_admin_client: TestClient) -> None:
+    """
+    Test - streamed list has the same content as the normal one
+    """
+    resp = await tilauspalvelu_jwt_admin_client.get("/api/v1/enrollment/list")
+    resp.raise_for_status()
+    streamed = await tilauspalvelu_jwt_admin_client.get("/api/v1/enrollment/list?stream=true")
+    streamed.raise_for_status()
+    assert streamed.headers["content-type"] == "application/json"
+    assert streamed.json() == resp.json()
+    pools = await tilauspalvelu_jwt_admin_client.get("/api/v1/enrollment/pools")
+    pools.raise_for_status()
+    streamed = await tilauspalvelu_jwt_admin_client.get("/api/v1/enrollment/pools?stream=true")
+    streamed.raise_for_status()
+    assert streamed.json() == pools.json()
+
+
 # LIST AS NORMAL USER
 @pytest.mark.asyncio(loop_scope="session")
 async def test_list_as_usr(tilauspalvelu_jwt_user_client: TestClient) -> None:
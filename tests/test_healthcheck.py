@@ -7,7 +7,8 @@ import pytest
 from async_asgi_testclient import TestClient  # type: ignore[import-untyped]
 
 from rasenmaeher_api import __version__
-from rasenmaeher_api.web.api.healthcheck.schema import AllProductsHealthCheckResponse
+from rasenmaeher_api.web.api.healthcheck.schema import AllProductsHealthCheckResponse, SignQueueState
+from rasenmaeher_api.productapihelpers import CircuitBreaker, BreakerState, ProductBreakers
 
 LOGGER = logging.getLogger(__name__)
 
@@ -42,3 +43,82 @@ async def test_get_healthcheck_services(unauth_client_session: TestClient) -> No
     assert parsed.all_ok is False
     assert parsed.products["fake"] is True
     assert parsed.products["nonexistent"] is False
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_healthcheck_services_circuit(unauth_client_session: TestClient) -> None:
+    """
+    /healthcheck/services
+    Repeated failures to reach nonexistentproduct should open its circuit
+    """
+    parsed = AllProductsHealthCheckResponse(all_ok=True, products={})
+    for _ in range(ProductBreakers.singleton().get("nonexistent").failure_threshold + 1):
+        resp = await unauth_client_session.get("/api/v1/healthcheck/services?fresh=true")
+        assert resp.status_code == 200
+        parsed = AllProductsHealthCheckResponse.parse_obj(resp.json())
+        if parsed.circuits["nonexistent"].state == "open":
+            break
+    assert parsed.circuits["nonexistent"].state == "open"
+    assert parsed.circuits["nonexistent"].retry_in is not None
+    assert parsed.circuits["fake"].state == "closed"
+    assert parsed.products["fake"] is True
+    assert parsed.products["nonexistent"] is False
+    ProductBreakers.singleton().breakers.pop("nonexistent")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_healthcheck_services_snapshot(unauth_client_session: TestClient) -> None:
+    """
+    /healthcheck/services
+    Should serve the latest probe results unless fresh=true is given
+    """
+    resp = await unauth_client_session.get("/api/v1/healthcheck/services")
+    assert resp.status_code == 200
+    first = AllProductsHealthCheckResponse.parse_obj(resp.json())
+    assert first.probes["fake"].healthy is True
+    assert first.probes["fake"].latency >= 0
+    resp = await unauth_client_session.get("/api/v1/healthcheck/services")
+    second = AllProductsHealthCheckResponse.parse_obj(resp.json())
+    assert second.probes["fake"].checked == first.probes["fake"].checked
+    resp = await unauth_client_session.get("/api/v1/healthcheck/services?fresh=true")
+    fresh = AllProductsHealthCheckResponse.parse_obj(resp.json())
+    assert fresh.probes["fake"].checked > first.probes["fake"].checked
+    assert fresh.products["fake"] is True
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_healthcheck_signing(unauth_client_session: TestClient) -> None:
+    """Check the signing queue counters are served"""
+    client = unauth_client_session
+    resp = await client.get("/api/v1/healthcheck/signing")
+    resp.raise_for_status()
+    state = SignQueueState.model_validate(resp.json())
+    assert state.depth >= 0
+    assert state.failed >= 0
+
+
+def test_circuit_breaker_states() -> None:
+    """Check the state transitions"""
+    breaker = CircuitBreaker(name="test", failure_threshold=2, reset_timeout=0.0, half_open_calls=1)
+    assert breaker.allow()
+    breaker.record_failure("nope")
+    assert breaker.state == BreakerState.CLOSED
+    breaker.record_failure("nope")
+    assert breaker.state == BreakerState.OPEN
+    # reset_timeout has passed so one trial call is allowed
+    assert breaker.allow()
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure("still nope")
+    assert breaker.state == BreakerState.OPEN
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.failures == 0
+
+    breaker = CircuitBreaker(name="test", failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure("nope")
+    assert not breaker.allow()
+    assert breaker.retry_in is not None and breaker.retry_in > 0
@@ -1,16 +1,24 @@
 """Test the interop route"""
 
+from typing import Any, List, Mapping, Optional, Type
+import asyncio
 import logging
 
+import pydantic
 import pytest
 from async_asgi_testclient import TestClient  # type: ignore[import-untyped]
+from libpvarki.schemas.generic import OperationResultResponse
 
 from rasenmaeher_api.web.api.product.schema import ProductAddRequest
+from rasenmaeher_api.productclients import ProductClients
+from rasenmaeher_api import productapihelpers
+from rasenmaeher_api.productapihelpers import get_from_product, post_to_product, post_to_all_products, InflightCalls
+from rasenmaeher_api.cert.errors import CertError
 
 LOGGER = logging.getLogger(__name__)
 
 
-@pytest.mark.asyncio
+@pytest.mark.asyncio(loop_scope="session")
 async def test_valid_products(ginosession: None, unauth_client: TestClient) -> None:
     """Test requesting interop with product 'fake'"""
     _ = ginosession
@@ -25,7 +33,7 @@ async def test_valid_products(ginosession: None, unauth_client: TestClient) -> N
     assert resp.status_code == 200
 
 
-@pytest.mark.asyncio
+@pytest.mark.asyncio(loop_scope="session")
 async def test_invalid_requester(ginosession: None, unauth_client: TestClient) -> None:
     """Test requesting interop with product 'fake' with product that is not valid"""
     _ = ginosession
@@ -40,7 +48,7 @@ async def test_invalid_requester(ginosession: None, unauth_client: TestClient) -
     assert resp.status_code == 403
 
 
-@pytest.mark.asyncio
+@pytest.mark.asyncio(loop_scope="session")
 async def test_invalid_tgt(ginosession: None, unauth_client: TestClient) -> None:
     """Test requesting interop with product 'nosuch'"""
     _ = ginosession
@@ -53,3 +61,96 @@ async def test_invalid_tgt(ginosession: None, unauth_client: TestClient) -> None
     payload = req.dict()
     resp = await client.post("/api/v1/product/interop/nosuch", json=payload)
     assert resp.status_code == 404
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_product_session_reused(ginosession: None, unauth_client: TestClient) -> None:
+    """Test that product calls go through the same pooled session"""
+    _ = ginosession
+    client = unauth_client
+    client.headers.update({"X-ClientCert-DN": "CN=interoptest.localmaeher.dev.pvarki.fi,O=N/A"})
+    req = ProductAddRequest(
+        certcn="interoptest.localmaeher.dev.pvarki.fi",
+        x509cert="-----BEGIN CERTIFICATE-----\\nMIIEwjCC...\\n-----END CERTIFICATE-----\\n",
+    )
+    session = await ProductClients.singleton().get("fake")
+    for _ in range(2):
+        resp = await client.post("/api/v1/product/interop/fake", json=req.model_dump())
+        assert resp.status_code == 200
+    assert await ProductClients.singleton().get("fake") is session
+    assert not session.closed
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_product_calls_coalesced(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that identical concurrent calls share one upstream call"""
+    calls: List[str] = []
+
+    async def fake_call(  # pylint: disable=too-many-arguments
+        productname: str,
+        methodname: str,
+        url_suffix: str,
+        data: Optional[Mapping[str, Any]],
+        response_schema: Type[pydantic.BaseModel],
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Optional[pydantic.BaseModel]:
+        """Count the calls"""
+        _ = productname, data, response_schema, headers
+        calls.append(f"{methodname} {url_suffix}")
+        await asyncio.sleep(0.1)
+        return OperationResultResponse(success=True)
+
+    monkeypatch.setattr(productapihelpers, "_call_product", fake_call)
+    results = await asyncio.gather(
+        *(get_from_product("fake", "api/v1/coalesce", OperationResultResponse) for _ in range(5)),
+        post_to_product("fake", "api/v1/coalesce", {"a": 1}, OperationResultResponse, coalesce=True),
+        post_to_product("fake", "api/v1/coalesce", {"a": 1}, OperationResultResponse, coalesce=True),
+        post_to_product("fake", "api/v1/coalesce", {"a": 2}, OperationResultResponse, coalesce=True),
+        # Not coalesced by default, the POST may change something
+        post_to_product("fake", "api/v1/mutate", {"a": 1}, OperationResultResponse),
+        post_to_product("fake", "api/v1/mutate", {"a": 1}, OperationResultResponse),
+    )
+    assert sorted(calls) == [
+        "get api/v1/coalesce",
+        "post api/v1/coalesce",
+        "post api/v1/coalesce",
+        "post api/v1/mutate",
+        "post api/v1/mutate",
+    ]
+    assert all(result is results[0] for result in results[:5])
+    assert results[5] is results[6]
+    assert results[5] is not results[7]
+    assert results[8] is not results[9]
+    assert not InflightCalls.singleton().calls
+    # Done calls are not shared
+    await get_from_product("fake", "api/v1/coalesce", OperationResultResponse)
+    assert len(calls) == 6
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_read_fanout_survives_ocsp_failure(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a failed OCSP refresh fails only the mutating fan-outs"""
+
+    async def failing_refresh() -> None:
+        """Fail like ocsprest being down"""
+        raise CertError("OCSP refresh failed")
+
+    async def fake_call(  # pylint: disable=too-many-arguments
+        productname: str,
+        methodname: str,
+        url_suffix: str,
+        data: Optional[Mapping[str, Any]],
+        response_schema: Type[pydantic.BaseModel],
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Optional[pydantic.BaseModel]:
+        """Answer without calling anything"""
+        _ = productname, methodname, url_suffix, data, response_schema, headers
+        return OperationResultResponse(success=True)
+
+    monkeypatch.setattr(productapihelpers, "refresh_ocsp", failing_refresh)
+    monkeypatch.setattr(productapihelpers, "_call_product", fake_call)
+    responses = await post_to_all_products("api/v1/read", {"a": 1}, OperationResultResponse, coalesce=True)
+    assert responses
+    assert all(response is not None for response in responses.values())
+    with pytest.raises(CertError):
+        await post_to_all_products("api/v1/mutate", {"a": 1}, OperationResultResponse)
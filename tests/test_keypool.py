@@ -0,0 +1,57 @@
+"""Test the pre-generated keypair pool"""
+
+from pathlib import Path
+import logging
+import os
+import time
+
+import pytest
+
+from rasenmaeher_api.keypool import KeypairPool, KEY_MODE, STALE_TMP_AGE
+
+LOGGER = logging.getLogger(__name__)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_keypool_take(tmp_path: Path) -> None:
+    """Check keys are generated to the pool and taking moves them"""
+    pool = KeypairPool(size=2, processes=1)
+    try:
+        await pool.fill()
+        ready = pool.ready()
+        assert len(ready) >= 2
+        assert await pool.fill() == 0
+        privkeypath, pubkeypath = tmp_path / "mtls.key", tmp_path / "mtls.pub"
+        key = await pool.take(privkeypath, pubkeypath)
+        assert key is not None
+        assert privkeypath.exists()
+        assert pubkeypath.exists()
+        assert privkeypath.stat().st_mode & 0o777 == KEY_MODE
+        assert ready[0] not in pool.ready()
+    finally:
+        await pool.stop()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_keypool_disabled(tmp_path: Path) -> None:
+    """Check disabled pool never gives keys"""
+    pool = KeypairPool(size=0)
+    assert await pool.take(tmp_path / "mtls.key", tmp_path / "mtls.pub") is None
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_keypool_counts_other_workers() -> None:
+    """Check pairs being generated by another worker count towards the size"""
+    pool = KeypairPool(size=1, processes=1)
+    pool.size = len(pool.ready()) + 1
+    othertmp = pool.ensure_directory() / "otherworker.key.tmp"
+    othertmp.touch()
+    try:
+        assert pool.generating() == 1
+        assert await pool.fill() == 0
+        stale = time.time() - STALE_TMP_AGE - 1
+        os.utime(othertmp, (stale, stale))
+        assert pool.generating() == 0
+    finally:
+        othertmp.unlink(missing_ok=True)
+        await pool.stop()